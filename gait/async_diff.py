@@ -0,0 +1,375 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
+
+from git import Blob, GitCommandError
+from git.util import hex_to_bin
+from openai import AsyncOpenAI
+
+from .diff import Diff, reviewed_ref
+from .errors import DirtyRepo, InvalidRemote, InvalidTree, IsAncestor, NotAncestor
+
+_NULL_SHA = "0" * 40
+
+
+@dataclass
+class RawDiff:
+    """
+    The diff of a single file parsed from the output of git diff.
+
+    It has the attributes of GitPython's diff.Diff that the patch creation relies on.
+    """
+
+    a_path: Optional[str]
+    b_path: Optional[str]
+    diff: bytes
+    new_file: bool = False
+    deleted_file: bool = False
+    renamed_file: bool = False
+    copied_file: bool = False
+    a_blob: Optional[Blob] = None
+    b_blob: Optional[Blob] = None
+
+
+def _unquote_path(path: str) -> str:
+    "Remove the quotes git puts around paths with special characters."
+    if path.startswith('"') and path.endswith('"'):
+        return path[1:-1].encode("latin-1").decode("unicode_escape").encode("latin-1").decode()
+    return path
+
+
+def _set_blobs(repo, raw_diff: RawDiff, index_line: str) -> None:
+    "Refer to the blobs of an index line such as index <sha>..<sha> 100644."
+    a_sha, b_sha = index_line.split()[1].split("..")
+    if a_sha != _NULL_SHA:
+        raw_diff.a_blob = Blob(repo, hex_to_bin(a_sha), path=raw_diff.a_path)
+    if b_sha != _NULL_SHA:
+        raw_diff.b_blob = Blob(repo, hex_to_bin(b_sha), path=raw_diff.b_path)
+
+
+def _apply_header_line(repo, raw_diff: RawDiff, line: str) -> None:
+    "Set the attributes of a diff from one of its extended header lines."
+    if line.startswith("new file mode"):
+        raw_diff.new_file = True
+    elif line.startswith("deleted file mode"):
+        raw_diff.deleted_file = True
+    elif line.startswith(("rename from ", "copy from ")):
+        raw_diff.a_path = _unquote_path(line.split(" ", 2)[2])
+    elif line.startswith(("rename to ", "copy to ")):
+        raw_diff.b_path = _unquote_path(line.split(" ", 2)[2])
+        raw_diff.renamed_file = line.startswith("rename")
+        raw_diff.copied_file = line.startswith("copy")
+    elif line.startswith("--- a/"):
+        # git ends the paths with spaces with a tab
+        raw_diff.a_path = _unquote_path(line[4:].rstrip("\t"))[2:]
+    elif line.startswith("+++ b/"):
+        raw_diff.b_path = _unquote_path(line[4:].rstrip("\t"))[2:]
+    elif line.startswith("Binary files"):
+        raw_diff.diff = (line + "\n").encode("utf-8")
+    elif line.startswith("index "):
+        _set_blobs(repo, raw_diff, line)
+
+
+def parse_diff_output(repo, output: bytes) -> List[RawDiff]:
+    """
+    Parse the output of git diff --full-index into the diffs of each file.
+
+    Args:
+        repo (Repo): The repository the diff was created in, used to refer to the blobs.
+        output (bytes): Output of git diff.
+
+    Returns:
+        List[RawDiff]: Diffs of each file.
+    """
+    diffs = []
+    for file_output in output.split(b"\ndiff --git "):
+        if not file_output.strip():
+            continue
+        header, separator, body = file_output.partition(b"\n@@")
+        header_lines = header.decode("utf-8").splitlines()
+        if separator:
+            body = b"@@" + body.rstrip(b"\n") + b"\n"
+        raw_diff = RawDiff(a_path=None, b_path=None, diff=body)
+        first = header_lines[0]
+        if first.startswith("diff --git "):
+            first = first[len("diff --git ") :]
+        # Paths without spaces can be read from the first line, the others follow below
+        paths = first.split(" ")
+        if len(paths) == 2:
+            raw_diff.a_path, raw_diff.b_path = (_unquote_path(path)[2:] for path in paths)
+        for line in header_lines[1:]:
+            _apply_header_line(repo, raw_diff, line)
+        if raw_diff.new_file:
+            raw_diff.a_path = raw_diff.a_path or raw_diff.b_path
+        if raw_diff.deleted_file:
+            raw_diff.b_path = raw_diff.b_path or raw_diff.a_path
+        diffs.append(raw_diff)
+    return diffs
+
+
+class AsyncDiff(Diff):
+    """
+    The asyncio counterpart of the Diff class.
+
+    The diff modes run git in asyncio subprocesses and the review streams from AsyncOpenAI, so
+    many repositories and reviews can be handled concurrently on one event loop. The patch is
+    created with the same options as Diff.
+    """
+
+    async def _git(self, *args: str, check: bool = True) -> Tuple[int, bytes]:
+        """
+        Run a git command in the repository.
+
+        Args:
+            *args (str): Arguments of the git command.
+            check (bool, optional): Whether to raise when the command fails. Defaults to True.
+
+        Raises:
+            GitCommandError: When the command fails and check is True.
+
+        Returns:
+            Tuple[int, bytes]: Exit status and output of the command.
+        """
+        command = ["git", "-c", "core.quotePath=false", *args]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=self.repo.working_tree_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if check and process.returncode != 0:
+            raise GitCommandError(command, process.returncode, stderr)
+        return process.returncode, stdout
+
+    async def _diff(self, *args: str) -> List[RawDiff]:
+        start = time.perf_counter()
+        _, output = await self._git(
+            "diff",
+            "--no-ext-diff",
+            "--no-color",
+            "--full-index",
+            f"-U{self.unified}",
+            *self.repo.git.transform_kwargs(**self._rename_options()),
+            *args,
+        )
+        self.diff_seconds = time.perf_counter() - start
+        return parse_diff_output(self.repo, output)
+
+    async def _is_ancestor(self, ancestor_commit: str, commit: str = "HEAD") -> bool:
+        status, _ = await self._git(
+            "merge-base", "--is-ancestor", ancestor_commit, commit, check=False
+        )
+        if status not in (0, 1):
+            raise InvalidTree
+        return status == 0
+
+    async def _fetch_remote(self, remote: str) -> None:
+        try:
+            await self._git("fetch", remote)
+        except GitCommandError as no_remote:
+            raise InvalidRemote from no_remote
+
+    async def _active_branch(self) -> str:
+        _, output = await self._git("symbolic-ref", "--short", "HEAD")
+        return output.decode("utf-8").strip()
+
+    async def add(self) -> "AsyncDiff":
+        """
+        Set diffs to the diffs between the index and the working tree.
+
+        Returns:
+            AsyncDiff: The AsyncDiff object.
+        """
+        self.diffs = await self._diff()
+        self.post_images = None
+        self.post_image_in_worktree = True
+        return self
+
+    async def commit(self) -> "AsyncDiff":
+        """
+        Set diffs to the diffs between the HEAD and the index.
+
+        Returns:
+            AsyncDiff: The AsyncDiff object.
+        """
+        self.diffs = await self._diff("--cached")
+        self.post_images = None
+        self.post_image_in_worktree = False
+        return self
+
+    async def _merge_on_temp_branch(self, feature_commit: str, base_commit: str) -> List[RawDiff]:
+        """
+        Merge the feature commit into the base commit on a temporary branch and set the diffs.
+
+        Args:
+            feature_commit (str): The commit to merge into the base commit.
+            base_commit (str): The commit to merge the feature commit into.
+
+        Raises:
+            DirtyRepo: If the repository has uncommitted changes.
+
+        Returns:
+            List[RawDiff]: The diffs between the base and the feature commit.
+        """
+        _, status = await self._git("status", "--porcelain", "--untracked-files=no")
+        if status.strip():
+            raise DirtyRepo
+        active_branch = await self._active_branch()
+
+        tmp_branch = f"tmp-{uuid.uuid4()}"
+        await self._git("checkout", "-q", "-b", tmp_branch, base_commit)
+        merge_status, _ = await self._git(
+            "merge", "--no-commit", "--no-ff", feature_commit, check=False
+        )
+        diffs = await self._diff("HEAD")
+        post_images = {}
+        for raw_diff in diffs:
+            if self._needs_post_image(raw_diff.b_path):
+                post_images[raw_diff.b_path] = self._read_worktree(raw_diff.b_path)
+        if merge_status != 0:
+            await self._git("merge", "--abort")
+        else:
+            await self._git("reset", "-q", "--hard")
+
+        await self._git("checkout", "-q", active_branch)
+        await self._git("branch", "-D", tmp_branch)
+
+        self.diffs = diffs
+        self.post_images = post_images
+        self.post_image_in_worktree = False
+        return diffs
+
+    async def merge(self, tree: str) -> "AsyncDiff":
+        """
+        Set diffs to the diffs between the HEAD and the tree.
+
+        Args:
+            tree (str): The tree to compare against.
+
+        Raises:
+            IsAncestor: When the tree is already an ancestor of the HEAD.
+
+        Returns:
+            AsyncDiff: The AsyncDiff object.
+        """
+        if await self._is_ancestor(tree):
+            raise IsAncestor
+        await self._merge_on_temp_branch(tree, await self._active_branch())
+        return self
+
+    async def last_reviewed_commit(self) -> Optional[str]:
+        """
+        Get the last reviewed commit of the active branch.
+
+        Returns:
+            Optional[str]: SHA of the commit, None when the branch has not been reviewed.
+        """
+        ref = reviewed_ref(await self._active_branch())
+        status, output = await self._git("rev-parse", "--verify", "--quiet", ref, check=False)
+        return output.decode("utf-8").strip() if status == 0 else None
+
+    async def mark_reviewed(self) -> None:
+        """
+        Record the commit reviewed by the last push as the last reviewed commit of the branch.
+        """
+        if self.reviewed_commit is not None:
+            ref = reviewed_ref(await self._active_branch())
+            await self._git("update-ref", ref, self.reviewed_commit)
+
+    async def push(self, remote: str = "origin", since_last_review: bool = False) -> "AsyncDiff":
+        """
+        Diff between the HEAD and the remote HEAD.
+
+        Args:
+            remote (str, optional): The remote to compare against. Defaults to "origin".
+            since_last_review (bool, optional): Whether to diff from the last reviewed commit
+            instead, when it is still in the history between the remote HEAD and the HEAD.
+            Defaults to False.
+
+        Raises:
+            NotAncestor: When the remote HEAD is not an ancestor of the HEAD.
+
+        Returns:
+            AsyncDiff: The AsyncDiff object.
+        """
+        remote_head = f"{remote}/{await self._active_branch()}"
+        await self._fetch_remote(remote)
+        if not await self._is_ancestor(remote_head):
+            raise NotAncestor
+
+        base = remote_head
+        last_reviewed = await self.last_reviewed_commit() if since_last_review else None
+        # Rewritten history or a pushed review falls back to the remote HEAD
+        if (
+            last_reviewed is not None
+            and await self._is_ancestor(last_reviewed)
+            and await self._is_ancestor(remote_head, last_reviewed)
+        ):
+            base = last_reviewed
+
+        _, head = await self._git("rev-parse", "HEAD")
+        self.reviewed_commit = head.decode("utf-8").strip()
+        self.diffs = await self._diff(base, self.reviewed_commit)
+        self.post_images = None
+        self.post_image_in_worktree = False
+        return self
+
+    async def pr(self, target_branch: str, remote: str = "origin") -> "AsyncDiff":
+        """
+        Diff between the HEAD and the target branch on the remote.
+
+        Args:
+            target_branch (str): The target branch on the remote.
+            remote (str, optional): The remote to compare against. Defaults to "origin".
+
+        Raises:
+            IsAncestor: When the HEAD is an ancestor of the target branch on the remote.
+
+        Returns:
+            AsyncDiff: The AsyncDiff object.
+        """
+        remote_head = f"{remote}/{target_branch}"
+        await self._fetch_remote(remote)
+        if await self._is_ancestor("HEAD", remote_head):
+            raise IsAncestor
+        await self._merge_on_temp_branch(await self._active_branch(), remote_head)
+        return self
+
+    async def review_patch(
+        self, openai_client: AsyncOpenAI, model: str, temperature: float, system_prompt: str
+    ) -> AsyncIterator[str]:
+        """
+        Review the patch using OpenAI's chat completion models, yielding the review as it streams.
+
+        Args:
+            openai_client (AsyncOpenAI): The async OpenAI client.
+            model (str): Model to use for the review.
+            temperature (float): Temperature parameter for the model.
+            system_prompt (str): System prompt to use for the review.
+
+        Raises:
+            Exception: When there is no patch to review.
+
+        Yields:
+            str: Chunks of the review.
+        """
+        if self.patch is None:
+            raise Exception("No patch to review.")
+
+        self.review = await openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": self.patch},
+            ],
+            temperature=temperature,
+            stream=True,
+        )
+        async for chunk in self.review:
+            chunk_content = chunk.choices[0].delta.content
+            if chunk_content is None:
+                break
+            yield chunk_content
@@ -0,0 +1,104 @@
+from typing import Dict, List, Tuple
+
+from .patch import FilePatch, Hunk
+
+
+def _normalize_change(line: str) -> str:
+    "Drop the whitespace of a changed line as `git diff -w` does, keeping blank lines as changes."
+    return line[0] + "".join(line[1:].split())
+
+
+def _hunk_sides(hunk: Hunk) -> Tuple[List[str], List[str]]:
+    "Old and new lines of a hunk in order, with their context, without their whitespace."
+    old, new = [], []
+    for line in hunk.lines:
+        normalized = _normalize_change(line)[1:] if line else ""
+        if line[:1] in ("", " ", "-"):
+            old.append(normalized)
+        if line[:1] in ("", " ", "+"):
+            new.append(normalized)
+    return old, new
+
+
+def is_formatting_only(file_patch: FilePatch) -> bool:
+    """
+    Check whether a file patch only changes whitespace, as an empty `git diff -w` would.
+
+    Args:
+        file_patch (FilePatch): The file patch to check.
+
+    Returns:
+        bool: Whether the old and new lines of every hunk are the same and in the same order
+        apart from whitespace. Added or removed blank lines are changes, as they are for
+        `git diff -w`.
+    """
+    if not file_patch.hunks or file_patch.new_file or file_patch.deleted_file:
+        return False
+    for hunk in file_patch.hunks:
+        old, new = _hunk_sides(hunk)
+        if old != new:
+            return False
+    return True
+
+
+def hunk_key(hunk: Hunk) -> Tuple[str, ...]:
+    """
+    Key of a hunk that is equal for identical or whitespace-equivalent changes.
+
+    Args:
+        hunk (Hunk): The hunk.
+
+    Returns:
+        Tuple[str, ...]: The changed lines without their whitespace, as `git diff -w` compares
+        them.
+    """
+    return tuple(_normalize_change(line) for line in hunk.changes)
+
+
+def _location(file_patch: FilePatch, hunk: Hunk) -> str:
+    line = hunk.new_start if not file_patch.deleted_file else hunk.old_start
+    return file_patch.path if line is None else f"{file_patch.path}:{line}"
+
+
+def render_deduplicated(file_patches: List[FilePatch]) -> str:
+    """
+    Render the file patches, sending repeated hunks once with the list of their locations.
+
+    Files that only change whitespace are summarized in a single line at the end of the patch.
+
+    Args:
+        file_patches (List[FilePatch]): The file patches to render.
+
+    Returns:
+        str: The deduplicated patch.
+    """
+    formatting_only = []
+    groups: Dict[Tuple[str, ...], List[str]] = {}
+    kept = []
+    for file_patch in file_patches:
+        if is_formatting_only(file_patch):
+            formatting_only.append(file_patch.path)
+            continue
+        hunks = []
+        for hunk in file_patch.hunks:
+            key = hunk_key(hunk)
+            if key and key in groups:
+                groups[key].append(_location(file_patch, hunk))
+                continue
+            groups[key] = []
+            hunks.append(hunk)
+        if hunks or not file_patch.hunks:
+            kept.append((file_patch, hunks))
+
+    rendered = []
+    for file_patch, hunks in kept:
+        text = file_patch.render_header() + file_patch.preamble
+        for hunk in hunks:
+            text += hunk.render()
+            repeats = groups.get(hunk_key(hunk))
+            if repeats:
+                text += f"# Identical change also at: {', '.join(repeats)}\n"
+        rendered.append(text)
+    if formatting_only:
+        rendered.append(f"# Whitespace-only changes in: {', '.join(formatting_only)}\n")
+    return "\n".join(rendered)
@@ -1,10 +1,13 @@
+import threading
+import time
 import uuid
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional
 
 from git import GitCommandError, InvalidGitRepositoryError, Repo, diff
 from openai import OpenAI, Stream
 
+from .dedupe import render_deduplicated
 from .errors import (
     DirtyRepo,
     InvalidRemote,
@@ -15,6 +18,15 @@ from .errors import (
     NotAncestor,
     NotARepo,
 )
+from .findings import response_format
+from .hedge import HedgedStream, hedge_outcome
+from .map_reduce import MapReduceReview, context_window
+from .patch import FilePatch
+from .reducers import find_reducer, reduce_file
+from .scheduler import Priority, RequestScheduler, create_completion, estimate_tokens
+from .shard import assign_shards
+from .symbols import SymbolCache, expand_hunks
+from .triage import TriageVerdict, triage_file_patches
 
 
 def fetch_remote(repo: Repo, remote: str) -> None:
@@ -54,12 +66,35 @@ def check_ancestry(repo: Repo, ancestor_commit: str, commit: str = "HEAD") -> bo
         raise InvalidTree from no_tree
 
 
+def reviewed_ref(branch: str) -> str:
+    """
+    Name of the private ref that records the last reviewed commit of a branch.
+
+    Args:
+        branch (str): Name of the branch.
+
+    Returns:
+        str: Name of the ref.
+    """
+    return f"refs/gait/reviewed/{branch}"
+
+
 class Diff:
     """
     The Diff class for generating diffs and patches.
     """
 
-    def __init__(self, repo_path: Path, unified: int = 3) -> None:
+    def __init__(
+        self,
+        repo_path: Path,
+        unified: int = 3,
+        deduplicate: bool = False,
+        symbol_context: bool = False,
+        reduce_structured: bool = False,
+        find_renames: int = 50,
+        find_copies: int = 0,
+        rename_limit: Optional[int] = None,
+    ) -> None:
         """
         Initialize the Diff class.
 
@@ -67,6 +102,20 @@ class Diff:
             repo_path (Path): The path to the git repository.
             unified (int, optional): The number of lines of context to include in the patch.
             Defaults to 3.
+            deduplicate (bool, optional): Whether to send repeated hunks once and summarize the
+            whitespace-only files in the patch. Defaults to False.
+            symbol_context (bool, optional): Whether to expand the context of each hunk to the
+            functions or classes enclosing its changes. Defaults to False.
+            reduce_structured (bool, optional): Whether to replace the hunks of notebooks,
+            lockfiles and JSON or YAML files with their semantic diff when it is shorter.
+            Defaults to False.
+            find_renames (int, optional): Minimum similarity in percent for a deleted and an
+            added file to be detected as a rename, 0 to disable the detection. Defaults to 50.
+            find_copies (int, optional): Minimum similarity in percent for an added file to be
+            detected as a copy of a modified file, 0 to disable the detection. Defaults to 0.
+            rename_limit (Optional[int], optional): Maximum number of files considered by the
+            rename and copy detection, bounding its cost on large trees. Defaults to the
+            diff.renameLimit of git.
 
         Raises:
             NotARepo: Raised when the path is not a git repository.
@@ -76,9 +125,59 @@ class Diff:
         except InvalidGitRepositoryError as no_git:
             raise NotARepo from no_git
         self.diffs = None
+        self.file_patches = None
         self.patch = None
         self.repo_path = repo_path
         self.unified = unified
+        self.deduplicate = deduplicate
+        self.symbol_context = symbol_context
+        self.reduce_structured = reduce_structured
+        self.find_renames = find_renames
+        self.find_copies = find_copies
+        self.rename_limit = rename_limit
+        # Seconds taken by git to compute the diffs, including the rename and copy detection
+        self.diff_seconds = None
+        self.symbol_cache = SymbolCache(Path(self.repo.git_dir) / "gait" / "symbols")
+        self.reviewed_commit = None
+        self.hedge_winner = None
+        self.selected = None
+        self.triage_verdicts = None
+        self.review_parts = None
+        # Where to read the files after the change from, see _post_image
+        self.post_images = None
+        self.post_image_in_worktree = False
+
+    def _rename_options(self) -> Dict:
+        """
+        Options of git diff for the rename and copy detection. Copy detection also detects
+        renames, at the copy similarity when find_renames is 0.
+        """
+        options = {}
+        if self.find_renames:
+            options["find_renames"] = f"{self.find_renames}%"
+        if self.find_copies:
+            options["find_copies"] = f"{self.find_copies}%"
+        elif not self.find_renames:
+            options["no_renames"] = True
+        if self.rename_limit is not None:
+            options["l"] = self.rename_limit
+        return options
+
+    def _diff(self, diffable, *args, **kwargs) -> List[diff.Diff]:
+        """
+        Create the diffs with a patch, timing git.
+        """
+        start = time.perf_counter()
+        diffs = diffable.diff(
+            *args,
+            create_patch=True,
+            no_ext_diff=True,
+            unified=self.unified,
+            **self._rename_options(),
+            **kwargs,
+        )
+        self.diff_seconds = time.perf_counter() - start
+        return diffs
 
     def add(self) -> "Diff":
         """
@@ -87,9 +186,9 @@ class Diff:
         Returns:
             Diff: The Diff object.
         """
-        self.diffs = self.repo.index.diff(
-            None, create_patch=True, no_ext_diff=True, unified=self.unified
-        )
+        self.diffs = self._diff(self.repo.index, None)
+        self.post_images = None
+        self.post_image_in_worktree = True
         return self
 
     def commit(self) -> "Diff":
@@ -99,9 +198,9 @@ class Diff:
         Returns:
             Diff: The Diff object.
         """
-        self.diffs = self.repo.head.commit.diff(
-            create_patch=True, no_ext_diff=True, unified=self.unified
-        )
+        self.diffs = self._diff(self.repo.head.commit)
+        self.post_images = None
+        self.post_image_in_worktree = False
         return self
 
     def _create_tmp_branch(self, from_commit: str = "HEAD") -> str:
@@ -146,9 +245,12 @@ class Diff:
         except GitCommandError:
             has_conflict = True
         finally:
-            diffs = self.repo.head.commit.diff(
-                None, create_patch=True, no_ext_diff=True, unified=self.unified
-            )
+            diffs = self._diff(self.repo.head.commit, None)
+        # The merge result only lives in the working tree of the temporary branch
+        post_images = {}
+        for git_diff in diffs:
+            if self._needs_post_image(git_diff.b_path):
+                post_images[git_diff.b_path] = self._read_worktree(git_diff.b_path)
         if has_conflict:
             self.repo.git.merge(abort=True)
         else:
@@ -160,6 +262,8 @@ class Diff:
         self.repo.delete_head(tmp_branch, force=True)
 
         self.diffs = diffs
+        self.post_images = post_images
+        self.post_image_in_worktree = False
         return diffs
 
     def merge(self, tree: str) -> "Diff":
@@ -183,12 +287,38 @@ class Diff:
 
         return self
 
-    def push(self, remote: str = "origin") -> "Diff":
+    def last_reviewed_commit(self) -> Optional[str]:
+        """
+        Get the last reviewed commit of the active branch.
+
+        Returns:
+            Optional[str]: SHA of the commit, None when the branch has not been reviewed.
+        """
+        try:
+            return self.repo.git.rev_parse(
+                "--verify", "--quiet", reviewed_ref(self.repo.active_branch.name)
+            )
+        except GitCommandError:
+            return None
+
+    def mark_reviewed(self) -> None:
+        """
+        Record the commit reviewed by the last push as the last reviewed commit of the branch.
+        """
+        if self.reviewed_commit is not None:
+            self.repo.git.update_ref(
+                reviewed_ref(self.repo.active_branch.name), self.reviewed_commit
+            )
+
+    def push(self, remote: str = "origin", since_last_review: bool = False) -> "Diff":
         """
         Diff between the HEAD and the remote HEAD.
 
         Args:
             remote (str, optional): The remote to compare against. Defaults to "origin".
+            since_last_review (bool, optional): Whether to diff from the last reviewed commit
+            instead, when it is still in the history between the remote HEAD and the HEAD.
+            Defaults to False.
 
         Raises:
             NotAncestor: When the remote HEAD is not an ancestor of the HEAD.
@@ -203,9 +333,20 @@ class Diff:
         if not remote_is_ancestor:
             raise NotAncestor
 
-        self.diffs = self.repo.head.commit.diff(
-            remote_head, create_patch=True, no_ext_diff=True, R=True, unified=self.unified
-        )
+        base = remote_head
+        last_reviewed = self.last_reviewed_commit() if since_last_review else None
+        # Rewritten history or a pushed review falls back to the remote HEAD
+        if (
+            last_reviewed is not None
+            and check_ancestry(self.repo, last_reviewed)
+            and check_ancestry(self.repo, remote_head, last_reviewed)
+        ):
+            base = last_reviewed
+
+        self.reviewed_commit = self.repo.head.commit.hexsha
+        self.diffs = self._diff(self.repo.head.commit, base, R=True)
+        self.post_images = None
+        self.post_image_in_worktree = False
         return self
 
     def pr(self, target_branch: str, remote: str = "origin") -> "Diff":
@@ -233,6 +374,100 @@ class Diff:
 
         return self
 
+    def _read_worktree(self, path: Optional[str]) -> Optional[bytes]:
+        """
+        Read a file from the working tree.
+
+        Args:
+            path (Optional[str]): Path of the file relative to the repository root.
+
+        Returns:
+            Optional[bytes]: Content of the file, None when it does not exist.
+        """
+        if path is None:
+            return None
+        try:
+            return (Path(self.repo.working_tree_dir) / path).read_bytes()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def _needs_post_image(self, path: Optional[str]) -> bool:
+        "Whether the content of a file after the change is needed to create the patch."
+        if path is None:
+            return False
+        return self.symbol_context or (self.reduce_structured and find_reducer(path) is not None)
+
+    def _pre_image(self, git_diff: diff.Diff) -> Optional[bytes]:
+        """
+        Get the content of a file before the change.
+
+        Args:
+            git_diff (diff.Diff): Diff of the file.
+
+        Returns:
+            Optional[bytes]: Content of the file, None when it was added or cannot be read.
+        """
+        if git_diff.new_file or git_diff.a_blob is None:
+            return None
+        try:
+            return git_diff.a_blob.data_stream.read()
+        except (ValueError, GitCommandError):
+            return None
+
+    def _post_image(self, git_diff: diff.Diff) -> Optional[bytes]:
+        """
+        Get the content of a file after the change.
+
+        Args:
+            git_diff (diff.Diff): Diff of the file.
+
+        Returns:
+            Optional[bytes]: Content of the file, None when it was deleted or cannot be read.
+        """
+        if git_diff.deleted_file:
+            return None
+        if self.post_images is not None:
+            return self.post_images.get(git_diff.b_path)
+        if self.post_image_in_worktree:
+            return self._read_worktree(git_diff.b_path)
+        if git_diff.b_blob is None:
+            return None
+        return git_diff.b_blob.data_stream.read()
+
+    def _expand_symbol_context(self) -> None:
+        """
+        Expand the hunks of the file patches to the functions or classes enclosing the changes.
+        """
+        for index, git_diff in enumerate(self.diffs):
+            file_patch = self.file_patches[index]
+            if not file_patch.hunks:
+                continue
+            content = self._post_image(git_diff)
+            if content is None:
+                continue
+            file_patch.hunks = expand_hunks(
+                file_patch,
+                content.decode("utf-8", errors="replace").splitlines(),
+                self.symbol_cache.symbols(content, file_patch.path),
+            )
+
+    def _reduce_structured_files(self) -> None:
+        """
+        Replace the hunks of the structured files with their semantic diff when it is shorter.
+        """
+        for index, git_diff in enumerate(self.diffs):
+            file_patch = self.file_patches[index]
+            if not file_patch.hunks or find_reducer(file_patch.path) is None:
+                continue
+            reduced = reduce_file(
+                file_patch.path, self._pre_image(git_diff), self._post_image(git_diff)
+            )
+            if reduced is None:
+                continue
+            if len(reduced) < len(file_patch.render()) - len(file_patch.render_header()):
+                file_patch.hunks = []
+                file_patch.preamble = reduced
+
     def create_patch(self) -> str:
         """
         Get the patch from the diffs.
@@ -248,14 +483,168 @@ class Diff:
             raise Exception("No diffs generated.")
         elif len(self.diffs) == 0:
             raise NoDiffs
-        patch = "\n".join([diff.diff.decode("utf-8") for diff in self.diffs])
+        self.file_patches = [FilePatch.from_diff(diff) for diff in self.diffs]
+        if self.reduce_structured:
+            self._reduce_structured_files()
+        if self.symbol_context:
+            self._expand_symbol_context()
+        self.selected = list(range(len(self.diffs)))
+        patch = self._render_patch(self.selected)
         if patch.strip() == "":
             raise NoCodeChanges
         self.patch = patch
         return patch
 
+    def _selected_file_patches(self) -> List[FilePatch]:
+        "File patches in the patch, without the ones left out by sharding or triage."
+        return [self.file_patches[index] for index in self.selected]
+
+    def shard(self, index: int, count: int) -> List[str]:
+        """
+        Keep only the files of a shard in the patch. The files are assigned to the shards by
+        their estimated tokens, the same way in every job reviewing the same diff.
+
+        Args:
+            index (int): Index of the shard, from 1 to count.
+            count (int): Number of shards.
+
+        Raises:
+            Exception: When there is no patch to shard.
+
+        Returns:
+            List[str]: Paths of the files in the shard, the patch is None when there are none.
+        """
+        if self.patch is None:
+            raise Exception("No patch to shard.")
+
+        file_patches = self._selected_file_patches()
+        shards = assign_shards(
+            [file_patch.path for file_patch in file_patches],
+            [estimate_tokens(file_patch.render()) for file_patch in file_patches],
+            count,
+        )
+        self.selected = [
+            selected for position, selected in enumerate(self.selected) if shards[position] == index
+        ]
+        self.patch = self._render_patch(self.selected) if self.selected else None
+        return [self.file_patches[selected].path for selected in self.selected]
+
+    def _render_patch(self, indices: Iterable[int], headers: bool = False) -> str:
+        """
+        Render the patch of the diffs at the indices with the options of the Diff, with the file
+        headers in the default mode too when headers is set.
+        """
+        indices = list(indices)
+        if self.deduplicate:
+            return render_deduplicated([self.file_patches[index] for index in indices])
+        elif self.symbol_context or self.reduce_structured or headers:
+            return "\n".join(self.file_patches[index].render() for index in indices)
+        return "\n".join(self._raw_patch(index) for index in indices)
+
+    def _raw_patch(self, index: int) -> str:
+        """
+        Patch of a diff as git created it, moved files get their one-line rename or copy header.
+        """
+        file_patch = self.file_patches[index]
+        patch = self.diffs[index].diff.decode("utf-8")
+        if file_patch.renamed_file or file_patch.copied_file:
+            return file_patch.render_header() + patch
+        return patch
+
+    def triage(
+        self,
+        openai_client: OpenAI,
+        model: str,
+        system_prompt: str,
+        scheduler: Optional[RequestScheduler] = None,
+        priority: Priority = Priority.interactive,
+    ) -> List[TriageVerdict]:
+        """
+        Triage the patch of each file with a fast model and keep only the files that need review
+        in the patch.
+
+        Args:
+            openai_client (OpenAI): The OpenAI client.
+            model (str): Model to triage with.
+            system_prompt (str): System prompt of the triage.
+            scheduler (Optional[RequestScheduler], optional): Scheduler to wait for a slot within
+            the rate limits before sending the requests. Defaults to None.
+            priority (Priority, optional): Priority of the requests in the scheduler.
+            Defaults to interactive.
+
+        Raises:
+            Exception: When there is no patch to triage.
+            NoCodeChanges: When no file needs review.
+
+        Returns:
+            List[TriageVerdict]: Verdicts of the files in the patch, in the order of the diffs.
+        """
+        if self.patch is None:
+            raise Exception("No patch to triage.")
+
+        self.triage_verdicts = triage_file_patches(
+            openai_client,
+            model,
+            self._selected_file_patches(),
+            system_prompt,
+            scheduler=scheduler,
+            priority=priority,
+        )
+        flagged = [
+            self.selected[position]
+            for position, verdict in enumerate(self.triage_verdicts)
+            if verdict.needs_review
+        ]
+        if not flagged:
+            raise NoCodeChanges
+        if len(flagged) < len(self.selected):
+            self.selected = flagged
+            self.patch = self._render_patch(flagged)
+        return self.triage_verdicts
+
+    def _create_stream(
+        self,
+        openai_client: OpenAI,
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        scheduler: Optional[RequestScheduler],
+        priority: Priority,
+        findings: bool = False,
+        on_acquired: Optional[Callable[[], None]] = None,
+    ) -> Stream:
+        """
+        Send the review request, waiting for a slot in the scheduler when there is one.
+        """
+        request = {"response_format": response_format(model)} if findings else {}
+        return create_completion(
+            openai_client,
+            scheduler,
+            priority,
+            on_acquired,
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": self.patch},
+            ],
+            temperature=temperature,
+            stream=True,
+            **request,
+        )
+
     def review_patch(
-        self, openai_client: OpenAI, model: str, temperature: float, system_prompt: str
+        self,
+        openai_client: OpenAI,
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        scheduler: Optional[RequestScheduler] = None,
+        priority: Priority = Priority.interactive,
+        latency_budget: Optional[float] = None,
+        hedge_model: Optional[str] = None,
+        map_reduce: bool = False,
+        context_tokens: Optional[int] = None,
+        findings: bool = False,
     ) -> Stream:
         """
         Review the patch using OpenAI's chat completion models.
@@ -265,6 +654,24 @@ class Diff:
             model (str): Model to use for the review.
             temperature (float): Temperature parameter for the model.
             system_prompt (str): System prompt to use for the review.
+            scheduler (Optional[RequestScheduler], optional): Scheduler to wait for a slot within
+            the rate limits before sending the request. Defaults to None.
+            priority (Priority, optional): Priority of the request in the scheduler.
+            Defaults to interactive.
+            latency_budget (Optional[float], optional): Seconds to wait for the first token before
+            sending a hedged request and using whichever streams first. Defaults to None.
+            hedge_model (Optional[str], optional): Model of the hedged request. Defaults to the
+            model of the review.
+            map_reduce (bool, optional): Whether to review a patch larger than the context window
+            of the model in parts, merging their findings into one review. Only models of known
+            context windows are reviewed in parts. Defaults to False.
+            context_tokens (Optional[int], optional): Context window of the model in tokens.
+            Defaults to the known context window of the model.
+            findings (bool, optional): Whether to ask for a structured review of line-anchored
+            findings in JSON, with the structured outputs of the model when it supports them.
+            The system prompt should ask for the findings too. The patch is rendered with the
+            header of every file, for the findings to be anchored at their paths.
+            Defaults to False.
 
         Raises:
             Exception: When there is no patch to review.
@@ -274,15 +681,50 @@ class Diff:
         """
         if self.patch is None:
             raise Exception("No patch to review.")
+        if findings:
+            self.patch = self._render_patch(self.selected, headers=True)
+
+        # Patches for models of unknown context windows are sent whole, the API reports overflows
+        if map_reduce and (context_tokens or context_window(model)) is not None:
+            reviewer = MapReduceReview(
+                openai_client,
+                model,
+                temperature,
+                scheduler=scheduler,
+                priority=priority,
+                context_tokens=context_tokens,
+                system_prompt=system_prompt,
+            )
+            if not reviewer.fits(system_prompt + self.patch):
+                self.review = reviewer.review(
+                    self._selected_file_patches(),
+                    response_format=response_format(model) if findings else None,
+                )
+                self.review_parts = reviewer.parts
+                self.hedge_winner = None
+                return self.review
+
+        def start(request_model: str, on_acquired: Optional[Callable[[], None]] = None):
+            return lambda: self._create_stream(
+                openai_client,
+                request_model,
+                temperature,
+                system_prompt,
+                scheduler,
+                priority,
+                findings,
+                on_acquired,
+            )
 
-        self.review = openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": self.patch},
-            ],
-            temperature=temperature,
-            stream=True,
-        )
+        if latency_budget is None:
+            self.review = start(model)()
+        else:
+            # Time queued for a slot in the rate limits does not count towards the budget
+            slot = threading.Event()
+            self.review = HedgedStream(
+                start(model, slot.set), start(hedge_model or model), latency_budget, slot=slot
+            )
+        self.hedge_winner = hedge_outcome(self.review)
+        self.review_parts = 1
 
         return self.review
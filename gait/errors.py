@@ -42,3 +42,9 @@ class NoCodeChanges(Exception):
     "Raised when there is a diff but no code changes."
 
     pass
+
+
+class InvalidShardResults(Exception):
+    "Raised when the shard results cannot be merged."
+
+    pass
@@ -0,0 +1,301 @@
+import json
+from dataclasses import asdict, dataclass
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+from openai import Stream
+
+SEVERITIES = ("high", "medium", "low")
+
+# Strict schema of the structured review, every property is required and no other is allowed
+FINDINGS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "findings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "line": {"type": "integer"},
+                    "severity": {"type": "string", "enum": list(SEVERITIES)},
+                    "message": {"type": "string"},
+                },
+                "required": ["path", "line", "severity", "message"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["findings"],
+    "additionalProperties": False,
+}
+
+# Models that accept a JSON schema as response format, the others get a JSON object
+_JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5")
+_JSON_OBJECT_MODELS = ("gpt-4o-2024-05-13",)
+
+_SARIF_LEVELS = {"high": "error", "medium": "warning", "low": "note"}
+_SARIF_RULE = "gait-review"
+
+
+class FindingsFormat(str, Enum):
+    terminal = "terminal"
+    json = "json"
+    sarif = "sarif"
+
+
+@dataclass
+class Finding:
+    """
+    A line-anchored finding of a structured review.
+    """
+
+    path: str
+    line: int
+    severity: str
+    message: str
+
+
+def response_format(model: str) -> Dict:
+    """
+    Response format of a structured review request.
+
+    Args:
+        model (str): Model of the request.
+
+    Returns:
+        Dict: The findings schema for the models supporting structured outputs, a JSON object
+        for the others.
+    """
+    if model.startswith(_JSON_SCHEMA_MODELS) and not model.startswith(_JSON_OBJECT_MODELS):
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "findings", "strict": True, "schema": FINDINGS_SCHEMA},
+        }
+    return {"type": "json_object"}
+
+
+def parse_finding(content: str) -> Optional[Finding]:
+    """
+    Parse a single finding of a structured review.
+
+    Args:
+        content (str): The JSON object of the finding.
+
+    Returns:
+        Optional[Finding]: The finding, None when it is malformed.
+    """
+    try:
+        value = json.loads(content)
+        finding = Finding(
+            str(value["path"]),
+            int(value["line"] or 0),
+            str(value["severity"]).lower(),
+            str(value["message"]).strip(),
+        )
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not finding.path or not finding.message or finding.severity not in SEVERITIES:
+        return None
+    return finding
+
+
+class FindingsParser:
+    """
+    Parse the findings of a structured review incrementally, as the stream arrives.
+
+    A finding is an object in the first array of the answer, such as {"findings": [...]}. It is
+    parsed as soon as its closing brace arrives, without waiting for the rest of the answer.
+    """
+
+    def __init__(self) -> None:
+        self.findings: List[Finding] = []
+        self.content = ""
+        self._position = 0
+        self._depth = 0
+        self._array_depth = None
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+
+    def _scan_string(self, char: str) -> None:
+        if self._escaped:
+            self._escaped = False
+        elif char == "\\":
+            self._escaped = True
+        elif char == '"':
+            self._in_string = False
+
+    def _scan(self, char: str) -> Optional[Finding]:
+        "Scan a character outside of the strings, returning the finding it closes."
+        finding = None
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+            if char == "[" and self._array_depth is None:
+                self._array_depth = self._depth
+            elif char == "{" and self._array_depth is not None:
+                if self._depth == self._array_depth + 1:
+                    self._start = self._position
+        elif char in "}]":
+            if char == "}" and self._start is not None and self._depth == self._array_depth + 1:
+                finding = parse_finding(self.content[self._start : self._position + 1])
+                self._start = None
+            self._depth -= 1
+        return finding
+
+    def feed(self, text: str) -> List[Finding]:
+        """
+        Feed the next part of the answer.
+
+        Args:
+            text (str): The next part of the answer.
+
+        Returns:
+            List[Finding]: The findings completed by the text. Malformed findings are left out.
+        """
+        self.content += text
+        findings = []
+        while self._position < len(self.content):
+            char = self.content[self._position]
+            if self._in_string:
+                self._scan_string(char)
+            else:
+                finding = self._scan(char)
+                if finding is not None:
+                    findings.append(finding)
+            self._position += 1
+        self.findings += findings
+        return findings
+
+
+def parse_findings(content: str) -> List[Finding]:
+    """
+    Parse the findings of a complete structured review.
+
+    Args:
+        content (str): The JSON answer of the model.
+
+    Returns:
+        List[Finding]: The findings. Malformed findings are left out.
+    """
+    parser = FindingsParser()
+    parser.feed(content)
+    return parser.findings
+
+
+def stream_findings(
+    stream: Stream, on_finding: Optional[Callable[[Finding], None]] = None
+) -> Tuple[str, List[Finding]]:
+    """
+    Read a structured review stream, parsing the findings as they arrive.
+
+    Args:
+        stream (Stream): Stream of text from OpenAI.
+        on_finding (Optional[Callable[[Finding], None]], optional): Called with each finding as
+        soon as it is complete. Defaults to None.
+
+    Returns:
+        Tuple[str, List[Finding]]: Full stream of text and the findings.
+    """
+    parser = FindingsParser()
+    for chunk in stream:
+        chunk_content = chunk.choices[0].delta.content
+        if chunk_content is None:
+            break
+        for finding in parser.feed(chunk_content):
+            if on_finding is not None:
+                on_finding(finding)
+    return parser.content, parser.findings
+
+
+def format_finding(finding: Finding) -> str:
+    """
+    Format a finding for the console.
+
+    Args:
+        finding (Finding): The finding.
+
+    Returns:
+        str: The finding as path:line: [severity] message.
+    """
+    return f"{finding.path}:{finding.line}: [{finding.severity}] {finding.message}"
+
+
+def summarize_findings(findings: List[Finding]) -> str:
+    """
+    Count the findings by severity.
+
+    Args:
+        findings (List[Finding]): The findings.
+
+    Returns:
+        str: The number of findings of each severity, or that there are none.
+    """
+    if not findings:
+        return "No findings"
+    counts = dict.fromkeys(SEVERITIES, 0)
+    for finding in findings:
+        counts[finding.severity] += 1
+    by_severity = ", ".join(f"{count} {severity}" for severity, count in counts.items() if count)
+    return f"{len(findings)} findings: {by_severity}"
+
+
+def findings_to_text(findings: List[Finding]) -> str:
+    "Render the findings one per line, followed by their summary."
+    return "".join(format_finding(finding) + "\n" for finding in findings) + (
+        summarize_findings(findings) + "\n"
+    )
+
+
+def findings_to_json(findings: List[Finding]) -> str:
+    "Render the findings as a JSON document."
+    return json.dumps({"findings": [asdict(finding) for finding in findings]}, indent=2) + "\n"
+
+
+def findings_to_sarif(findings: List[Finding]) -> str:
+    "Render the findings as a SARIF 2.1.0 log for code scanning tools."
+    results = []
+    for finding in findings:
+        location = {"artifactLocation": {"uri": finding.path}}
+        if finding.line > 0:
+            location["region"] = {"startLine": finding.line}
+        results.append(
+            {
+                "ruleId": _SARIF_RULE,
+                "level": _SARIF_LEVELS[finding.severity],
+                "message": {"text": finding.message},
+                "locations": [{"physicalLocation": location}],
+            }
+        )
+    driver = {
+        "name": "gait",
+        "informationUri": "https://github.com/can-taslicukur/gait",
+        "rules": [{"id": _SARIF_RULE, "shortDescription": {"text": "Code review finding"}}],
+    }
+    sarif = {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [{"tool": {"driver": driver}, "results": results}],
+    }
+    return json.dumps(sarif, indent=2) + "\n"
+
+
+def render_findings(findings: List[Finding], findings_format: FindingsFormat) -> str:
+    """
+    Render the findings of a structured review.
+
+    Args:
+        findings (List[Finding]): The findings.
+        findings_format (FindingsFormat): Format to render the findings in.
+
+    Returns:
+        str: The rendered findings.
+    """
+    renderers = {
+        FindingsFormat.terminal: findings_to_text,
+        FindingsFormat.json: findings_to_json,
+        FindingsFormat.sarif: findings_to_sarif,
+    }
+    return renderers[FindingsFormat(findings_format)](findings)
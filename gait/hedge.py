@@ -0,0 +1,148 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+def _close(stream: Iterable) -> None:
+    "Close a chat completion stream, dropping its connection."
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class HedgedStream:
+    """
+    A chat completion stream that fires a hedged request when the first token is late.
+
+    The primary request starts right away. When no token has arrived within the latency budget,
+    the hedged request starts too, and the stream of whichever produces a token first is used
+    while the other one is closed. With a slot event, the budget only starts once the primary
+    request has its slot in the rate limits, so that a queued request is not hedged.
+    """
+
+    def __init__(
+        self,
+        start_primary: Callable[[], Iterable],
+        start_hedge: Callable[[], Iterable],
+        latency_budget: float,
+        slot: Optional[threading.Event] = None,
+    ) -> None:
+        """
+        Initialize the HedgedStream class, waiting for the first token of either request.
+
+        Args:
+            start_primary (Callable[[], Iterable]): Sends the primary request.
+            start_hedge (Callable[[], Iterable]): Sends the hedged request.
+            latency_budget (float): Seconds to wait for the first token before hedging.
+            slot (Optional[threading.Event], optional): Set by the primary request once it has
+            its slot in the rate limits. Defaults to None, for a budget starting right away.
+
+        Raises:
+            Exception: The error of the primary request, when no request produced a token.
+        """
+        self.winner = None
+        self.hedged = False
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._streams: Dict[str, Iterable] = {}
+        self._racing = 1
+        if slot is None:
+            self._race(PRIMARY, start_primary)
+        else:
+
+            def start_in_slot() -> Iterable:
+                # A primary request failing before its slot must not leave the wait hanging
+                try:
+                    return start_primary()
+                finally:
+                    slot.set()
+
+            self._race(PRIMARY, start_in_slot)
+            slot.wait()
+        try:
+            result = self._results.get(timeout=latency_budget)
+        except queue.Empty:
+            self.hedged = True
+            self._racing += 1
+            self._race(HEDGE, start_hedge)
+            result = self._results.get()
+        errors = {}
+        # A failed request leaves the race to the other one
+        while result[3] is not None:
+            errors[result[0]] = result[3]
+            if len(errors) == self._racing:
+                raise errors.get(PRIMARY, result[3])
+            result = self._results.get()
+        name, iterator, buffered, _ = result
+        with self._lock:
+            self.winner = name
+            losers = [stream for racer, stream in self._streams.items() if racer != name]
+        for stream in losers:
+            _close(stream)
+        self._iterator = iterator
+        self._buffered = buffered
+
+    def _race(self, name: str, start: Callable[[], Iterable]) -> None:
+        thread = threading.Thread(target=self._run, args=(name, start), daemon=True)
+        thread.start()
+
+    def _run(self, name: str, start: Callable[[], Iterable]) -> None:
+        """
+        Send a request and report its stream once it produced its first token.
+        """
+        buffered: List = []
+        try:
+            stream = start()
+            with self._lock:
+                lost = self.winner is not None
+                self._streams[name] = stream
+            if lost:
+                _close(stream)
+                return
+            iterator = iter(stream)
+            for chunk in iterator:
+                buffered.append(chunk)
+                # Role and empty chunks come before the first token
+                if not chunk.choices or chunk.choices[0].delta.content != "":
+                    break
+        except Exception as err:
+            self._results.put((name, None, buffered, err))
+            return
+        with self._lock:
+            lost = self.winner is not None
+        if lost:
+            _close(stream)
+            return
+        self._results.put((name, iterator, buffered, None))
+
+    def __iter__(self) -> Iterator:
+        yield from self._buffered
+        yield from self._iterator
+
+    def close(self) -> None:
+        for stream in list(self._streams.values()):
+            _close(stream)
+
+
+def hedge_outcome(stream: Iterable) -> Optional[str]:
+    """
+    Describe which request of a review stream won, to record it with the review metrics.
+
+    Args:
+        stream (Iterable): The review stream.
+
+    Returns:
+        Optional[str]: primary when the primary request was on time, primary-after-hedge or
+        hedge when a hedged request was fired, None when the stream was not hedged.
+    """
+    if not isinstance(stream, HedgedStream):
+        return None
+    if not stream.hedged:
+        return PRIMARY
+    return HEDGE if stream.winner == HEDGE else f"{PRIMARY}-after-{HEDGE}"
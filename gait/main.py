@@ -1,5 +1,10 @@
+import os
+import sqlite3
+import sys
+import time
 from pathlib import Path
 from types import SimpleNamespace
+from typing import List, Optional, TextIO, Tuple
 
 import typer
 from openai import AuthenticationError, NotFoundError, OpenAI
@@ -9,27 +14,295 @@ from .diff import Diff
 from .errors import (
     DirtyRepo,
     InvalidRemote,
+    InvalidShardResults,
     InvalidTree,
     IsAncestor,
+    NoCodeChanges,
     NotAncestor,
     NotARepo,
 )
+from .findings import (
+    FindingsFormat,
+    format_finding,
+    render_findings,
+    stream_findings,
+    summarize_findings,
+)
+from .metrics import (
+    MetricsStore,
+    StreamTimer,
+    default_metrics_path,
+    format_summary,
+    review_record,
+    summarize,
+    write_openmetrics,
+)
+from .scan import ScanMode, scan_repositories
+from .scheduler import RequestScheduler, estimate_tokens
+from .shard import load_results, parse_shard, stitch_results, write_result
+from .triage import format_triage
 from .utils import handle_create_patch_errors, read_prompt, stream_to_console
 
 
+def record_review(ctx: typer.Context, timer: StreamTimer) -> None:
+    """
+    Append the usage and latency of the review to the metrics store.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+        timer (StreamTimer): Timer of the consumed review stream.
+    """
+    if not ctx.obj.record_metrics:
+        return
+    record = review_record(ctx.info_name, ctx.obj.diff, ctx.obj.system_prompt, timer)
+    try:
+        MetricsStore(ctx.obj.metrics_db).record(record)
+    except sqlite3.Error:
+        print(f"Could not record the review metrics to {ctx.obj.metrics_db}", file=sys.stderr)
+
+
+def status_file(ctx: typer.Context) -> TextIO:
+    """
+    Stream of the status messages of a review.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+
+    Returns:
+        TextIO: Standard error when JSON or SARIF findings may be written to the standard output,
+        so that the report stays parseable, standard output otherwise.
+    """
+    if ctx.obj.findings in (FindingsFormat.json, FindingsFormat.sarif):
+        return sys.stderr
+    return sys.stdout
+
+
+def triage_patch(ctx: typer.Context) -> None:
+    """
+    Keep only the files the triage model flags in the patch, when a triage model is set.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+    """
+    if ctx.obj.triage_model is None:
+        return
+    try:
+        verdicts = ctx.obj.diff.triage(
+            ctx.obj.client,
+            ctx.obj.triage_model,
+            read_prompt("triage"),
+            scheduler=ctx.obj.scheduler,
+        )
+    except NoCodeChanges as no_code_changes:
+        print(format_triage(ctx.obj.diff.triage_verdicts), file=status_file(ctx))
+        print("No meaningful code changes found to review", file=status_file(ctx))
+        write_shard_result(ctx, "No meaningful code changes found to review")
+        raise typer.Abort() from no_code_changes
+    print(format_triage(verdicts), end="\n\n", file=status_file(ctx), flush=True)
+
+
+def write_shard_result(ctx: typer.Context, review: str) -> None:
+    """
+    Write the review of the shard for merge-results, when a shard is set.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+        review (str): The review.
+    """
+    if ctx.obj.shard is None:
+        return
+    index, count = ctx.obj.shard
+    diff = ctx.obj.diff
+    path = write_result(
+        ctx.obj.results_dir,
+        index,
+        count,
+        ctx.info_name,
+        [diff.file_patches[selected].path for selected in diff.selected],
+        estimate_tokens(diff.patch or ""),
+        review,
+    )
+    print(f"\nShard result written to {path}", file=sys.stderr)
+
+
+def shard_patch(ctx: typer.Context) -> None:
+    """
+    Keep only the files of the shard in the patch, when a shard is set.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+    """
+    if ctx.obj.shard is None:
+        return
+    index, count = ctx.obj.shard
+    files = ctx.obj.diff.shard(index, count)
+    if not files:
+        print(f"No files to review in shard {index}/{count}", file=status_file(ctx))
+        write_shard_result(ctx, "")
+        raise typer.Exit()
+    print(
+        f"Shard {index}/{count}: {', '.join(files)}", end="\n\n", file=status_file(ctx), flush=True
+    )
+
+
+def print_findings(ctx: typer.Context, stream: StreamTimer) -> str:
+    """
+    Render the findings of a structured review, printing them as they arrive in the terminal.
+
+    Args:
+        ctx (typer.Context): Context of the review command.
+        stream (StreamTimer): Timed stream of the structured review.
+
+    Returns:
+        str: The findings as text, one per line.
+    """
+    terminal = ctx.obj.findings == FindingsFormat.terminal
+
+    def print_finding(finding):
+        print(format_finding(finding), flush=True)
+
+    _, findings = stream_findings(stream, print_finding if terminal else None)
+    if terminal:
+        print(summarize_findings(findings))
+    report = render_findings(findings, ctx.obj.findings)
+    if ctx.obj.findings_output is not None:
+        ctx.obj.findings_output.write_text(report)
+        print(f"Findings written to {ctx.obj.findings_output}", file=sys.stderr)
+    elif not terminal:
+        print(report, end="")
+    return render_findings(findings, FindingsFormat.terminal)
+
+
 def print_patch_review(ctx: typer.Context):
+    start = time.perf_counter()
+    shard_patch(ctx)
+    triage_patch(ctx)
     try:
         review = ctx.obj.diff.review_patch(
-            ctx.obj.client, ctx.obj.model, ctx.obj.temperature, ctx.obj.system_prompt
+            ctx.obj.client,
+            ctx.obj.model,
+            ctx.obj.temperature,
+            ctx.obj.system_prompt,
+            scheduler=ctx.obj.scheduler,
+            latency_budget=ctx.obj.latency_budget,
+            hedge_model=ctx.obj.hedge_model,
+            map_reduce=ctx.obj.map_reduce,
+            context_tokens=ctx.obj.context_window,
+            findings=ctx.obj.findings is not None,
         )
     except Exception as err:
-        print("Error while reviewing the code changes.")
+        print("Error while reviewing the code changes.", file=status_file(ctx))
         raise typer.Abort() from err
-    stream_to_console(review)
+    if ctx.obj.diff.review_parts > 1:
+        print(
+            f"The patch exceeds the context window of {ctx.obj.model}, "
+            f"merging the reviews of its {ctx.obj.diff.review_parts} parts.",
+            end="\n\n",
+            file=status_file(ctx),
+            flush=True,
+        )
+    timer = StreamTimer(review, start)
+    if ctx.obj.findings is None:
+        review = stream_to_console(timer)
+    else:
+        review = print_findings(ctx, timer)
+    record_review(ctx, timer)
+    write_shard_result(ctx, review)
+
+
+def validate_model(
+    ctx: typer.Context, client: OpenAI, model: str, param_hint: str = "model"
+) -> None:
+    """
+    Validate that the model is a gpt model available to the client.
+
+    Args:
+        ctx (typer.Context): Context of the main callback.
+        client (OpenAI): The OpenAI client.
+        model (str): OpenAI GPT model.
+        param_hint (str, optional): Option the model was given with. Defaults to "model".
+
+    Raises:
+        typer.BadParameter: When the model is not valid.
+    """
+    if not model.startswith("gpt"):
+        raise typer.BadParameter(
+            "Only gpt models are supported", ctx=ctx, param=model, param_hint=param_hint
+        )
+    try:
+        client.models.retrieve(model=model)
+    except NotFoundError as no_model:
+        raise typer.BadParameter(
+            f"{model} does not exist", ctx=ctx, param=model, param_hint=param_hint
+        ) from no_model
+
+
+def create_openai_client(ctx: typer.Context, openai_api_key: str, model: str) -> OpenAI:
+    """
+    Create the OpenAI client after validating the API key and the model.
+
+    Args:
+        ctx (typer.Context): Context of the main callback.
+        openai_api_key (str): OpenAI API key.
+        model (str): OpenAI GPT model.
+
+    Raises:
+        typer.BadParameter: When the API key or the model is not valid.
+
+    Returns:
+        OpenAI: The OpenAI client.
+    """
+    if openai_api_key is None:
+        raise typer.BadParameter(
+            "Missing OpenAI API key, set it with OPENAI_API_KEY",
+            ctx=ctx,
+            param_hint="openai_api_key",
+        )
+    client = OpenAI(api_key=openai_api_key)
+    try:
+        validate_model(ctx, client, model)
+    except AuthenticationError as auth_error:
+        raise typer.BadParameter(
+            "Invalid OpenAI API key", ctx=ctx, param=openai_api_key, param_hint="openai_api_key"
+        ) from auth_error
+    return client
+
+
+def validate_rename_options(ctx: typer.Context, find_renames: int, find_copies: int) -> None:
+    """
+    Validate that rename detection is not disabled along with copy detection enabled.
+
+    Args:
+        ctx (typer.Context): Context of the command.
+        find_renames (int): Minimum similarity of the renames, 0 when disabled.
+        find_copies (int): Minimum similarity of the copies, 0 when disabled.
+
+    Raises:
+        typer.BadParameter: When copies are detected and renames are not, as git detects the
+        renames along with the copies.
+    """
+    if find_copies and not find_renames:
+        raise typer.BadParameter(
+            "cannot be 0 with --find-copies, as copy detection also detects renames",
+            ctx=ctx,
+            param_hint="--find-renames",
+        )
+
+
+def parse_shard_option(shard: Optional[str]) -> Optional[Tuple[int, int]]:
+    if shard is None:
+        return None
+    try:
+        return parse_shard(shard)
+    except ValueError as invalid_shard:
+        raise typer.BadParameter(str(invalid_shard)) from invalid_shard
 
 
 app = typer.Typer()
 
+# Commands that need neither a git repository nor an OpenAI API key
+OFFLINE_COMMANDS = ("stats", "merge-results")
+
 @app.callback(invoke_without_command=True)
 def main(
     ctx: typer.Context,
@@ -38,7 +311,7 @@ def main(
         typer.Option(
             help="OpenAI API key", envvar="OPENAI_API_KEY", rich_help_panel="OpenAI Parameters"
         ),
-    ],
+    ] = None,
     model: Annotated[
         str, typer.Option(help="OpenAI GPT model", rich_help_panel="OpenAI Parameters")
     ] = "gpt-4-turbo-preview",
@@ -55,6 +328,54 @@ def main(
             rich_help_panel="OpenAI Parameters",
         ),
     ] = None,
+    rate_limit_state: Annotated[
+        Path,
+        typer.Option(
+            help="State file shared by gait processes to schedule requests within rate limits",
+            envvar="GAIT_RATE_LIMIT_STATE",
+            dir_okay=False,
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = None,
+    latency_budget: Annotated[
+        float,
+        typer.Option(
+            min=0,
+            help="Seconds to wait for the first token before sending a hedged request",
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = None,
+    hedge_model: Annotated[
+        str,
+        typer.Option(
+            help="OpenAI GPT model of the hedged request [default: the model]",
+            show_default=False,
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = None,
+    triage_model: Annotated[
+        str,
+        typer.Option(
+            help="Fast OpenAI GPT model that picks the files for the model to review",
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = None,
+    map_reduce: Annotated[
+        bool,
+        typer.Option(
+            help="Review patches larger than the context window of the model in parts",
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = True,
+    context_window: Annotated[
+        int,
+        typer.Option(
+            min=1024,
+            help="Context window of the model in tokens [default: known window of the model]",
+            show_default=False,
+            rich_help_panel="OpenAI Parameters",
+        ),
+    ] = None,
     unified: Annotated[
         int,
         typer.Option(
@@ -62,43 +383,165 @@ def main(
             rich_help_panel="Git Parameters",
         ),
     ] = 3,
+    deduplicate: Annotated[
+        bool,
+        typer.Option(
+            help="Send repeated hunks once and summarize whitespace-only files",
+            rich_help_panel="Git Parameters",
+        ),
+    ] = False,
+    symbol_context: Annotated[
+        bool,
+        typer.Option(
+            help="Expand each hunk to the functions or classes enclosing its changes",
+            rich_help_panel="Git Parameters",
+        ),
+    ] = False,
+    reduce_structured: Annotated[
+        bool,
+        typer.Option(
+            help="Send the semantic diff of notebooks, lockfiles and JSON or YAML files",
+            rich_help_panel="Git Parameters",
+        ),
+    ] = False,
+    find_renames: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            max=100,
+            help="Minimum similarity in percent to send a moved file as its delta, 0 to disable",
+            rich_help_panel="Git Parameters",
+        ),
+    ] = 50,
+    find_copies: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            max=100,
+            help="Minimum similarity in percent to send a copied file as its delta, 0 to disable, "
+            "needs --find-renames",
+            rich_help_panel="Git Parameters",
+        ),
+    ] = 0,
+    rename_limit: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help="Maximum files for the rename and copy detection [default: diff.renameLimit]",
+            show_default=False,
+            rich_help_panel="Git Parameters",
+        ),
+    ] = None,
+    findings: Annotated[
+        FindingsFormat,
+        typer.Option(
+            help="Ask for compact line-anchored findings and render them in a format",
+            show_default=False,
+            rich_help_panel="Output Parameters",
+        ),
+    ] = None,
+    findings_output: Annotated[
+        Path,
+        typer.Option(
+            help="File to write the rendered findings to instead of the console",
+            dir_okay=False,
+            rich_help_panel="Output Parameters",
+        ),
+    ] = None,
+    shard: Annotated[
+        str,
+        typer.Option(
+            help="Review only the files of shard i of n, balanced by estimated tokens, e.g. 2/4",
+            callback=parse_shard_option,
+            show_default=False,
+            rich_help_panel="Sharding Parameters",
+        ),
+    ] = None,
+    results_dir: Annotated[
+        Path,
+        typer.Option(
+            help="Directory to write the shard results to for merge-results",
+            file_okay=False,
+            rich_help_panel="Sharding Parameters",
+        ),
+    ] = Path("gait-results"),
+    metrics_db: Annotated[
+        Path,
+        typer.Option(
+            help="SQLite store of the review usage and latency [default: in the gait app dir]",
+            envvar="GAIT_METRICS_DB",
+            dir_okay=False,
+            show_default=False,
+            rich_help_panel="Metrics Parameters",
+        ),
+    ] = None,
+    record_metrics: Annotated[
+        bool,
+        typer.Option(
+            help="Record the usage and latency of each review",
+            rich_help_panel="Metrics Parameters",
+        ),
+    ] = True,
 ):
     if ctx.invoked_subcommand is None:
         ctx.get_help()
-    try:
-        diff = Diff(Path("."), unified=unified)
-    except NotARepo as not_a_repo:
-        print("Current directory is not a git repository")
-        raise typer.Abort() from not_a_repo
+    if metrics_db is None:
+        metrics_db = default_metrics_path()
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
+        ctx.obj = SimpleNamespace(metrics_db=metrics_db)
+        return
+    validate_rename_options(ctx, find_renames, find_copies)
+    diff_options = {
+        "unified": unified,
+        "deduplicate": deduplicate,
+        "symbol_context": symbol_context,
+        "reduce_structured": reduce_structured,
+        "find_renames": find_renames,
+        "find_copies": find_copies,
+        "rename_limit": rename_limit,
+    }
+    diff = None
+    if ctx.invoked_subcommand != "scan":
+        try:
+            diff = Diff(Path("."), **diff_options)
+        except NotARepo as not_a_repo:
+            print("Current directory is not a git repository")
+            raise typer.Abort() from not_a_repo
 
-    if not model.startswith("gpt"):
-        raise typer.BadParameter(
-            "Only gpt models are supported", ctx=ctx, param=model, param_hint="model"
-        )
-
-    client = OpenAI(api_key=openai_api_key)
-    try:
-        client.models.retrieve(model=model)
-    except AuthenticationError as auth_error:
-        raise typer.BadParameter(
-            "Invalid OpenAI API key", ctx=ctx, param=openai_api_key, param_hint="openai_api_key"
-        ) from auth_error
-    except NotFoundError as no_model:
-        raise typer.BadParameter(
-            f"{model} does not exist", ctx=ctx, param=model, param_hint="model"
-        ) from no_model
+    client = create_openai_client(ctx, openai_api_key, model)
+    for param_hint, extra_model in (("hedge_model", hedge_model), ("triage_model", triage_model)):
+        if extra_model is not None:
+            validate_model(ctx, client, extra_model, param_hint=param_hint)
 
     if system_prompt is None:
-        system_prompt = read_prompt("default")
+        system_prompt = read_prompt("default" if findings is None else "findings")
+
+    scheduler = None
+    if rate_limit_state is not None:
+        scheduler = RequestScheduler(rate_limit_state)
 
     ctx.obj = SimpleNamespace(
         diff=diff,
         client=client,
+        scheduler=scheduler,
+        rate_limit_state=rate_limit_state,
         openai_api_key=openai_api_key,
         model=model,
         temperature=temperature,
         system_prompt=system_prompt,
+        latency_budget=latency_budget,
+        hedge_model=hedge_model,
+        triage_model=triage_model,
+        map_reduce=map_reduce,
+        context_window=context_window,
+        findings=findings,
+        findings_output=findings_output,
         unified=unified,
+        diff_options=diff_options,
+        shard=shard,
+        results_dir=results_dir,
+        metrics_db=metrics_db,
+        record_metrics=record_metrics,
     )
 
 @app.command()
@@ -148,14 +591,18 @@ def merge(
 
 @app.command()
 def push(
-    ctx: typer.Context, remote: Annotated[str, typer.Argument(help="remote to push to")] = "origin"
+    ctx: typer.Context,
+    remote: Annotated[str, typer.Argument(help="remote to push to")] = "origin",
+    since_last_review: Annotated[
+        bool, typer.Option(help="review only the commits after the last reviewed one")
+    ] = False,
 ):
     """
     Review the changes between the HEAD and the remote
     """
     remote_head = f"{remote}/{ctx.obj.diff.repo.active_branch.name}"
     try:
-        ctx.obj.diff.push(remote)
+        ctx.obj.diff.push(remote, since_last_review=since_last_review)
     except InvalidRemote as invalid_remote:
         print(f"{remote} is not a valid remote")
         raise typer.BadParameter(
@@ -171,6 +618,7 @@ def push(
         raise typer.Abort() from not_ancestor
     handle_create_patch_errors(ctx.obj.diff)
     print_patch_review(ctx)
+    ctx.obj.diff.mark_reviewed()
 
 
 @app.command()
@@ -207,5 +655,120 @@ def pr(
     print_patch_review(ctx)
 
 
+@app.command()
+def scan(
+    ctx: typer.Context,
+    directory: Annotated[
+        Path, typer.Argument(help="directory to search for git repositories", file_okay=False)
+    ],
+    mode: Annotated[ScanMode, typer.Option(help="diff mode to review in each repository")] = (
+        ScanMode.add
+    ),
+    output_dir: Annotated[
+        Path, typer.Option(help="directory to write the reviews and the summary to")
+    ] = Path("gait-scan"),
+    workers: Annotated[
+        int, typer.Option(min=1, help="number of worker processes")
+    ] = os.cpu_count() or 1,
+    max_requests: Annotated[
+        int, typer.Option(min=1, help="maximum number of concurrent OpenAI requests")
+    ] = 4,
+    max_depth: Annotated[
+        int, typer.Option(min=0, help="directory levels below the directory to search")
+    ] = 3,
+):
+    """
+    Review the changes of every git repository under a directory
+    """
+    if ctx.obj.shard is not None:
+        raise typer.BadParameter(
+            "cannot be combined with scan, shard the repositories by directory instead",
+            ctx=ctx,
+            param_hint="--shard",
+        )
+    config = SimpleNamespace(
+        openai_api_key=ctx.obj.openai_api_key,
+        model=ctx.obj.model,
+        temperature=ctx.obj.temperature,
+        system_prompt=ctx.obj.system_prompt,
+        triage_model=ctx.obj.triage_model,
+        map_reduce=ctx.obj.map_reduce,
+        context_window=ctx.obj.context_window,
+        findings=ctx.obj.findings,
+        diff_options=ctx.obj.diff_options,
+        rate_limit_state=ctx.obj.rate_limit_state,
+        metrics_db=ctx.obj.metrics_db if ctx.obj.record_metrics else None,
+    )
+    summary = scan_repositories(
+        directory,
+        mode.value,
+        config,
+        output_dir,
+        max_workers=workers,
+        max_requests=max_requests,
+        max_depth=max_depth,
+    )
+    statuses = ", ".join(f"{count} {status}" for status, count in summary["statuses"].items())
+    print(
+        f"Scanned {summary['repositories']} repositories in {summary['seconds']:.1f}s"
+        f" ({statuses or 'nothing found'}), summary written to {output_dir / 'summary.json'}"
+    )
+
+
+@app.command()
+def stats(
+    ctx: typer.Context,
+    command: Annotated[str, typer.Option(help="only show the reviews of a command")] = None,
+    days: Annotated[
+        float, typer.Option(min=0, help="only show the reviews of the last days")
+    ] = None,
+    openmetrics: Annotated[
+        Path,
+        typer.Option(help="write the metrics in OpenMetrics text format to a file", dir_okay=False),
+    ] = None,
+):
+    """
+    Show the percentiles of the latency and the usage of the recorded reviews
+    """
+    since = None if days is None else time.time() - days * 86400
+    store = MetricsStore(ctx.obj.metrics_db)
+    records = store.records(command, since)
+    summary = summarize(records)
+    if openmetrics is not None:
+        # Counters must not decrease between scrapes, so they count all the records
+        if since is None:
+            write_openmetrics(summary, openmetrics)
+        else:
+            write_openmetrics(summarize(store.records(command)), openmetrics, window=summary)
+    if not records:
+        print("No reviews recorded")
+        return
+    print(format_summary(summary))
+
+
+@app.command()
+def merge_results(
+    results: Annotated[
+        List[Path],
+        typer.Argument(help="shard result files or directories of them", show_default=False),
+    ] = None,
+    output: Annotated[
+        Path, typer.Option(help="file to write the report to instead of the console")
+    ] = None,
+):
+    """
+    Stitch the reviews of the shards into a single report
+    """
+    try:
+        report = stitch_results(load_results(results or [Path("gait-results")]))
+    except (InvalidShardResults, OSError, ValueError, KeyError) as invalid_results:
+        print(f"Could not merge the shard results: {invalid_results}")
+        raise typer.Abort() from invalid_results
+    if output is None:
+        print(report, end="")
+    else:
+        output.write_text(report)
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,299 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI, Stream
+
+from .patch import FilePatch, Hunk
+from .scheduler import Priority, RequestScheduler, create_completion, estimate_tokens
+from .triage import batch_chunks
+from .utils import read_prompt
+
+# Context windows in tokens by model name prefix, the longest matching prefix wins
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-vision": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.5": 128000,
+    "gpt-5": 400000,
+}
+
+# Reasoning models reject max_tokens and any temperature but their default
+_REASONING_MODELS = ("gpt-5", "o1", "o3", "o4")
+
+
+def _sampling_options(model: str, temperature: float, max_tokens: Optional[int] = None) -> Dict:
+    """
+    Temperature and completion limit of a request, in the parameters the model accepts.
+
+    Args:
+        model (str): Model of the request.
+        temperature (float): Temperature of the request.
+        max_tokens (Optional[int], optional): Completion limit in tokens. Defaults to None.
+
+    Returns:
+        Dict: Parameters of the chat completion request.
+    """
+    if not model.startswith(_REASONING_MODELS):
+        options = {"temperature": temperature}
+        if max_tokens is not None:
+            options["max_tokens"] = max_tokens
+        return options
+    if max_tokens is None:
+        return {}
+    # Sent in the body, as older versions of the client do not know the parameter
+    return {"extra_body": {"max_completion_tokens": max_tokens}}
+
+
+def context_window(model: str) -> Optional[int]:
+    """
+    Look up the context window of a model.
+
+    Args:
+        model (str): The model.
+
+    Returns:
+        Optional[int]: The context window in tokens, None for unknown models.
+    """
+    prefixes = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not prefixes:
+        return None
+    return CONTEXT_WINDOWS[max(prefixes, key=len)]
+
+
+def split_hunk(hunk: Hunk, chunk_tokens: int) -> List[Hunk]:
+    """
+    Split a hunk into consecutive hunks of at most chunk_tokens estimated tokens.
+
+    Args:
+        hunk (Hunk): The hunk.
+        chunk_tokens (int): Estimated tokens of a part.
+
+    Returns:
+        List[Hunk]: The parts, with the line numbers of their headers adjusted.
+    """
+    if hunk.old_start is None or estimate_tokens(hunk.render()) <= chunk_tokens:
+        return [hunk]
+    max_chars = chunk_tokens * 4
+    parts = []
+    old_line, new_line = hunk.old_start, hunk.new_start
+    lines, chars = [], 0
+    for line in hunk.lines + [None]:
+        if lines and (line is None or chars + len(line) + 1 > max_chars):
+            old_length = sum(1 for part_line in lines if part_line[:1] in (" ", "-"))
+            new_length = sum(1 for part_line in lines if part_line[:1] in (" ", "+"))
+            header = f"@@ -{old_line},{old_length} +{new_line},{new_length} @@"
+            parts.append(Hunk(header, lines))
+            old_line, new_line = old_line + old_length, new_line + new_length
+            lines, chars = [], 0
+        if line is not None:
+            # A single line above the budget, such as minified code, is cut
+            lines.append(line[:max_chars])
+            chars += min(len(line), max_chars) + 1
+    return parts
+
+
+def split_file_patches(
+    file_patches: List[FilePatch], chunk_tokens: int
+) -> List[Tuple[List[str], str]]:
+    """
+    Pack the file patches into parts of at most chunk_tokens estimated tokens.
+
+    Small files are packed together, large files are split between their hunks and hunks
+    larger than a part are split between their lines.
+
+    Args:
+        file_patches (List[FilePatch]): The file patches.
+        chunk_tokens (int): Estimated tokens of a part.
+
+    Returns:
+        List[Tuple[List[str], str]]: Paths of the files in each part and the part's patch.
+    """
+    pieces = []
+    for file_patch in file_patches:
+        rendered = file_patch.render()
+        if estimate_tokens(rendered) <= chunk_tokens:
+            pieces.append((file_patch.path, rendered))
+            continue
+        hunks = []
+        for hunk in file_patch.hunks:
+            hunks += split_hunk(hunk, chunk_tokens - estimate_tokens(file_patch.render([])))
+        for hunk in hunks:
+            pieces.append((file_patch.path, file_patch.render([hunk])))
+
+    parts = []
+    for batch in batch_chunks(dict(enumerate(piece for _, piece in pieces)), chunk_tokens):
+        paths = list(dict.fromkeys(pieces[index][0] for index in batch))
+        parts.append((paths, "\n".join(pieces[index][1] for index in batch)))
+    return parts
+
+
+class MapReduceReview:
+    """
+    Reviews a patch larger than the context window of the model in parts.
+
+    The parts are reviewed concurrently into compact findings, which are merged level by level
+    until they fit in the context window, and a final request streams the review written from
+    them. Each level shrinks the findings at least fourfold, so the number of levels grows with
+    the logarithm of the patch size.
+    """
+
+    def __init__(
+        self,
+        openai_client: OpenAI,
+        model: str,
+        temperature: float,
+        scheduler: Optional[RequestScheduler] = None,
+        priority: Priority = Priority.interactive,
+        context_tokens: Optional[int] = None,
+        max_workers: int = 8,
+        system_prompt: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize the MapReduceReview class.
+
+        Args:
+            openai_client (OpenAI): The OpenAI client.
+            model (str): Model to use for the review.
+            temperature (float): Temperature parameter for the model.
+            scheduler (Optional[RequestScheduler], optional): Scheduler to wait for a slot within
+            the rate limits before sending the requests. Defaults to None.
+            priority (Priority, optional): Priority of the requests in the scheduler.
+            Defaults to interactive.
+            context_tokens (Optional[int], optional): Context window of the model in tokens.
+            Defaults to the known context window of the model.
+            max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+            system_prompt (Optional[str], optional): System prompt of the review, which the final
+            review follows along with the instructions to merge the findings. Defaults to None.
+
+        Raises:
+            ValueError: When the context window is not given and the model is unknown.
+        """
+        self.openai_client = openai_client
+        self.model = model
+        self.temperature = temperature
+        self.scheduler = scheduler
+        self.priority = priority
+        self.context_tokens = context_tokens or context_window(model)
+        if self.context_tokens is None:
+            raise ValueError(f"Unknown context window of {model}")
+        self.max_workers = max_workers
+        # Room left for the completion in every request
+        self.output_tokens = min(4096, self.context_tokens // 4)
+        self.prompts = {
+            name: read_prompt(name) for name in ("map", "combine", "reduce", "reduce_findings")
+        }
+        if system_prompt is not None:
+            for name in ("reduce", "reduce_findings"):
+                self.prompts[name] = f"{system_prompt}\n\n{self.prompts[name]}"
+        prompt_tokens = max(estimate_tokens(prompt) for prompt in self.prompts.values())
+        self.input_tokens = self.context_tokens - self.output_tokens - prompt_tokens
+        self.findings_tokens = max(64, min(1024, self.input_tokens // 4))
+        self.parts = 0
+        self.levels = 0
+
+    def fits(self, prompt: str) -> bool:
+        """
+        Check whether a prompt and its completion fit in the context window of the model.
+
+        Args:
+            prompt (str): The system prompt and the patch.
+
+        Returns:
+            bool: Whether the prompt can be sent in a single request.
+        """
+        return estimate_tokens(prompt) + self.output_tokens <= self.context_tokens
+
+    def _complete(self, prompt: str, content: str) -> str:
+        completion = create_completion(
+            self.openai_client,
+            self.scheduler,
+            self.priority,
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.prompts[prompt]},
+                {"role": "user", "content": content},
+            ],
+            **_sampling_options(self.model, self.temperature, self.findings_tokens),
+        )
+        return completion.choices[0].message.content.strip()
+
+    def _map(self, parts: List[Tuple[List[str], str]]) -> List[str]:
+        """
+        Review the parts concurrently. A failed part is reported as a finding, unless all failed.
+        """
+
+        def review_part(part: Tuple[List[str], str]):
+            try:
+                return self._complete("map", part[1])
+            except Exception as err:
+                return err
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(parts))) as executor:
+            results = list(executor.map(review_part, parts))
+        if all(isinstance(result, Exception) for result in results):
+            raise results[0]
+        findings = []
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                path = parts[index][0][0]
+                result = f"- {path}: [low] This part of the patch could not be reviewed."
+            findings.append(result)
+        return findings
+
+    def _combine(self, findings: List[str]) -> List[str]:
+        "Merge the findings in groups that fit in a request."
+        groups = batch_chunks(dict(enumerate(findings)), self.input_tokens)
+
+        def combine_group(group: List[int]) -> str:
+            content = "\n".join(findings[index] for index in group)
+            if len(group) == 1 and estimate_tokens(content) <= self.findings_tokens:
+                return content
+            return self._complete("combine", content)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as executor:
+            return list(executor.map(combine_group, groups))
+
+    def review(
+        self, file_patches: List[FilePatch], response_format: Optional[Dict] = None
+    ) -> Stream:
+        """
+        Review the file patches in parts and stream the review merged from their findings.
+
+        Args:
+            file_patches (List[FilePatch]): The file patches.
+            response_format (Optional[Dict], optional): Response format of a structured review,
+            whose findings are merged into JSON instead of prose. Defaults to None.
+
+        Returns:
+            Stream: Chat completion stream of the merged review.
+        """
+        parts = split_file_patches(file_patches, self.input_tokens)
+        self.parts = len(parts)
+        findings = self._map(parts)
+        self.levels = 1
+        # Estimated tokens can exceed the completion limit, the level cap ensures an end
+        while estimate_tokens("\n".join(findings)) > self.input_tokens and self.levels < 8:
+            findings = self._combine(findings)
+            self.levels += 1
+        reduce_prompt, request = "reduce", {}
+        if response_format is not None:
+            reduce_prompt, request["response_format"] = "reduce_findings", response_format
+        return create_completion(
+            self.openai_client,
+            self.scheduler,
+            self.priority,
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.prompts[reduce_prompt]},
+                {"role": "user", "content": "\n".join(findings)},
+            ],
+            stream=True,
+            **_sampling_options(self.model, self.temperature),
+            **request,
+        )
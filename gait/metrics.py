@@ -0,0 +1,468 @@
+import math
+import os
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import typer
+
+from .scheduler import estimate_tokens
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+@dataclass
+class ReviewRecord:
+    """
+    Usage and latency of a single review. Token counts are estimates, the output tokens are the
+    number of streamed chunks.
+    """
+
+    command: str
+    patch_bytes: int
+    files: int
+    input_tokens: int
+    output_tokens: int
+    ttft_seconds: Optional[float]
+    duration_seconds: float
+    cache_hits: int = 0
+    hedge_winner: Optional[str] = None
+    diff_seconds: Optional[float] = None
+    renamed_files: int = 0
+    timestamp: float = field(default_factory=time.time)
+
+
+_COLUMN_TYPES = {
+    int: "INTEGER",
+    float: "REAL",
+    str: "TEXT",
+    Optional[float]: "REAL",
+    Optional[str]: "TEXT",
+}
+
+
+def default_metrics_path() -> Path:
+    """
+    Path of the metrics store in the application directory of gait.
+
+    Returns:
+        Path: Path of the SQLite database.
+    """
+    return Path(typer.get_app_dir("gait")) / "metrics.sqlite"
+
+
+def percentile(values: List[float], quantile: float) -> Optional[float]:
+    """
+    Compute a percentile of the values by linear interpolation.
+
+    Args:
+        values (List[float]): The values.
+        quantile (float): The quantile between 0 and 1.
+
+    Returns:
+        Optional[float]: The percentile, None when there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * quantile
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class StreamTimer:
+    """
+    Wraps a chat completion stream to measure the time to first token and count the chunks.
+    """
+
+    def __init__(self, stream: Iterable, start: Optional[float] = None) -> None:
+        """
+        Initialize the StreamTimer class.
+
+        Args:
+            stream (Iterable): The chat completion stream.
+            start (Optional[float], optional): perf_counter value the request was sent at.
+            Defaults to now.
+        """
+        self.stream = stream
+        self.start = time.perf_counter() if start is None else start
+        self.ttft_seconds = None
+        self.chunks = 0
+
+    def __iter__(self) -> Iterator:
+        for chunk in self.stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if self.ttft_seconds is None:
+                    self.ttft_seconds = time.perf_counter() - self.start
+                self.chunks += 1
+            yield chunk
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def review_record(command: str, diff, system_prompt: str, timer: StreamTimer) -> ReviewRecord:
+    """
+    Create the record of a finished review.
+
+    Args:
+        command (str): The gait command that ran the review.
+        diff (Diff): The reviewed Diff object.
+        system_prompt (str): System prompt used for the review.
+        timer (StreamTimer): Timer of the consumed review stream.
+
+    Returns:
+        ReviewRecord: The record.
+    """
+    return ReviewRecord(
+        command=command,
+        patch_bytes=len(diff.patch.encode("utf-8")),
+        files=len(diff.diffs),
+        input_tokens=estimate_tokens(system_prompt + diff.patch),
+        output_tokens=timer.chunks,
+        ttft_seconds=timer.ttft_seconds,
+        duration_seconds=timer.elapsed,
+        cache_hits=diff.symbol_cache.hits,
+        hedge_winner=diff.hedge_winner,
+        diff_seconds=diff.diff_seconds,
+        renamed_files=sum(
+            1
+            for file_patch in diff.file_patches
+            if file_patch.renamed_file or file_patch.copied_file
+        ),
+    )
+
+
+class MetricsStore:
+    """
+    Append-only SQLite store of the review records.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Initialize the MetricsStore class.
+
+        Args:
+            path (Path): Path of the SQLite database.
+        """
+        self.path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        columns = {
+            record_field.name: _COLUMN_TYPES[record_field.type]
+            for record_field in fields(ReviewRecord)
+        }
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            + ", ".join(f"{name} {column_type}" for name, column_type in columns.items())
+            + ")"
+        )
+        # Add the columns of newer gait versions to older stores
+        existing = {row[1] for row in connection.execute("PRAGMA table_info(reviews)")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                try:
+                    connection.execute(f"ALTER TABLE reviews ADD COLUMN {name} {column_type}")
+                except sqlite3.OperationalError:
+                    # Another process added it in the meantime
+                    pass
+        return connection
+
+    def record(self, review_record: ReviewRecord) -> None:
+        """
+        Append a record to the store.
+
+        Args:
+            review_record (ReviewRecord): The record.
+        """
+        values = asdict(review_record)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    f"INSERT INTO reviews ({', '.join(values)}) "
+                    f"VALUES ({', '.join('?' for _ in values)})",
+                    list(values.values()),
+                )
+        finally:
+            connection.close()
+
+    def records(
+        self, command: Optional[str] = None, since: Optional[float] = None
+    ) -> List[ReviewRecord]:
+        """
+        Read the records from the store.
+
+        Args:
+            command (Optional[str], optional): Only read the records of a command.
+            Defaults to None.
+            since (Optional[float], optional): Only read the records after a timestamp.
+            Defaults to None.
+
+        Returns:
+            List[ReviewRecord]: The records, oldest first.
+        """
+        names = [record_field.name for record_field in fields(ReviewRecord)]
+        query = f"SELECT {', '.join(names)} FROM reviews WHERE 1 = 1"
+        parameters = []
+        if command is not None:
+            query += " AND command = ?"
+            parameters.append(command)
+        if since is not None:
+            query += " AND timestamp >= ?"
+            parameters.append(since)
+        connection = self._connect()
+        try:
+            rows = connection.execute(query + " ORDER BY timestamp", parameters).fetchall()
+        finally:
+            connection.close()
+        return [
+            ReviewRecord(**{name: row[index] for index, name in enumerate(names)}) for row in rows
+        ]
+
+
+def _quantiles(values: List[float]) -> Dict[float, Optional[float]]:
+    return {quantile: percentile(values, quantile) for quantile in QUANTILES}
+
+
+def _count_hedges(records: List[ReviewRecord]) -> Dict[str, int]:
+    "Count the hedged reviews by the request that won."
+    hedges: Dict[str, int] = {}
+    for review_record in records:
+        if review_record.hedge_winner is not None:
+            hedges[review_record.hedge_winner] = hedges.get(review_record.hedge_winner, 0) + 1
+    return dict(sorted(hedges.items()))
+
+
+def summarize(records: List[ReviewRecord]) -> Dict[str, Dict]:
+    """
+    Summarize the records by command.
+
+    Args:
+        records (List[ReviewRecord]): The records.
+
+    Returns:
+        Dict[str, Dict]: Count, percentiles and totals of each command.
+    """
+    by_command: Dict[str, List[ReviewRecord]] = {}
+    for review_record in records:
+        by_command.setdefault(review_record.command, []).append(review_record)
+    summary = {}
+    for command, command_records in sorted(by_command.items()):
+        durations = [review_record.duration_seconds for review_record in command_records]
+        ttfts = [
+            review_record.ttft_seconds
+            for review_record in command_records
+            if review_record.ttft_seconds is not None
+        ]
+        diff_seconds = [
+            review_record.diff_seconds
+            for review_record in command_records
+            if review_record.diff_seconds is not None
+        ]
+        summary[command] = {
+            "count": len(command_records),
+            "duration_seconds": _quantiles(durations),
+            "duration_seconds_sum": sum(durations),
+            "ttft_seconds": _quantiles(ttfts),
+            "ttft_seconds_sum": sum(ttfts),
+            "ttft_seconds_count": len(ttfts),
+            "diff_seconds": _quantiles(diff_seconds),
+            "diff_seconds_sum": sum(diff_seconds),
+            "diff_seconds_count": len(diff_seconds),
+            "input_tokens": sum(record.input_tokens for record in command_records),
+            "output_tokens": sum(record.output_tokens for record in command_records),
+            "patch_bytes": sum(record.patch_bytes for record in command_records),
+            # Stores of older gait versions have no cache hits or renamed files
+            "cache_hits": sum(record.cache_hits or 0 for record in command_records),
+            "renamed_files": sum(record.renamed_files or 0 for record in command_records),
+            "hedges": _count_hedges(command_records),
+        }
+    return summary
+
+
+def _format_seconds(quantiles: Dict[float, Optional[float]]) -> str:
+    return "/".join("-" if value is None else f"{value:.2f}" for value in quantiles.values())
+
+
+def _format_hedges(hedges: Dict[str, int]) -> str:
+    return ",".join(f"{winner}={count}" for winner, count in hedges.items()) or "-"
+
+
+def format_summary(summary: Dict[str, Dict]) -> str:
+    """
+    Format the summary as a table for the console.
+
+    Args:
+        summary (Dict[str, Dict]): Summary created by summarize.
+
+    Returns:
+        str: The table.
+    """
+    quantiles = "/".join(f"p{quantile * 100:g}" for quantile in QUANTILES)
+    rows = [
+        (
+            "command",
+            "reviews",
+            f"duration {quantiles} (s)",
+            f"ttft {quantiles} (s)",
+            f"diff {quantiles} (s)",
+            "input tokens",
+            "output tokens",
+            "patch bytes",
+            "cache hits",
+            "renamed files",
+            "hedge winners",
+        )
+    ]
+    for command, stats in summary.items():
+        rows.append(
+            (
+                command,
+                str(stats["count"]),
+                _format_seconds(stats["duration_seconds"]),
+                _format_seconds(stats["ttft_seconds"]),
+                _format_seconds(stats["diff_seconds"]),
+                str(stats["input_tokens"]),
+                str(stats["output_tokens"]),
+                str(stats["patch_bytes"]),
+                str(stats["cache_hits"]),
+                str(stats["renamed_files"]),
+                _format_hedges(stats["hedges"]),
+            )
+        )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(value.ljust(widths[column]) for column, value in enumerate(row)).rstrip()
+        for row in rows
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_SUMMARIES = (
+    ("duration_seconds", "Duration of the reviews from request to the end of the stream."),
+    ("ttft_seconds", "Time from the request to the first streamed token."),
+    ("diff_seconds", "Time git took to diff, including the rename and copy detection."),
+)
+_COUNTERS = (
+    ("input_tokens", "Estimated input tokens sent for review."),
+    ("output_tokens", "Estimated output tokens streamed by the reviews."),
+    ("patch_bytes", "Bytes of the reviewed patches."),
+    ("cache_hits", "Symbol index cache hits."),
+    ("renamed_files", "Renamed or copied files sent as their content delta."),
+)
+
+
+def _summary_lines(totals: Dict[str, Dict], window: Optional[Dict[str, Dict]]) -> List[str]:
+    "Render the quantiles of the window, or of all time without one, with the all-time totals."
+    quantiles = totals if window is None else window
+    lines = []
+    for name, help_text in _SUMMARIES:
+        lines += [
+            f"# TYPE gait_review_{name} summary",
+            f"# HELP gait_review_{name} {help_text}",
+        ]
+        for command, stats in totals.items():
+            # Commands without records in the window have no current quantiles
+            command_quantiles = quantiles[command][name] if command in quantiles else {}
+            for quantile, value in command_quantiles.items():
+                if value is not None:
+                    lines.append(
+                        f'gait_review_{name}{{command="{command}",quantile="{quantile}"}} '
+                        f"{_format_value(value)}"
+                    )
+            count = stats["count"] if name == "duration_seconds" else stats[f"{name}_count"]
+            total = _format_value(stats[f"{name}_sum"])
+            lines.append(f'gait_review_{name}_sum{{command="{command}"}} {total}')
+            lines.append(f'gait_review_{name}_count{{command="{command}"}} {count}')
+    return lines
+
+
+def _counter_lines(totals: Dict[str, Dict]) -> List[str]:
+    "Render the all-time totals as counters."
+    lines = []
+    for name, help_text in _COUNTERS:
+        lines += [f"# TYPE gait_{name} counter", f"# HELP gait_{name} {help_text}"]
+        for command, stats in totals.items():
+            lines.append(f'gait_{name}_total{{command="{command}"}} {stats[name]}')
+    lines += [
+        "# TYPE gait_review_hedge_winner counter",
+        "# HELP gait_review_hedge_winner Reviews with a latency budget by the request that won.",
+    ]
+    for command, stats in totals.items():
+        for winner, count in stats["hedges"].items():
+            lines.append(
+                f'gait_review_hedge_winner_total{{command="{command}",winner="{winner}"}} {count}'
+            )
+    return lines
+
+
+def _gauge_lines(window: Dict[str, Dict]) -> List[str]:
+    "Render the totals of a window of time as gauges, as they decrease when the window moves."
+    lines = []
+    for name, help_text in (("reviews", "Reviews."),) + _COUNTERS:
+        lines += [
+            f"# TYPE gait_{name}_window gauge",
+            f"# HELP gait_{name}_window {help_text[:-1]} in the window of the last days.",
+        ]
+        for command, stats in window.items():
+            value = stats["count"] if name == "reviews" else stats[name]
+            lines.append(f'gait_{name}_window{{command="{command}"}} {value}')
+    lines += [
+        "# TYPE gait_review_hedge_winner_window gauge",
+        "# HELP gait_review_hedge_winner_window Reviews with a latency budget by the request that"
+        " won, in the window of the last days.",
+    ]
+    for command, stats in window.items():
+        for winner, count in stats["hedges"].items():
+            lines.append(
+                f'gait_review_hedge_winner_window{{command="{command}",winner="{winner}"}} {count}'
+            )
+    return lines
+
+
+def to_openmetrics(totals: Dict[str, Dict], window: Optional[Dict[str, Dict]] = None) -> str:
+    """
+    Render the summaries in the OpenMetrics text format.
+
+    The counters and the sums and counts of the summaries are all-time totals, so that they never
+    decrease between scrapes. The values of a window of time are exposed as gauges instead.
+
+    Args:
+        totals (Dict[str, Dict]): Summary of all the records, created by summarize.
+        window (Optional[Dict[str, Dict]], optional): Summary of the records of a window of time,
+        for the quantiles and the gauges. Defaults to None, for no window.
+
+    Returns:
+        str: The metrics, ending with the # EOF marker.
+    """
+    lines = _summary_lines(totals, window) + _counter_lines(totals)
+    if window is not None:
+        lines += _gauge_lines(window)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_openmetrics(
+    totals: Dict[str, Dict], path: Path, window: Optional[Dict[str, Dict]] = None
+) -> None:
+    """
+    Atomically write the summaries in the OpenMetrics text format, for textfile collectors.
+
+    Args:
+        totals (Dict[str, Dict]): Summary of all the records, created by summarize.
+        path (Path): Path of the metrics file.
+        window (Optional[Dict[str, Dict]], optional): Summary of the records of a window of time.
+        Defaults to None.
+    """
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp_path.write_text(to_openmetrics(totals, window))
+    os.replace(tmp_path, path)
@@ -0,0 +1,133 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from git import diff
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+@dataclass
+class Hunk:
+    """
+    A hunk of a file patch, its header and its lines with their " ", "+" or "-" prefixes.
+    """
+
+    header: str
+    lines: List[str] = field(default_factory=list)
+
+    def _header_field(self, group: int, default: Optional[int] = None) -> Optional[int]:
+        match = _HUNK_HEADER.match(self.header)
+        if match is None or match.group(group) is None:
+            return default
+        return int(match.group(group))
+
+    @property
+    def old_start(self) -> Optional[int]:
+        return self._header_field(1)
+
+    @property
+    def old_length(self) -> Optional[int]:
+        return self._header_field(2, 1)
+
+    @property
+    def new_start(self) -> Optional[int]:
+        return self._header_field(3)
+
+    @property
+    def new_length(self) -> Optional[int]:
+        return self._header_field(4, 1)
+
+    @property
+    def changes(self) -> List[str]:
+        "Added and removed lines of the hunk."
+        return [line for line in self.lines if line[:1] in ("+", "-")]
+
+    def render(self) -> str:
+        return "\n".join([self.header] + self.lines) + "\n"
+
+
+@dataclass
+class FilePatch:
+    """
+    The patch of a single file, split into hunks.
+    """
+
+    a_path: Optional[str]
+    b_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+    preamble: str = ""
+    new_file: bool = False
+    deleted_file: bool = False
+    renamed_file: bool = False
+    copied_file: bool = False
+
+    @property
+    def path(self) -> str:
+        return self.b_path or self.a_path
+
+    @classmethod
+    def from_diff(cls, git_diff: diff.Diff) -> "FilePatch":
+        """
+        Parse the patch of a GitPython diff.
+
+        Args:
+            git_diff (diff.Diff): Diff created with create_patch=True.
+
+        Returns:
+            FilePatch: The parsed file patch.
+        """
+        file_patch = cls(
+            a_path=git_diff.a_path,
+            b_path=git_diff.b_path,
+            new_file=git_diff.new_file,
+            deleted_file=git_diff.deleted_file,
+            renamed_file=git_diff.renamed_file,
+            copied_file=git_diff.copied_file,
+        )
+        file_patch.hunks, file_patch.preamble = parse_hunks(git_diff.diff.decode("utf-8"))
+        return file_patch
+
+    def render_header(self) -> str:
+        # Moved files take a single line, their hunks are only the content delta
+        if self.renamed_file or self.copied_file:
+            return f"{'rename' if self.renamed_file else 'copy'} {self.a_path} => {self.b_path}\n"
+        a_path = "/dev/null" if self.new_file else f"a/{self.a_path or self.b_path}"
+        b_path = "/dev/null" if self.deleted_file else f"b/{self.b_path or self.a_path}"
+        return f"--- {a_path}\n+++ {b_path}\n"
+
+    def render(self, hunks: Optional[List[Hunk]] = None) -> str:
+        """
+        Render the file patch with its file header.
+
+        Args:
+            hunks (Optional[List[Hunk]], optional): Hunks to render instead of the file's own.
+            Defaults to None.
+
+        Returns:
+            str: The rendered file patch.
+        """
+        hunks = self.hunks if hunks is None else hunks
+        return self.render_header() + self.preamble + "".join(hunk.render() for hunk in hunks)
+
+
+def parse_hunks(patch: str) -> Tuple[List[Hunk], str]:
+    """
+    Split the patch of a single file into hunks.
+
+    Args:
+        patch (str): Patch of a single file, starting at its first hunk header.
+
+    Returns:
+        Tuple[List[Hunk], str]: The hunks and any text before the first hunk.
+    """
+    hunks = []
+    preamble = []
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            hunks.append(Hunk(line))
+        elif hunks:
+            hunks[-1].lines.append(line)
+        else:
+            preamble.append(line)
+    return hunks, "".join(line + "\n" for line in preamble)
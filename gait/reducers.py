@@ -0,0 +1,256 @@
+import difflib
+import json
+import re
+from fnmatch import fnmatch
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Reducers turn the old and new content of a file into the lines of a semantic diff, or None
+# when they cannot parse it
+Reducer = Callable[[Optional[str], Optional[str]], Optional[List[str]]]
+
+_REDUCERS: List[Tuple[Tuple[str, ...], str, Reducer]] = []
+_TOML_PACKAGE = re.compile(r'^\[\[package\]\]\s*\nname = "([^"]+)"\s*\nversion = "([^"]+)"', re.M)
+_MAX_VALUE_LENGTH = 80
+
+
+def register_reducer(description: str, *patterns: str) -> Callable[[Reducer], Reducer]:
+    """
+    Register a reducer for the files whose name matches one of the patterns.
+
+    Reducers registered first take precedence, so specific patterns such as poetry.lock must be
+    registered before generic ones such as *.json.
+
+    Args:
+        description (str): What the semantic diff shows, such as "notebook cell sources".
+        *patterns (str): fnmatch patterns of the file names.
+
+    Returns:
+        Callable[[Reducer], Reducer]: Decorator registering the reducer.
+    """
+
+    def decorator(reducer: Reducer) -> Reducer:
+        _REDUCERS.append((patterns, description, reducer))
+        return reducer
+
+    return decorator
+
+
+def find_reducer(path: str) -> Optional[Tuple[str, Reducer]]:
+    """
+    Find the reducer of a file.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        Optional[Tuple[str, Reducer]]: Description and reducer, None when no reducer matches.
+    """
+    name = path.rsplit("/", 1)[-1]
+    for patterns, description, reducer in _REDUCERS:
+        if any(fnmatch(name, pattern) for pattern in patterns):
+            return description, reducer
+    return None
+
+
+def reduce_file(path: str, old: Optional[bytes], new: Optional[bytes]) -> Optional[str]:
+    """
+    Compute the semantic diff of a file from its old and new content.
+
+    Args:
+        path (str): Path of the file.
+        old (Optional[bytes]): Content before the change, None for new files.
+        new (Optional[bytes]): Content after the change, None for deleted files.
+
+    Returns:
+        Optional[str]: The semantic diff, None when no reducer matches or the content cannot be
+        parsed.
+    """
+    found = find_reducer(path)
+    if found is None:
+        return None
+    description, reducer = found
+    try:
+        lines = reducer(
+            None if old is None else old.decode("utf-8"),
+            None if new is None else new.decode("utf-8"),
+        )
+    except (ValueError, TypeError, AttributeError, KeyError):
+        return None
+    if lines is None:
+        return None
+    lines = lines or ["# No semantic changes"]
+    return f"# Semantic diff of the {description}, the raw hunks are left out\n" + "".join(
+        line + "\n" for line in lines
+    )
+
+
+def _short(value: str) -> str:
+    if len(value) <= _MAX_VALUE_LENGTH:
+        return value
+    return f"{value[:_MAX_VALUE_LENGTH]}... ({len(value)} characters)"
+
+
+def diff_mappings(old: Dict[str, str], new: Dict[str, str], separator: str) -> List[str]:
+    """
+    Diff two mappings into added, removed and changed lines.
+
+    Args:
+        old (Dict[str, str]): The mapping before the change.
+        new (Dict[str, str]): The mapping after the change.
+        separator (str): Separator between a key and its value, such as ": ".
+
+    Returns:
+        List[str]: "+ key value" for added keys, "- key value" for removed keys and
+        "~ key old -> new" for changed values, in key order.
+    """
+    lines = []
+    for key in sorted(old.keys() | new.keys()):
+        if key not in old:
+            lines.append(f"+ {key}{separator}{_short(new[key])}")
+        elif key not in new:
+            lines.append(f"- {key}{separator}{_short(old[key])}")
+        elif old[key] != new[key]:
+            lines.append(f"~ {key}{separator}{_short(old[key])} -> {_short(new[key])}")
+    return lines
+
+
+def _notebook_cells(source: Optional[str]) -> Tuple[List[str], List[str]]:
+    "Lines of the cell sources and the outputs of each cell of a notebook."
+    if source is None:
+        return [], []
+    lines, outputs = [], []
+    for index, cell in enumerate(json.loads(source).get("cells", [])):
+        cell_source = cell.get("source", "")
+        if isinstance(cell_source, list):
+            cell_source = "".join(cell_source)
+        lines.append(f"# %% [{cell.get('cell_type', 'code')}] cell {index + 1}")
+        lines += cell_source.splitlines()
+        outputs.append(json.dumps(cell.get("outputs", []), sort_keys=True))
+    return lines, outputs
+
+
+@register_reducer("notebook cell sources", "*.ipynb")
+def reduce_notebook(old: Optional[str], new: Optional[str]) -> List[str]:
+    "Diff the cell sources of a notebook, leaving out the outputs and the metadata."
+    old_lines, old_outputs = _notebook_cells(old)
+    new_lines, new_outputs = _notebook_cells(new)
+    lines = list(difflib.unified_diff(old_lines, new_lines, lineterm="", n=1))[2:]
+    changed_outputs = sum(
+        1
+        for index, output in enumerate(new_outputs)
+        if index >= len(old_outputs) or old_outputs[index] != output
+    )
+    if changed_outputs:
+        lines.append(f"# Outputs changed in {changed_outputs} cells, not shown")
+    return lines
+
+
+def _versions(packages: List[Tuple[str, str]]) -> Dict[str, str]:
+    versions: Dict[str, Set[str]] = {}
+    for name, version in packages:
+        versions.setdefault(name, set()).add(version)
+    return {name: ", ".join(sorted(found)) for name, found in versions.items()}
+
+
+def _toml_lock_versions(source: Optional[str]) -> Dict[str, str]:
+    return _versions(_TOML_PACKAGE.findall(source or ""))
+
+
+@register_reducer("locked package versions", "poetry.lock", "Cargo.lock")
+def reduce_toml_lock(old: Optional[str], new: Optional[str]) -> List[str]:
+    "Diff the package versions of a poetry.lock or Cargo.lock."
+    return diff_mappings(_toml_lock_versions(old), _toml_lock_versions(new), " ")
+
+
+def _npm_lock_versions(source: Optional[str]) -> Dict[str, str]:
+    if source is None:
+        return {}
+    lock = json.loads(source)
+    packages = []
+    # Lockfile version 2 and 3 list the packages by path, version 1 by name
+    for path, package in lock.get("packages", {}).items():
+        if path and "version" in package:
+            packages.append((path.split("node_modules/", 1)[-1], package["version"]))
+    if "packages" not in lock:
+        for name, package in lock.get("dependencies", {}).items():
+            packages.append((name, package.get("version", "")))
+    return _versions(packages)
+
+
+@register_reducer("locked package versions", "package-lock.json", "npm-shrinkwrap.json")
+def reduce_npm_lock(old: Optional[str], new: Optional[str]) -> List[str]:
+    "Diff the package versions of a package-lock.json."
+    return diff_mappings(_npm_lock_versions(old), _npm_lock_versions(new), " ")
+
+
+def _pipfile_lock_versions(source: Optional[str]) -> Dict[str, str]:
+    if source is None:
+        return {}
+    lock = json.loads(source)
+    packages = []
+    for section in ("default", "develop"):
+        for name, package in lock.get(section, {}).items():
+            packages.append((name, package.get("version", "").lstrip("=")))
+    return _versions(packages)
+
+
+@register_reducer("locked package versions", "Pipfile.lock")
+def reduce_pipfile_lock(old: Optional[str], new: Optional[str]) -> List[str]:
+    "Diff the package versions of a Pipfile.lock."
+    return diff_mappings(_pipfile_lock_versions(old), _pipfile_lock_versions(new), " ")
+
+
+def flatten(value, path: str = "$") -> Dict[str, str]:
+    """
+    Flatten a parsed JSON or YAML document into its key paths and scalar values.
+
+    Args:
+        value: The parsed document.
+        path (str, optional): Key path of the value. Defaults to "$", the root.
+
+    Returns:
+        Dict[str, str]: JSON encoded scalars, empty objects and empty arrays by key path.
+    """
+    if isinstance(value, dict) and value:
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{path}.{key}"))
+        return flat
+    if isinstance(value, list) and value:
+        flat = {}
+        for index, item in enumerate(value):
+            flat.update(flatten(item, f"{path}[{index}]"))
+        return flat
+    return {path: json.dumps(value, default=str)}
+
+
+@register_reducer("key paths", "*.json")
+def reduce_json(old: Optional[str], new: Optional[str]) -> List[str]:
+    "Diff the key paths of a JSON document."
+    old_flat = {} if old is None else flatten(json.loads(old))
+    new_flat = {} if new is None else flatten(json.loads(new))
+    return diff_mappings(old_flat, new_flat, ": ")
+
+
+def _load_yaml(source: str):
+    "Load a YAML file, as a list when it has several documents."
+    documents = list(yaml.safe_load_all(source))
+    return documents[0] if len(documents) == 1 else documents
+
+
+@register_reducer("key paths", "*.yaml", "*.yml")
+def reduce_yaml(old: Optional[str], new: Optional[str]) -> Optional[List[str]]:
+    "Diff the key paths of a YAML document, when PyYAML is installed."
+    if yaml is None:
+        return None
+    try:
+        old_flat = {} if old is None else flatten(_load_yaml(old))
+        new_flat = {} if new is None else flatten(_load_yaml(new))
+    except yaml.YAMLError:
+        return None
+    return diff_mappings(old_flat, new_flat, ": ")
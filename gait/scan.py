@@ -0,0 +1,287 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import Enum
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from .diff import Diff
+from .errors import (
+    InvalidRemote,
+    InvalidTree,
+    NoCodeChanges,
+    NoDiffs,
+    NotAncestor,
+    NotARepo,
+)
+from .findings import FindingsFormat, parse_findings, render_findings
+from .metrics import MetricsStore, StreamTimer, review_record
+from .scheduler import Priority, RequestScheduler
+from .utils import read_prompt, read_stream
+
+
+class ScanMode(str, Enum):
+    add = "add"
+    commit = "commit"
+    push = "push"
+
+
+# Extension of the review files, by findings format for structured reviews
+_REVIEW_SUFFIXES = {
+    None: ".md",
+    FindingsFormat.terminal: ".txt",
+    FindingsFormat.json: ".json",
+    FindingsFormat.sarif: ".sarif",
+}
+
+# Semaphore shared by the worker processes to cap the concurrent LLM requests
+_llm_slots = None
+
+
+def find_repositories(root: Path, max_depth: int = 3) -> List[Path]:
+    """
+    Find the git repositories under a directory.
+
+    Args:
+        root (Path): The directory to search.
+        max_depth (int, optional): How many directory levels below the root to search.
+        Defaults to 3.
+
+    Returns:
+        List[Path]: Sorted paths of the repositories found.
+    """
+    repositories = []
+    root = Path(root).resolve()
+    for dirpath, dirnames, _ in os.walk(root):
+        path = Path(dirpath)
+        if (path / ".git").exists():
+            repositories.append(path)
+            # Do not descend into the repository, nested repositories are its own business
+            dirnames.clear()
+            continue
+        if len(path.relative_to(root).parts) >= max_depth:
+            dirnames.clear()
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".")]
+    return sorted(repositories)
+
+
+def _init_worker(llm_slots) -> None:
+    """
+    Initialize a worker process with the semaphore that caps the LLM requests.
+
+    Args:
+        llm_slots (Semaphore): Semaphore shared across the worker processes.
+    """
+    global _llm_slots
+    _llm_slots = llm_slots
+
+
+def _triage_patch(diff: Diff, config: SimpleNamespace, result: Dict) -> None:
+    """
+    Keep only the files the triage model flags in the patch of a diff, once a slot for an LLM
+    request is free.
+
+    Args:
+        diff (Diff): The Diff object with a patch.
+        config (SimpleNamespace): Validated OpenAI parameters shared by all the workers.
+        result (Dict): Result of the review, the skipped files are added to it.
+
+    Raises:
+        NoCodeChanges: When no file needs review.
+    """
+    scheduler = None
+    if config.rate_limit_state is not None:
+        scheduler = RequestScheduler(config.rate_limit_state)
+    if _llm_slots is not None:
+        _llm_slots.acquire()
+    try:
+        diff.triage(
+            OpenAI(api_key=config.openai_api_key),
+            config.triage_model,
+            read_prompt("triage"),
+            scheduler=scheduler,
+            priority=Priority.batch,
+        )
+    finally:
+        if _llm_slots is not None:
+            _llm_slots.release()
+        if diff.triage_verdicts is not None:
+            result["trivial_files"] = [
+                verdict.path for verdict in diff.triage_verdicts if not verdict.needs_review
+            ]
+
+
+def _review_patch(diff: Diff, mode: str, config: SimpleNamespace) -> str:
+    """
+    Review the patch of a diff once a slot for an LLM request is free.
+
+    Args:
+        diff (Diff): The Diff object with a patch.
+        mode (str): Diff mode of the patch, recorded in the metrics store.
+        config (SimpleNamespace): Validated OpenAI parameters shared by all the workers.
+
+    Returns:
+        str: The review, the rendered findings of a structured review.
+    """
+    scheduler = None
+    if config.rate_limit_state is not None:
+        scheduler = RequestScheduler(config.rate_limit_state)
+    if _llm_slots is not None:
+        _llm_slots.acquire()
+    try:
+        client = OpenAI(api_key=config.openai_api_key)
+        start = time.perf_counter()
+        review = diff.review_patch(
+            client,
+            config.model,
+            config.temperature,
+            config.system_prompt,
+            scheduler=scheduler,
+            priority=Priority.batch,
+            map_reduce=config.map_reduce,
+            context_tokens=config.context_window,
+            findings=config.findings is not None,
+        )
+        timer = StreamTimer(review, start)
+        review = read_stream(timer)
+        if config.findings is not None:
+            review = render_findings(parse_findings(review), config.findings)
+    finally:
+        if _llm_slots is not None:
+            _llm_slots.release()
+    if config.metrics_db is not None:
+        record = review_record(f"scan-{mode}", diff, config.system_prompt, timer)
+        try:
+            MetricsStore(config.metrics_db).record(record)
+        except sqlite3.Error:
+            # Losing a record is better than losing the review
+            pass
+    return review
+
+
+def review_repository(
+    repo_path: Path, mode: str, config: SimpleNamespace, output_path: Path
+) -> Dict:
+    """
+    Review a single repository and write the review to the output path.
+
+    Args:
+        repo_path (Path): Path of the repository.
+        mode (str): Diff mode to review, one of add, commit or push.
+        config (SimpleNamespace): Validated OpenAI and git parameters shared by all the workers.
+        output_path (Path): File to write the review to.
+
+    Returns:
+        Dict: Result of the review with its status and timing.
+    """
+    start = time.perf_counter()
+    result = {"repo": str(repo_path), "mode": mode, "status": "reviewed", "output": None}
+    try:
+        diff = Diff(repo_path, **config.diff_options)
+        getattr(diff, mode)()
+        diff.create_patch()
+        if config.triage_model is not None:
+            _triage_patch(diff, config, result)
+    except NotARepo:
+        result["status"] = "not-a-repo"
+    except NoDiffs:
+        result["status"] = "no-diffs"
+    except NoCodeChanges:
+        result["status"] = "no-code-changes"
+    except (InvalidRemote, InvalidTree, NotAncestor) as err:
+        result["status"] = "skipped"
+        result["detail"] = type(err).__name__
+    result["diff_seconds"] = round(time.perf_counter() - start, 3)
+    if result["status"] != "reviewed":
+        result["seconds"] = result["diff_seconds"]
+        return result
+
+    try:
+        review = _review_patch(diff, mode, config)
+    except Exception as err:
+        result["status"] = "error"
+        result["detail"] = str(err)
+    else:
+        output_path.write_text(review)
+        result["output"] = str(output_path)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def scan_repositories(
+    root: Path,
+    mode: str,
+    config: SimpleNamespace,
+    output_dir: Path,
+    max_workers: Optional[int] = None,
+    max_requests: int = 4,
+    max_depth: int = 3,
+) -> Dict:
+    """
+    Review every repository under a directory in a process pool.
+
+    Args:
+        root (Path): The directory to search for repositories.
+        mode (str): Diff mode to review, one of add, commit or push.
+        config (SimpleNamespace): Validated OpenAI and git parameters shared by all the workers.
+        output_dir (Path): Directory to write the reviews and the summary to.
+        max_workers (Optional[int], optional): Number of worker processes. Defaults to the
+        number of CPUs.
+        max_requests (int, optional): Maximum number of concurrent LLM requests. Defaults to 4.
+        max_depth (int, optional): How many directory levels below the root to search.
+        Defaults to 3.
+
+    Returns:
+        Dict: Aggregate summary of the scan, also written to summary.json in the output dir.
+    """
+    start = time.perf_counter()
+    root = Path(root).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    repositories = find_repositories(root, max_depth)
+
+    mp_context = multiprocessing.get_context()
+    llm_slots = mp_context.BoundedSemaphore(max_requests)
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(llm_slots,),
+    ) as executor:
+        futures = {}
+        for repo_path in repositories:
+            name = "__".join(repo_path.relative_to(root).parts) or repo_path.name
+            output_path = output_dir / f"{name}{_REVIEW_SUFFIXES[config.findings]}"
+            future = executor.submit(review_repository, repo_path, mode, config, output_path)
+            futures[future] = repo_path
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                result = {"repo": str(futures[future]), "mode": mode, "status": "error"}
+                result["detail"] = str(err)
+            print(f"{result['status']:>16}  {result['repo']}", flush=True)
+            results.append(result)
+
+    results.sort(key=lambda result: result["repo"])
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    review_seconds = [result["seconds"] for result in results if result["status"] == "reviewed"]
+    summary = {
+        "root": str(root),
+        "mode": mode,
+        "repositories": len(results),
+        "statuses": statuses,
+        "seconds": round(time.perf_counter() - start, 3),
+        "review_seconds": round(sum(review_seconds), 3),
+        "results": results,
+    }
+    (output_dir / "summary.json").write_text(json.dumps(summary, indent=2))
+    return summary
@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from enum import IntEnum
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Mapping, Optional
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class Priority(IntEnum):
+    """
+    Priority of a scheduled request, lower values are served first.
+    """
+
+    interactive = 0
+    batch = 1
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text, roughly 4 characters per token for English and code.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: Estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+def parse_duration(duration: str) -> float:
+    """
+    Parse a rate limit reset duration such as 1s, 6m0s or 20ms.
+
+    Args:
+        duration (str): The duration from the rate limit headers.
+
+    Returns:
+        float: Duration in seconds.
+    """
+    return sum(
+        float(value) * _DURATION_UNITS[unit] for value, unit in _DURATION_PART.findall(duration)
+    )
+
+
+class RequestScheduler:
+    """
+    Client-side token bucket scheduler shared by the gait processes through a state file.
+
+    The state file keeps a bucket for the requests and the tokens per minute along with the
+    requests waiting for a slot. Waiting requests are served by priority, then by arrival, and
+    the buckets are corrected from the rate limit headers of every response.
+    """
+
+    def __init__(
+        self,
+        state_path: Path,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 30000,
+        expected_output_tokens: int = 1024,
+        poll_interval: float = 0.25,
+        stale_seconds: float = 30,
+    ) -> None:
+        """
+        Initialize the RequestScheduler class.
+
+        Args:
+            state_path (Path): Path of the state file shared by the gait processes.
+            requests_per_minute (int, optional): Request limit used until the first response
+            headers are seen. Defaults to 500.
+            tokens_per_minute (int, optional): Token limit used until the first response headers
+            are seen. Defaults to 30000.
+            expected_output_tokens (int, optional): Tokens reserved for the completion of each
+            request. Defaults to 1024.
+            poll_interval (float, optional): Seconds to wait between checks for a free slot.
+            Defaults to 0.25.
+            stale_seconds (float, optional): Seconds after which a lock or a waiting request left
+            behind by a dead process is discarded. Defaults to 30.
+        """
+        self.state_path = Path(state_path)
+        self.lock_path = self.state_path.with_name(self.state_path.name + ".lock")
+        self.default_limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.expected_output_tokens = expected_output_tokens
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Hold the lock file of the state, breaking it when its owner is gone.
+        """
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                lock_fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - self.lock_path.stat().st_mtime > self.stale_seconds:
+                        self.lock_path.unlink()
+                except FileNotFoundError:
+                    pass
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(lock_fd)
+            self.lock_path.unlink(missing_ok=True)
+
+    def _load(self) -> Dict:
+        try:
+            state = json.loads(self.state_path.read_text())
+        except (FileNotFoundError, ValueError):
+            state = {}
+        state.setdefault("buckets", {})
+        state.setdefault("waiting", {})
+        now = time.time()
+        for name, limit in self.default_limits.items():
+            state["buckets"].setdefault(
+                name, {"limit": limit, "remaining": limit, "rate": limit / 60, "updated": now}
+            )
+        state["waiting"] = {
+            ticket: waiter
+            for ticket, waiter in state["waiting"].items()
+            if now - waiter["seen"] <= self.stale_seconds
+        }
+        return state
+
+    def _save(self, state: Dict) -> None:
+        tmp_path = self.state_path.with_name(self.state_path.name + f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def _available(bucket: Dict, now: float) -> float:
+        refilled = bucket["remaining"] + (now - bucket["updated"]) * bucket["rate"]
+        return min(bucket["limit"], refilled)
+
+    def _try_take(self, state: Dict, ticket: str, tokens: int) -> bool:
+        now = time.time()
+        waiter = state["waiting"][ticket]
+        waiter["seen"] = now
+        first_in_line = min(
+            state["waiting"].items(), key=lambda item: (item[1]["priority"], item[1]["since"])
+        )
+        if first_in_line[0] != ticket:
+            return False
+        needs = {"requests": 1, "tokens": tokens}
+        buckets = state["buckets"]
+        # A request larger than the whole bucket can only wait for a full bucket
+        if any(
+            self._available(buckets[name], now) < min(amount, buckets[name]["limit"])
+            for name, amount in needs.items()
+        ):
+            return False
+        for name, amount in needs.items():
+            buckets[name]["remaining"] = self._available(buckets[name], now) - amount
+            buckets[name]["updated"] = now
+        del state["waiting"][ticket]
+        return True
+
+    @contextmanager
+    def acquire(self, prompt_tokens: int, priority: Priority = Priority.interactive):
+        """
+        Wait until the request fits in the rate limits and its turn has come.
+
+        Args:
+            prompt_tokens (int): Estimated tokens of the prompt.
+            priority (Priority, optional): Priority of the request. Defaults to interactive.
+        """
+        tokens = prompt_tokens + self.expected_output_tokens
+        ticket = uuid.uuid4().hex
+        with self._locked():
+            state = self._load()
+            now = time.time()
+            state["waiting"][ticket] = {"priority": int(priority), "since": now, "seen": now}
+            self._save(state)
+        try:
+            while True:
+                with self._locked():
+                    state = self._load()
+                    state["waiting"].setdefault(
+                        ticket, {"priority": int(priority), "since": time.time(), "seen": 0}
+                    )
+                    acquired = self._try_take(state, ticket, tokens)
+                    self._save(state)
+                if acquired:
+                    break
+                time.sleep(self.poll_interval)
+        except BaseException:
+            with self._locked():
+                state = self._load()
+                state["waiting"].pop(ticket, None)
+                self._save(state)
+            raise
+        yield
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Correct the buckets with the rate limit headers of a response.
+
+        Args:
+            headers (Mapping[str, str]): Headers of the OpenAI response.
+        """
+        updates = {}
+        for name in self.default_limits:
+            limit = headers.get(f"x-ratelimit-limit-{name}")
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            if limit is None or remaining is None:
+                continue
+            limit, remaining = int(limit), int(remaining)
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{name}", ""))
+            rate = limit / 60
+            if reset > 0 and remaining < limit:
+                rate = (limit - remaining) / reset
+            updates[name] = {"limit": limit, "remaining": remaining, "rate": rate}
+        if not updates:
+            return
+        with self._locked():
+            state = self._load()
+            now = time.time()
+            for name, bucket in updates.items():
+                state["buckets"][name] = dict(bucket, updated=now)
+            self._save(state)
+
+
+def create_completion(
+    openai_client,
+    scheduler: Optional[RequestScheduler] = None,
+    priority: Priority = Priority.interactive,
+    on_acquired: Optional[Callable[[], None]] = None,
+    **request,
+):
+    """
+    Send a chat completion request, waiting for a slot in the scheduler when there is one.
+
+    Args:
+        openai_client (OpenAI): The OpenAI client.
+        scheduler (Optional[RequestScheduler], optional): Scheduler to wait for a slot within
+        the rate limits before sending the request. Defaults to None.
+        priority (Priority, optional): Priority of the request in the scheduler.
+        Defaults to interactive.
+        on_acquired (Optional[Callable[[], None]], optional): Called right before the request is
+        sent, once it has its slot. Defaults to None.
+        **request: Parameters of the chat completion request.
+
+    Returns:
+        The chat completion, or its stream when the request streams.
+    """
+    if scheduler is None:
+        if on_acquired is not None:
+            on_acquired()
+        return openai_client.chat.completions.create(**request)
+
+    prompt = "".join(message["content"] for message in request["messages"])
+    with scheduler.acquire(estimate_tokens(prompt), priority):
+        if on_acquired is not None:
+            on_acquired()
+        response = openai_client.chat.completions.with_raw_response.create(**request)
+    scheduler.update_from_headers(response.headers)
+    return response.parse()
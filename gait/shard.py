@@ -0,0 +1,162 @@
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .errors import InvalidShardResults
+
+_SHARD = re.compile(r"^(\d+)/(\d+)$")
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Parse a shard such as 2/4, the second of four shards.
+
+    Args:
+        shard (str): The shard, 1-based.
+
+    Raises:
+        ValueError: When the shard is not in the form i/n with 1 <= i <= n.
+
+    Returns:
+        Tuple[int, int]: Index and count of the shard.
+    """
+    match = _SHARD.match(shard.strip())
+    if match is None:
+        raise ValueError(f"{shard} is not in the form i/n")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise ValueError(f"{shard} is not between 1/{count} and {count}/{count}")
+    return index, count
+
+
+def assign_shards(paths: List[str], tokens: List[int], count: int) -> List[int]:
+    """
+    Assign the files to shards, balancing the estimated tokens of the shards.
+
+    The largest files are assigned first, each to the shard with the fewest tokens so far. Ties
+    are broken by path and by shard index, so every job computes the same assignment from the
+    same diff.
+
+    Args:
+        paths (List[str]): Paths of the files.
+        tokens (List[int]): Estimated tokens of the patch of each file.
+        count (int): Number of shards.
+
+    Returns:
+        List[int]: The 1-based shard of each file.
+    """
+    loads = [0] * count
+    shards = [0] * len(paths)
+    for index in sorted(range(len(paths)), key=lambda index: (-tokens[index], paths[index])):
+        shard = min(range(count), key=lambda shard: (loads[shard], shard))
+        loads[shard] += tokens[index]
+        shards[index] = shard + 1
+    return shards
+
+
+def result_path(results_dir: Path, index: int, count: int) -> Path:
+    """
+    Path of the result file of a shard.
+
+    Args:
+        results_dir (Path): Directory of the result files.
+        index (int): Index of the shard.
+        count (int): Number of shards.
+
+    Returns:
+        Path: The result file.
+    """
+    return Path(results_dir) / f"shard-{index}-of-{count}.json"
+
+
+def write_result(
+    results_dir: Path,
+    index: int,
+    count: int,
+    command: str,
+    files: List[str],
+    patch_tokens: int,
+    review: str,
+) -> Path:
+    """
+    Write the review of a shard for merge-results.
+
+    Args:
+        results_dir (Path): Directory of the result files.
+        index (int): Index of the shard.
+        count (int): Number of shards.
+        command (str): The gait command that ran the review.
+        files (List[str]): Paths of the reviewed files.
+        patch_tokens (int): Estimated tokens of the reviewed patch.
+        review (str): The review.
+
+    Returns:
+        Path: The result file.
+    """
+    path = result_path(results_dir, index, count)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    result = {
+        "shard": index,
+        "shards": count,
+        "command": command,
+        "files": files,
+        "patch_tokens": patch_tokens,
+        "review": review,
+    }
+    path.write_text(json.dumps(result, indent=2))
+    return path
+
+
+def load_results(paths: List[Path]) -> List[Dict]:
+    """
+    Load the shard results from result files and from directories of result files.
+
+    Args:
+        paths (List[Path]): Result files and directories.
+
+    Raises:
+        InvalidShardResults: When the results are of different shard counts or a shard is repeated.
+
+    Returns:
+        List[Dict]: The results, by shard index.
+    """
+    files = []
+    for path in paths:
+        path = Path(path)
+        files += sorted(path.glob("shard-*-of-*.json")) if path.is_dir() else [path]
+    results: Dict[int, Dict] = {}
+    for file in files:
+        result = json.loads(file.read_text())
+        if results and result["shards"] != next(iter(results.values()))["shards"]:
+            raise InvalidShardResults(f"{file} is a result of {result['shards']} shards")
+        if result["shard"] in results:
+            raise InvalidShardResults(f"{file} repeats the result of shard {result['shard']}")
+        results[result["shard"]] = result
+    return [results[index] for index in sorted(results)]
+
+
+def stitch_results(results: List[Dict]) -> str:
+    """
+    Stitch the reviews of the shards into a single Markdown report.
+
+    Args:
+        results (List[Dict]): The results, by shard index.
+
+    Returns:
+        str: The report, noting the missing shards.
+    """
+    if not results:
+        return "No shard results found\n"
+    count = results[0]["shards"]
+    sections = [f"# gait {results[0]['command']} review of {count} shards"]
+    missing = sorted(set(range(1, count + 1)) - {result["shard"] for result in results})
+    if missing:
+        sections.append(
+            "Missing the results of shards " + ", ".join(f"{index}/{count}" for index in missing)
+        )
+    for result in results:
+        files = ", ".join(result["files"]) or "no files"
+        review = result["review"].strip() or "No files to review in this shard."
+        sections.append(f"## Shard {result['shard']}/{count}\n\nFiles: {files}\n\n{review}")
+    return "\n\n".join(sections) + "\n"
@@ -0,0 +1,262 @@
+import ast
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from .patch import FilePatch, Hunk
+
+_HUNK_HEADER_SUFFIX = re.compile(r"^@@ [^@]* @@(.*)$")
+_DEFINITION = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?"
+    r"(?:(?:public|private|protected|internal|static|async|abstract|final|override|pub(?:\([^)]*\))?"
+    r"|inline|virtual|unsafe|const)\s+)*"
+    r"(?:def|class|function|func|fn|struct|interface|impl|enum|trait|module|sub|object)\s+"
+    r"(?:\([^)]*\)\s*)?(?P<name>[\w$.]+)"
+)
+_C_LIKE_FUNCTION = re.compile(
+    r"^\s*(?:[\w:<>,\[\]]+[\s*&]+)+(?P<name>[A-Za-z_]\w*)\s*\([^;]*\)\s*"
+    r"(?:const\s*)?(?:throws [\w.,\s]+)?\{?\s*$"
+)
+_KEYWORDS = {"if", "for", "while", "switch", "catch", "return", "else", "do", "new", "throw"}
+
+
+@dataclass
+class Symbol:
+    """
+    A function or class in a file, spanning the 1-based inclusive lines start to end.
+    """
+
+    name: str
+    start: int
+    end: int
+
+
+def blob_sha(content: bytes) -> str:
+    """
+    Compute the git blob SHA of a file content.
+
+    Args:
+        content (bytes): Content of the file.
+
+    Returns:
+        str: The SHA the blob has, or would have, in git.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def python_symbols(source: str) -> Optional[List[Symbol]]:
+    """
+    Index the functions and classes of a Python source with the ast module.
+
+    Args:
+        source (str): The Python source.
+
+    Returns:
+        Optional[List[Symbol]]: The symbols, None when the source cannot be parsed.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    symbols = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            symbols.append(Symbol(node.name, start, node.end_lineno))
+    return symbols
+
+
+def _block_end(lines: List[str], start: int) -> int:
+    """
+    Find the last line of a block starting at a 0-based line, by braces or by indentation.
+    """
+    opened = "{" in lines[start] or (
+        start + 1 < len(lines) and lines[start + 1].strip().startswith("{")
+    )
+    if opened:
+        depth = 0
+        for index in range(start, len(lines)):
+            depth += lines[index].count("{") - lines[index].count("}")
+            if depth <= 0 and "}" in lines[index]:
+                return index
+        return len(lines) - 1
+
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    end = start
+    for index in range(start + 1, len(lines)):
+        stripped = lines[index].strip()
+        if not stripped:
+            continue
+        if len(lines[index]) - len(lines[index].lstrip()) <= indent:
+            break
+        end = index
+    return end
+
+
+def heuristic_symbols(source: str) -> List[Symbol]:
+    """
+    Index the functions and classes of a source in any language with regular expressions.
+
+    Args:
+        source (str): The source.
+
+    Returns:
+        List[Symbol]: The symbols.
+    """
+    lines = source.splitlines()
+    symbols = []
+    for index, line in enumerate(lines):
+        match = _DEFINITION.match(line)
+        if match is None:
+            match = _C_LIKE_FUNCTION.match(line)
+            # C-like functions need a body, otherwise they are calls or declarations
+            has_body = "{" in line or "".join(lines[index + 1 : index + 2]).strip() == "{"
+            if match is None or not has_body or line.split()[0] in _KEYWORDS:
+                continue
+        symbols.append(Symbol(match.group("name"), index + 1, _block_end(lines, index) + 1))
+    return symbols
+
+
+def index_symbols(source: str, path: str) -> List[Symbol]:
+    """
+    Index the functions and classes of a file.
+
+    Args:
+        source (str): Content of the file.
+        path (str): Path of the file, used to pick the parser.
+
+    Returns:
+        List[Symbol]: The symbols.
+    """
+    symbols = None
+    if path.endswith((".py", ".pyi")):
+        symbols = python_symbols(source)
+    if symbols is None:
+        symbols = heuristic_symbols(source)
+    return symbols
+
+
+class SymbolCache:
+    """
+    On-disk cache of the symbol indexes, keyed by the blob SHA of the indexed file.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        """
+        Initialize the SymbolCache class.
+
+        Args:
+            cache_dir (Path): Directory to store the indexes in.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def symbols(self, content: bytes, path: str) -> List[Symbol]:
+        """
+        Get the symbol index of a file, parsing it only when it is not cached.
+
+        Args:
+            content (bytes): Content of the file.
+            path (str): Path of the file, used to pick the parser.
+
+        Returns:
+            List[Symbol]: The symbols.
+        """
+        parser = "python" if path.endswith((".py", ".pyi")) else "heuristic"
+        cache_path = self.cache_dir / f"{blob_sha(content)}.{parser}.json"
+        try:
+            symbols = [Symbol(*symbol) for symbol in json.loads(cache_path.read_text())]
+        except (FileNotFoundError, ValueError, TypeError):
+            pass
+        else:
+            self.hits += 1
+            return symbols
+        self.misses += 1
+        symbols = index_symbols(content.decode("utf-8", errors="replace"), path)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(
+            json.dumps([[symbol.name, symbol.start, symbol.end] for symbol in symbols])
+        )
+        return symbols
+
+
+def _enclosing(symbols: List[Symbol], line: int) -> Optional[Symbol]:
+    "Innermost symbol containing a line."
+    containing = [symbol for symbol in symbols if symbol.start <= line <= symbol.end]
+    return min(containing, key=lambda symbol: symbol.end - symbol.start, default=None)
+
+
+def _changed_lines(hunk: Hunk, new_begin: int) -> List[int]:
+    "Post-image lines of the changes in a hunk, removals anchored to the following line."
+    changed = []
+    new_line = new_begin
+    for line in hunk.lines:
+        if line.startswith("+"):
+            changed.append(new_line)
+            new_line += 1
+        elif line.startswith("-"):
+            changed.append(new_line)
+        elif line.startswith(" "):
+            new_line += 1
+    return changed
+
+
+def expand_hunks(
+    file_patch: FilePatch, post_image: List[str], symbols: List[Symbol]
+) -> List[Hunk]:
+    """
+    Expand the context of each hunk to the functions or classes enclosing its changes.
+
+    The added context lines lie between the hunks, so they are the same on both sides of the diff.
+
+    Args:
+        file_patch (FilePatch): The file patch.
+        post_image (List[str]): Lines of the file after the change.
+        symbols (List[Symbol]): Symbols of the file after the change.
+
+    Returns:
+        List[Hunk]: The expanded hunks.
+    """
+    hunks = file_patch.hunks
+    if any(hunk.new_start is None for hunk in hunks):
+        return hunks
+    expanded = []
+    previous_end = 0
+    for position, hunk in enumerate(hunks):
+        new_begin = hunk.new_start if hunk.new_length else hunk.new_start + 1
+        new_end = new_begin + hunk.new_length - 1
+        old_begin = hunk.old_start if hunk.old_length else hunk.old_start + 1
+        if position + 1 < len(hunks):
+            next_hunk = hunks[position + 1]
+            limit = next_hunk.new_start - (1 if next_hunk.new_length else 0)
+        else:
+            limit = len(post_image)
+
+        lead, trail = new_begin, new_end
+        changed = [min(max(line, 1), len(post_image)) for line in _changed_lines(hunk, new_begin)]
+        if changed:
+            first, last = _enclosing(symbols, changed[0]), _enclosing(symbols, changed[-1])
+            if first is not None:
+                lead = max(min(lead, first.start), previous_end + 1)
+            if last is not None:
+                trail = min(max(trail, last.end), limit)
+        leading = [" " + line for line in post_image[lead - 1 : new_begin - 1]]
+        trailing = [" " + line for line in post_image[new_end : trail]]
+        previous_end = max(trail, new_end)
+        if not leading and not trailing:
+            expanded.append(hunk)
+            continue
+
+        old_length = hunk.old_length + len(leading) + len(trailing)
+        new_length = hunk.new_length + len(leading) + len(trailing)
+        old_start = old_begin - len(leading)
+        suffix = _HUNK_HEADER_SUFFIX.match(hunk.header)
+        header = f"@@ -{old_start},{old_length} +{lead},{new_length} @@"
+        if suffix is not None:
+            header += suffix.group(1)
+        expanded.append(Hunk(header, leading + hunk.lines + trailing))
+    return expanded
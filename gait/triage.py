@@ -0,0 +1,177 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from .patch import FilePatch
+from .scheduler import Priority, RequestScheduler, create_completion, estimate_tokens
+
+NEEDS_REVIEW = "needs-review"
+TRIVIAL = "trivial"
+
+
+@dataclass
+class TriageVerdict:
+    """
+    The triage verdict of the patch of a single file.
+    """
+
+    path: str
+    needs_review: bool
+    reason: str
+
+
+def parse_verdicts(content: str) -> Dict[int, Tuple[bool, str]]:
+    """
+    Parse the answer of the triage model.
+
+    Args:
+        content (str): The JSON answer of the triage model.
+
+    Returns:
+        Dict[int, Tuple[bool, str]]: Whether each chunk needs review and why, by chunk id.
+        Malformed entries are left out.
+    """
+    try:
+        chunks = json.loads(content)["chunks"]
+    except (ValueError, TypeError, KeyError):
+        return {}
+    verdicts = {}
+    for chunk in chunks if isinstance(chunks, list) else []:
+        try:
+            chunk_id, verdict = int(chunk["id"]), chunk["verdict"]
+        except (ValueError, TypeError, KeyError):
+            continue
+        if verdict in (NEEDS_REVIEW, TRIVIAL):
+            verdicts[chunk_id] = (verdict == NEEDS_REVIEW, str(chunk.get("reason", "")))
+    return verdicts
+
+
+def batch_chunks(chunks: Dict[int, str], batch_tokens: int) -> List[List[int]]:
+    """
+    Group the chunks into batches of at most batch_tokens estimated tokens, keeping their order.
+
+    Args:
+        chunks (Dict[int, str]): Rendered chunks by chunk id.
+        batch_tokens (int): Estimated tokens of a batch.
+
+    Returns:
+        List[List[int]]: Chunk ids of each batch.
+    """
+    batches = []
+    batch, tokens = [], 0
+    for chunk_id, chunk in chunks.items():
+        chunk_tokens = estimate_tokens(chunk)
+        if batch and tokens + chunk_tokens > batch_tokens:
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(chunk_id)
+        tokens += chunk_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def triage_file_patches(
+    openai_client: OpenAI,
+    model: str,
+    file_patches: List[FilePatch],
+    system_prompt: str,
+    scheduler: Optional[RequestScheduler] = None,
+    priority: Priority = Priority.interactive,
+    max_chunk_tokens: int = 4000,
+    batch_tokens: int = 12000,
+    max_workers: int = 4,
+) -> List[TriageVerdict]:
+    """
+    Classify the patch of each file as needing review or trivial with a fast model.
+
+    The patches are sent in batches that are classified concurrently. The triage fails open: a
+    patch too large to triage, left out of the answer or in a failed batch needs review.
+
+    Args:
+        openai_client (OpenAI): The OpenAI client.
+        model (str): Model to triage with.
+        file_patches (List[FilePatch]): The file patches.
+        system_prompt (str): System prompt of the triage.
+        scheduler (Optional[RequestScheduler], optional): Scheduler to wait for a slot within
+        the rate limits before sending the requests. Defaults to None.
+        priority (Priority, optional): Priority of the requests in the scheduler.
+        Defaults to interactive.
+        max_chunk_tokens (int, optional): Estimated tokens above which a file patch needs review
+        without being triaged. Defaults to 4000.
+        batch_tokens (int, optional): Estimated tokens of the file patches sent in one request.
+        Defaults to 12000.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 4.
+
+    Returns:
+        List[TriageVerdict]: Verdicts in the order of the file patches.
+    """
+    verdicts = {}
+    chunks = {}
+    for chunk_id, file_patch in enumerate(file_patches):
+        chunk = file_patch.render()
+        if estimate_tokens(chunk) > max_chunk_tokens:
+            verdicts[chunk_id] = (True, "too large to triage")
+        else:
+            chunks[chunk_id] = chunk
+
+    def triage_batch(batch: List[int]) -> Dict[int, Tuple[bool, str]]:
+        content = "\n".join(
+            f"### Chunk {chunk_id}: {file_patches[chunk_id].path}\n{chunks[chunk_id]}"
+            for chunk_id in batch
+        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content},
+        ]
+        try:
+            completion = create_completion(
+                openai_client,
+                scheduler,
+                priority,
+                model=model,
+                messages=messages,
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+            answer = completion.choices[0].message.content
+        except Exception:
+            return {}
+        return {
+            chunk_id: verdict
+            for chunk_id, verdict in parse_verdicts(answer).items()
+            if chunk_id in batch
+        }
+
+    batches = batch_chunks(chunks, batch_tokens)
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+            for batch_verdicts in executor.map(triage_batch, batches):
+                verdicts.update(batch_verdicts)
+    return [
+        TriageVerdict(file_patch.path, *verdicts.get(chunk_id, (True, "not triaged")))
+        for chunk_id, file_patch in enumerate(file_patches)
+    ]
+
+
+def format_triage(verdicts: List[TriageVerdict]) -> str:
+    """
+    Summarize the triage for the console.
+
+    Args:
+        verdicts (List[TriageVerdict]): The triage verdicts.
+
+    Returns:
+        str: How many files need review and why the others were skipped.
+    """
+    skipped = [verdict for verdict in verdicts if not verdict.needs_review]
+    summary = f"Triage: {len(verdicts) - len(skipped)} of {len(verdicts)} files need review"
+    if skipped:
+        summary += ", skipped " + ", ".join(
+            f"{verdict.path} ({verdict.reason})" if verdict.reason else verdict.path
+            for verdict in skipped
+        )
+    return summary
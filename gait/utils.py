@@ -1,11 +1,15 @@
 import pkgutil
+from typing import TYPE_CHECKING
 
 import typer
 from openai import Stream
 
-from .diff import Diff
 from .errors import NoCodeChanges, NoDiffs
 
+if TYPE_CHECKING:
+    # The diff module reads its prompts with read_prompt
+    from .diff import Diff
+
 
 def stream_to_console(stream: Stream) -> str:
     """
@@ -27,6 +31,25 @@ def stream_to_console(stream: Stream) -> str:
     return full_stream
 
 
+def read_stream(stream: Stream) -> str:
+    """
+    Reads the stream without printing it and returns the full stream as a string
+
+    Args:
+        stream (Stream): Stream of text from OpenAI
+
+    Returns:
+        str: Full stream of text from OpenAI
+    """
+    full_stream = ""
+    for chunk in stream:
+        chunk_content = chunk.choices[0].delta.content
+        if chunk_content is None:
+            break
+        full_stream += chunk_content
+    return full_stream
+
+
 def read_prompt(prompt: str) -> str:
     """
     Reads a prompt from system_prompts directory
@@ -40,7 +63,7 @@ def read_prompt(prompt: str) -> str:
     return pkgutil.get_data(__name__, f"system_prompts/{prompt}").decode("utf-8")
 
 
-def handle_create_patch_errors(diff_object: Diff) -> None:
+def handle_create_patch_errors(diff_object: "Diff") -> None:
     """
     Handles errors raised when creating a patch
 
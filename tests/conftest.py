@@ -3,6 +3,8 @@ from unittest.mock import MagicMock
 import pytest
 from git import Repo
 
+from gait.patch import FilePatch, parse_hunks
+
 
 @pytest.fixture
 def git_history(tmp_path_factory):
@@ -44,6 +46,24 @@ def git_history(tmp_path_factory):
     }
 
 
+@pytest.fixture
+def moved_files(git_history):
+    # Move src to lib, editing a.py and copying b.py to lib/c.py, staged
+    repo_path = git_history["repo_path"]
+    repo = Repo(repo_path)
+    (repo_path / "src").mkdir()
+    lines = "".join(f"value_{index} = {index}\n" for index in range(40))
+    (repo_path / "src" / "a.py").write_text(lines)
+    (repo_path / "src" / "b.py").write_text(lines.replace("value", "item"))
+    repo.git.add("src")
+    repo.index.commit("add src")
+    repo.git.mv("src", "lib")
+    (repo_path / "lib" / "a.py").write_text(lines.replace("value_5 = 5", "value_5 = 50"))
+    (repo_path / "lib" / "c.py").write_text(lines.replace("value", "item"))
+    repo.git.add("lib")
+    return repo_path
+
+
 @pytest.fixture
 def mock_openai():
     class MockAuthenticationError(Exception):
@@ -71,3 +91,16 @@ def mock_openai():
         "MockNotFoundError": MockNotFoundError,
         "MockOpenAI": MockOpenAI,
     }
+
+
+@pytest.fixture
+def make_file_patch():
+    def make(path, patch=None, changes=1, width=40, **kwargs):
+        # Without a patch, the file adds `changes` lines of `width` characters
+        if patch is None:
+            lines = "".join(f"+{index:04d} ".ljust(width, "x") + "\n" for index in range(changes))
+            patch = f"@@ -0,0 +1,{changes} @@\n{lines}"
+        hunks, preamble = parse_hunks(patch)
+        return FilePatch(path, path, hunks, preamble, **kwargs)
+
+    return make
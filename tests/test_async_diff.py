@@ -0,0 +1,120 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from git import Repo
+
+from gait.async_diff import AsyncDiff, parse_diff_output
+from gait.diff import Diff
+from gait.errors import DirtyRepo, InvalidRemote, IsAncestor, NotAncestor
+
+
+def test_parse_diff_output(git_history):
+    repo = Repo(git_history["repo_path"])
+    repo.git.add(git_history["gitignore"])
+    repo.index.commit("second commit")
+    with open(git_history["repo_path"] / "new file.txt", "w") as f:
+        f.write("new\n")
+    repo.git.add("new file.txt")
+    repo.git.mv(".gitignore", "ignore")
+    output = repo.git.diff("--cached", "--full-index", "-M", stdout_as_string=False)
+    diffs = parse_diff_output(repo, output)
+    assert [(raw_diff.a_path, raw_diff.b_path) for raw_diff in diffs] == [
+        (".gitignore", "ignore"),
+        ("new file.txt", "new file.txt"),
+    ]
+    assert diffs[0].renamed_file
+    assert diffs[0].diff == b""
+    assert diffs[1].new_file
+    assert diffs[1].a_blob is None
+    assert diffs[1].b_blob.data_stream.read() == b"new\n"
+    assert diffs[1].diff == b"@@ -0,0 +1 @@\n+new\n"
+
+
+def test_add_and_commit(git_history):
+    repo_path = git_history["repo_path"]
+    async_diff = AsyncDiff(repo_path)
+    assert asyncio.run(async_diff.add()).create_patch() == Diff(repo_path).add().create_patch()
+    assert (
+        asyncio.run(async_diff.commit()).create_patch()
+        == Diff(repo_path).commit().create_patch()
+    )
+
+
+def test_renames_and_copies(moved_files):
+    repo_path = moved_files
+    for options in ({}, {"find_copies": 50}, {"find_renames": 0, "rename_limit": 10}):
+        async_diff = AsyncDiff(repo_path, **options)
+        assert (
+            asyncio.run(async_diff.commit()).create_patch()
+            == Diff(repo_path, **options).commit().create_patch()
+        )
+        assert async_diff.diff_seconds > 0
+
+
+def test_merge_push_and_pr(git_history):
+    repo_path = git_history["repo_path"]
+    repo = Repo(repo_path)
+    async_diff = AsyncDiff(repo_path)
+    with pytest.raises(DirtyRepo):
+        asyncio.run(async_diff._merge_on_temp_branch("feature", "master"))
+    with pytest.raises(InvalidRemote):
+        asyncio.run(async_diff.push("nonexistent_remote"))
+
+    repo.git.add(git_history["gitignore"])
+    repo.index.commit("second commit")
+    patch = asyncio.run(async_diff.push()).create_patch()
+    assert patch == Diff(repo_path).push().create_patch()
+    repo.remotes.origin.push("master")
+    patch = asyncio.run(async_diff.pr("master")).create_patch()
+    assert patch == Diff(repo_path).pr("master").create_patch()
+    assert repo.active_branch.name == "feature"
+    assert len(repo.heads) == 2
+
+    repo.heads.master.checkout()
+    patch = asyncio.run(async_diff.merge("feature")).create_patch()
+    assert patch == Diff(repo_path).merge("feature").create_patch()
+
+    repo.heads.feature.checkout()
+    with pytest.raises(IsAncestor):
+        asyncio.run(async_diff.merge("master"))
+
+    # Make remote ahead of local
+    repo.remotes.origin.push("feature")
+    repo.git.reset("HEAD^", hard=True)
+    with pytest.raises(NotAncestor):
+        asyncio.run(async_diff.push())
+
+
+def test_review_patch(git_history):
+    async def chunks():
+        for content in ["looks", " good", None]:
+            yield MagicMock(choices=[MagicMock(delta=MagicMock(content=content))])
+
+    openai_client = MagicMock()
+    openai_client.chat.completions.create = AsyncMock(return_value=chunks())
+    async_diff = AsyncDiff(git_history["repo_path"])
+
+    async def review():
+        return [chunk async for chunk in async_diff.review_patch(openai_client, "gpt-4", 1, "")]
+
+    with pytest.raises(Exception, match="No patch to review"):
+        asyncio.run(review())
+    asyncio.run(async_diff.add()).create_patch()
+    assert asyncio.run(review()) == ["looks", " good"]
+
+
+def test_push_since_last_review(git_history):
+    repo = Repo(git_history["repo_path"])
+    async_diff = AsyncDiff(git_history["repo_path"])
+    assert asyncio.run(async_diff.last_reviewed_commit()) is None
+
+    repo.index.commit("added second line")
+    asyncio.run(async_diff.push(since_last_review=True))
+    asyncio.run(async_diff.mark_reviewed())
+    assert asyncio.run(async_diff.last_reviewed_commit()) == repo.head.commit.hexsha
+
+    repo.git.add(git_history["gitignore"])
+    repo.index.commit("added third line")
+    patch = asyncio.run(async_diff.push(since_last_review=True)).create_patch()
+    assert patch == "@@ -1,2 +1,3 @@\n first_line\n second_line\n+third_line\n"
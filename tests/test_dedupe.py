@@ -0,0 +1,48 @@
+from gait.dedupe import hunk_key, is_formatting_only, render_deduplicated
+from gait.patch import parse_hunks
+
+LICENSE_UPDATE = """@@ -1,3 +1,3 @@
+-# Copyright 2023 Example
++# Copyright 2024 Example
+ import os
+"""
+
+
+def test_hunk_key():
+    first = parse_hunks(LICENSE_UPDATE)[0][0]
+    second = parse_hunks(LICENSE_UPDATE.replace("+# Copyright", "+#   Copyright"))[0][0]
+    third = parse_hunks(LICENSE_UPDATE.replace("import os", "import sys"))[0][0]
+    assert hunk_key(first) == hunk_key(second) == hunk_key(third)
+    assert hunk_key(first) != hunk_key(parse_hunks(LICENSE_UPDATE.replace("2024", "2025"))[0][0])
+    assert hunk_key(parse_hunks("@@ -1 +1 @@\n-f(a,b)\n+f(a, b)\n")[0][0]) == ("-f(a,b)", "+f(a,b)")
+
+
+def test_is_formatting_only(make_file_patch):
+    reindented = make_file_patch("a.py", "@@ -1,2 +1,2 @@\n-x = [1,2]\n+x  =  [1, 2]\n")
+    assert is_formatting_only(reindented)
+    # Blank lines are changes for `git diff -w`
+    spaced = make_file_patch("a.py", "@@ -1,2 +1,3 @@\n x = 1\n+\n y = 2\n")
+    assert not is_formatting_only(spaced)
+    assert hunk_key(spaced.hunks[0]) == ("+",)
+    # Reordered lines are changes, even when the same lines are removed and added
+    reordered = make_file_patch("e.c", "@@ -1,2 +1,2 @@\n-free(p);\n use(p);\n+free(p);\n")
+    assert not is_formatting_only(reordered)
+    assert not is_formatting_only(make_file_patch("b.py", LICENSE_UPDATE))
+    assert not is_formatting_only(make_file_patch("c.py", "@@ -0,0 +1 @@\n+\n", new_file=True))
+    assert not is_formatting_only(make_file_patch("d.bin", "Binary files differ\n"))
+
+
+def test_render_deduplicated(make_file_patch):
+    file_patches = [
+        make_file_patch("a.py", LICENSE_UPDATE),
+        make_file_patch("b.py", LICENSE_UPDATE + "@@ -20 +20 @@\n-old\n+new\n"),
+        make_file_patch("c.py", LICENSE_UPDATE.replace("@@ -1,3 +1,3 @@", "@@ -5,3 +5,3 @@")),
+        make_file_patch("d.py", "@@ -1 +1 @@\n-f(a,b)\n+f(a, b)\n"),
+    ]
+    assert render_deduplicated(file_patches) == (
+        "--- a/a.py\n+++ b/a.py\n"
+        + LICENSE_UPDATE
+        + "# Identical change also at: b.py:1, c.py:5\n"
+        + "\n--- a/b.py\n+++ b/b.py\n@@ -20 +20 @@\n-old\n+new\n"
+        + "\n# Whitespace-only changes in: d.py\n"
+    )
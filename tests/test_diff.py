@@ -1,3 +1,6 @@
+import json
+from unittest.mock import MagicMock
+
 import pytest
 from git import Repo
 
@@ -7,10 +10,13 @@ from gait.errors import (
     InvalidRemote,
     InvalidTree,
     IsAncestor,
+    NoCodeChanges,
     NoDiffs,
     NotAncestor,
     NotARepo,
 )
+from gait.scheduler import RequestScheduler
+from gait.utils import read_prompt
 
 
 def test_fetch_remote(git_history):
@@ -231,3 +237,323 @@ def test_review_patch(mock_openai, git_history):
     diff.add().create_patch()
     diff.review_patch(openai_client, "gpt-3", 0.7, "system prompt")
     assert diff.review == "test completion"
+
+
+def test_review_patch_with_scheduler(mock_openai, git_history, tmp_path):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    response = openai_client.chat.completions.with_raw_response.create.return_value
+    response.headers = {
+        "x-ratelimit-limit-requests": "500",
+        "x-ratelimit-remaining-requests": "499",
+    }
+    response.parse.return_value = "test completion"
+    scheduler = RequestScheduler(tmp_path / "state.json")
+
+    diff = Diff(git_history["repo_path"])
+    diff.add().create_patch()
+    diff.review_patch(openai_client, "gpt-3", 0.7, "system prompt", scheduler=scheduler)
+    assert diff.review == "test completion"
+    openai_client.chat.completions.create.assert_not_called()
+    assert '"remaining": 499' in (tmp_path / "state.json").read_text()
+
+
+def test_review_patch_with_latency_budget(mock_openai, git_history):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    chunks = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content="review"))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    openai_client.chat.completions.create.return_value = iter(chunks)
+
+    diff = Diff(git_history["repo_path"])
+    assert diff.hedge_winner is None
+    diff.add().create_patch()
+    review = diff.review_patch(
+        openai_client, "gpt-4", 0.7, "system prompt", latency_budget=5, hedge_model="gpt-3.5-turbo"
+    )
+    assert list(review) == chunks
+    assert diff.hedge_winner == "primary"
+    assert openai_client.chat.completions.create.call_args.kwargs["model"] == "gpt-4"
+
+
+def test_review_patch_map_reduce(mock_openai, git_history):
+    repo_path = git_history["repo_path"]
+    lines = [f"value_{index} = {index}\n" for index in range(1000)]
+    (repo_path / "big.py").write_text("".join(lines))
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    openai_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content="- big.py:1: [low] finding"))]
+    )
+
+    diff = Diff(repo_path)
+    diff.repo.git.add("big.py")
+    diff.commit().create_patch()
+    diff.review_patch(openai_client, "gpt-4", 0.7, "system prompt", map_reduce=True)
+    assert diff.review_parts == 1
+    assert openai_client.chat.completions.create.call_count == 1
+
+    diff.review_patch(
+        openai_client, "gpt-4", 0.7, "system prompt", map_reduce=True, context_tokens=4096
+    )
+    assert diff.review_parts > 1
+    requests = [call.kwargs for call in openai_client.chat.completions.create.call_args_list]
+    assert len(requests) == 1 + diff.review_parts + 1
+    assert requests[-1]["stream"] is True
+    assert "big.py:1" in requests[-1]["messages"][1]["content"]
+
+    # Without a known context window the patch is sent whole
+    openai_client.chat.completions.create.reset_mock()
+    diff.review_patch(openai_client, "gpt-unknown", 0.7, "system prompt", map_reduce=True)
+    assert diff.review_parts == 1
+    assert openai_client.chat.completions.create.call_count == 1
+
+
+def test_review_patch_findings(mock_openai, git_history):
+    repo_path = git_history["repo_path"]
+    lines = [f"value_{index} = {index}\n" for index in range(1000)]
+    (repo_path / "big.py").write_text("".join(lines))
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    openai_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content="- big.py:1: [low] finding"))]
+    )
+
+    diff = Diff(repo_path)
+    diff.repo.git.add("big.py")
+    diff.commit().create_patch()
+    diff.review_patch(openai_client, "gpt-4o", 0.7, "system prompt", findings=True)
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert request["response_format"]["json_schema"]["name"] == "findings"
+    diff.review_patch(openai_client, "gpt-4o", 0.7, "system prompt")
+    assert "response_format" not in openai_client.chat.completions.create.call_args.kwargs
+
+    diff.review_patch(
+        openai_client,
+        "gpt-4",
+        0.7,
+        "system prompt",
+        map_reduce=True,
+        context_tokens=4096,
+        findings=True,
+    )
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert request["response_format"] == {"type": "json_object"}
+    assert request["messages"][0]["content"].endswith(read_prompt("reduce_findings"))
+    assert request["messages"][0]["content"].startswith("system prompt\n\n")
+
+
+def test_triage(git_history):
+    repo_path = git_history["repo_path"]
+    (repo_path / "app.py").write_text("def main():\n    return 1\n")
+    repo = Repo(repo_path)
+    repo.git.add(all=True)
+    repo.index.commit("add app")
+    (repo_path / "app.py").write_text("def main():\n    return 2\n")
+    with open(git_history["gitignore"], "a") as f:
+        f.write("fourth_line\n")
+
+    openai_client = MagicMock()
+    diff = Diff(repo_path)
+    with pytest.raises(Exception, match="No patch to triage"):
+        diff.triage(openai_client, "gpt-3.5-turbo", "triage prompt")
+
+    patch = diff.add().create_patch()
+    content = json.dumps(
+        {
+            "chunks": [
+                {"id": 0, "verdict": "trivial", "reason": "ignore list"},
+                {"id": 1, "verdict": "needs-review", "reason": "return value"},
+            ]
+        }
+    )
+    openai_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content=content))]
+    )
+    verdicts = diff.triage(openai_client, "gpt-3.5-turbo", "triage prompt")
+    assert [(verdict.path, verdict.needs_review) for verdict in verdicts] == [
+        (".gitignore", False),
+        ("app.py", True),
+    ]
+    assert "fourth_line" in patch
+    assert diff.patch == diff.diffs[1].diff.decode("utf-8")
+    assert "+    return 2" in diff.patch
+
+    content = json.dumps(
+        {"chunks": [{"id": 0, "verdict": "trivial"}, {"id": 1, "verdict": "trivial"}]}
+    )
+    openai_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content=content))]
+    )
+    diff.create_patch()
+    with pytest.raises(NoCodeChanges):
+        diff.triage(openai_client, "gpt-3.5-turbo", "triage prompt")
+    assert [verdict.needs_review for verdict in diff.triage_verdicts] == [False, False]
+
+
+def test_create_patch_reduce_structured(git_history):
+    repo_path = git_history["repo_path"]
+    image = "iVBORw0KGgo" * 1000
+
+    def write_notebook(source):
+        cell = {"cell_type": "code", "source": source, "outputs": [{"data": image}]}
+        (repo_path / "analysis.ipynb").write_text(json.dumps({"cells": [cell]}, indent=1))
+
+    write_notebook("df = load()")
+    (repo_path / "app.py").write_text("value = 1\n")
+    repo = Repo(repo_path)
+    repo.git.add(all=True)
+    repo.index.commit("add notebook")
+    write_notebook("df = load(cache=True)")
+    (repo_path / "app.py").write_text("value = 2\n")
+
+    raw_patch = Diff(repo_path).add().create_patch()
+    diff = Diff(repo_path, reduce_structured=True)
+    patch = diff.add().create_patch()
+    assert len(patch) * 10 < len(raw_patch)
+    assert image not in patch
+    assert "--- a/analysis.ipynb\n+++ b/analysis.ipynb\n# Semantic diff of the notebook" in patch
+    assert "-df = load()\n+df = load(cache=True)\n" in patch
+    assert "--- a/app.py\n+++ b/app.py\n@@ -1 +1 @@\n-value = 1\n+value = 2\n" in patch
+
+    repo.git.add(all=True)
+    repo.index.commit("load from cache")
+    repo.git.checkout("master")
+    patch = diff.merge("feature").create_patch()
+    assert "+df = load(cache=True)\n" in patch
+    assert image not in patch
+
+
+def test_shard(git_history):
+    repo_path = git_history["repo_path"]
+    lines = [f"value_{index} = {index}\n" for index in range(50)]
+    (repo_path / "large.py").write_text("".join(lines))
+    (repo_path / "small.py").write_text("value = 1\n")
+    diff = Diff(repo_path)
+    with pytest.raises(Exception, match="No patch to shard"):
+        diff.shard(1, 2)
+
+    diff.repo.git.add(all=True)
+    diff.commit()
+    diff.create_patch()
+    assert diff.shard(1, 2) == ["large.py"]
+    assert "value_49" in diff.patch
+    assert "small.py" not in diff.patch
+
+    diff.create_patch()
+    assert diff.shard(2, 2) == [".gitignore", "small.py"]
+    assert "value_49" not in diff.patch
+    assert diff.patch == "\n".join(diff.diffs[index].diff.decode("utf-8") for index in (0, 2))
+
+    diff.create_patch()
+    assert diff.shard(4, 4) == []
+    assert diff.patch is None
+
+
+def test_create_patch_deduplicate(git_history):
+    repo_path = git_history["repo_path"]
+    for name in ("a.py", "b.py"):
+        with open(repo_path / name, "w") as f:
+            f.write("# Copyright 2023\nimport os\n")
+    repo = Repo(repo_path)
+    repo.git.add(all=True)
+    repo.index.commit("add files")
+    for name in ("a.py", "b.py"):
+        with open(repo_path / name, "w") as f:
+            f.write("# Copyright 2024\nimport os\n")
+
+    patch = Diff(repo_path).add().create_patch()
+    assert patch.count("Copyright 2024") == 2
+
+    diff = Diff(repo_path, deduplicate=True)
+    patch = diff.add().create_patch()
+    assert patch.count("Copyright 2024") == 1
+    assert "# Identical change also at: b.py:1" in patch
+    assert [file_patch.path for file_patch in diff.file_patches] == ["a.py", "b.py"]
+
+
+def test_create_patch_symbol_context(git_history):
+    repo_path = git_history["repo_path"]
+    repo = Repo(repo_path)
+    source = "def first():\n" + "    x = 1\n" * 10 + "    return x\n"
+    with open(repo_path / "module.py", "w") as f:
+        f.write(source)
+    repo.git.add(all=True)
+    repo.index.commit("add module")
+    repo.git.push()
+    with open(repo_path / "module.py", "w") as f:
+        f.write(source.replace("return x", "return x + 1"))
+
+    diff = Diff(repo_path, symbol_context=True)
+    patch = diff.add().create_patch()
+    assert patch.startswith(
+        "--- a/module.py\n+++ b/module.py\n@@ -1,12 +1,12 @@ def first():\n def first():"
+    )
+    assert diff.symbol_cache.misses == 1
+    assert Diff(repo_path).add().create_patch().startswith("@@ -9,4 +9,4 @@")
+
+    repo.git.add(all=True)
+    assert diff.commit().create_patch() == patch
+    assert diff.symbol_cache.hits == 1
+
+    repo.index.commit("return x + 1")
+    assert diff.push().create_patch() == patch
+
+    repo.create_head("feature-merge", "HEAD~1").checkout()
+    patch = diff.merge("feature").create_patch()
+    assert "@@ -1,12 +1,12 @@ def first():\n def first():" in patch
+
+
+def test_renames_and_copies(moved_files):
+    repo_path = moved_files
+
+    diff = Diff(repo_path)
+    assert diff.diff_seconds is None
+    patch = diff.commit().create_patch()
+    assert diff.diff_seconds > 0
+    assert patch.startswith("rename src/a.py => lib/a.py\n@@ -3,7 +3,7 @@")
+    assert "rename src/b.py => lib/b.py\n\n" in patch
+    assert patch.count("\n-value") == 1
+    assert "+item_0 = 0" in patch
+
+    rendered = Diff(repo_path, symbol_context=True).commit().create_patch()
+    assert rendered.startswith("rename src/a.py => lib/a.py\n@@")
+    assert "--- a/src" not in rendered
+
+    copies = Diff(repo_path, find_copies=50).commit().create_patch()
+    assert "copy src/b.py => lib/b.py\n\nrename src/b.py => lib/c.py\n" in copies
+    assert "+item_0 = 0" not in copies
+
+    no_renames = Diff(repo_path, find_renames=0).commit().create_patch()
+    assert "rename" not in no_renames
+    assert no_renames.count("\n-value") == 40
+
+    assert Diff(repo_path, rename_limit=1).commit().create_patch()
+
+
+def test_push_since_last_review(git_history):
+    repo_path = git_history["repo_path"]
+    repo = Repo(repo_path)
+    diff = Diff(repo_path)
+    assert diff.last_reviewed_commit() is None
+
+    repo.index.commit("added second line")
+    patch = diff.push(since_last_review=True).create_patch()
+    assert "+second_line" in patch
+    diff.mark_reviewed()
+    assert diff.last_reviewed_commit() == repo.head.commit.hexsha
+    assert "refs/gait/reviewed/feature" in repo.git.for_each_ref()
+
+    repo.git.add(git_history["gitignore"])
+    repo.index.commit("added third line")
+    patch = diff.push(since_last_review=True).create_patch()
+    assert "+third_line" in patch
+    assert "+second_line" not in patch
+    assert "+second_line" in diff.push().create_patch()
+
+    # Rewritten history falls back to the remote
+    repo.git.reset("origin/feature", hard=True)
+    with open(git_history["gitignore"], "a") as f:
+        f.write("rewritten_line\n")
+    repo.git.add(git_history["gitignore"])
+    repo.index.commit("rewritten")
+    patch = diff.push(since_last_review=True).create_patch()
+    assert "+rewritten_line" in patch
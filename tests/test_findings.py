@@ -0,0 +1,123 @@
+import json
+from unittest.mock import MagicMock
+
+from gait.diff import Diff
+from gait.findings import (
+    Finding,
+    FindingsFormat,
+    FindingsParser,
+    parse_finding,
+    parse_findings,
+    render_findings,
+    response_format,
+    stream_findings,
+    summarize_findings,
+)
+
+ANSWER = json.dumps(
+    {
+        "findings": [
+            {"path": "a.py", "line": 3, "severity": "high", "message": 'Quote " and {brace}.'},
+            {"path": "b.py", "line": 0, "severity": "LOW", "message": "Missing test."},
+            {"path": "c.py", "line": 1, "severity": "minor", "message": "Unknown severity."},
+        ]
+    }
+)
+
+
+def test_response_format():
+    assert response_format("gpt-4o-mini")["json_schema"]["strict"]
+    assert response_format("gpt-4.1")["type"] == "json_schema"
+    assert response_format("gpt-4o-2024-05-13") == {"type": "json_object"}
+    assert response_format("gpt-4-turbo-preview") == {"type": "json_object"}
+
+
+def test_parse_finding():
+    assert parse_finding('{"path": "a.py", "line": "7", "severity": "medium", "message": "x"}') == (
+        Finding("a.py", 7, "medium", "x")
+    )
+    assert parse_finding('{"path": "a.py", "line": 1, "severity": "high"}') is None
+    assert parse_finding('{"path": "", "line": 1, "severity": "high", "message": "x"}') is None
+    assert parse_finding("{") is None
+
+
+def test_findings_parser():
+    parser = FindingsParser()
+    completed = [parser.feed(ANSWER[index : index + 7]) for index in range(0, len(ANSWER), 7)]
+    # Each finding is parsed with the chunk that closes it, before the answer is complete
+    first = next(index for index, findings in enumerate(completed) if findings)
+    assert first < len(completed) // 2
+    assert parser.findings == [
+        Finding("a.py", 3, "high", 'Quote " and {brace}.'),
+        Finding("b.py", 0, "low", "Missing test."),
+    ]
+    assert parser.content == ANSWER
+
+    # Models answering in JSON object mode may leave out the wrapping object
+    assert parse_findings('[{"path": "a.py", "line": 1, "severity": "low", "message": "x"}]') == [
+        Finding("a.py", 1, "low", "x")
+    ]
+    assert parse_findings("Not JSON") == []
+
+
+def test_stream_findings():
+    stream = [MagicMock(choices=[MagicMock(delta=MagicMock(content=ANSWER[:90]))])]
+    stream.append(MagicMock(choices=[MagicMock(delta=MagicMock(content=ANSWER[90:]))]))
+    stream.append(MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]))
+    arrived = []
+    content, findings = stream_findings(stream, arrived.append)
+    assert content == ANSWER
+    assert arrived == findings
+    assert len(findings) == 2
+
+
+def test_render_findings():
+    findings = parse_findings(ANSWER)
+    assert summarize_findings([]) == "No findings"
+    assert render_findings(findings, FindingsFormat.terminal) == (
+        'a.py:3: [high] Quote " and {brace}.\n'
+        "b.py:0: [low] Missing test.\n"
+        "2 findings: 1 high, 1 low\n"
+    )
+    assert json.loads(render_findings(findings, "json"))["findings"][1] == {
+        "path": "b.py",
+        "line": 0,
+        "severity": "low",
+        "message": "Missing test.",
+    }
+
+    sarif = json.loads(render_findings(findings, FindingsFormat.sarif))
+    assert sarif["version"] == "2.1.0"
+    results = sarif["runs"][0]["results"]
+    assert [result["level"] for result in results] == ["error", "note"]
+    assert results[0]["locations"][0]["physicalLocation"] == {
+        "artifactLocation": {"uri": "a.py"},
+        "region": {"startLine": 3},
+    }
+    assert "region" not in results[1]["locations"][0]["physicalLocation"]
+
+
+def test_review_findings_are_anchored_at_changed_files(mock_openai, git_history):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    finding = {"path": ".gitignore", "line": 2, "severity": "low", "message": "Sort the lines."}
+    content = json.dumps({"findings": [finding]})
+    openai_client.chat.completions.create.return_value = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=content))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    diff = Diff(git_history["repo_path"])
+    diff.add().create_patch()
+    assert "+++ b/.gitignore" not in diff.patch
+
+    review = diff.review_patch(openai_client, "gpt-4o", 0.7, "system prompt", findings=True)
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert "--- a/.gitignore\n+++ b/.gitignore\n@@" in request["messages"][1]["content"]
+
+    _, findings = stream_findings(review)
+    sarif = json.loads(render_findings(findings, FindingsFormat.sarif))
+    uris = [
+        result["locations"][0]["physicalLocation"]["artifactLocation"]["uri"]
+        for result in sarif["runs"][0]["results"]
+    ]
+    assert uris == [".gitignore"]
+    assert set(uris) <= {git_diff.b_path for git_diff in diff.diffs}
@@ -0,0 +1,120 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from gait.hedge import HedgedStream, hedge_outcome
+
+
+def chunk(content):
+    return MagicMock(choices=[MagicMock(delta=MagicMock(content=content))])
+
+
+class FakeStream:
+    def __init__(self, contents, first_token_delay=0.0):
+        self.contents = contents
+        self.first_token_delay = first_token_delay
+        self.closed = False
+
+    def __iter__(self):
+        yield chunk("")
+        time.sleep(self.first_token_delay)
+        for content in self.contents:
+            if self.closed:
+                return
+            yield chunk(content)
+        yield chunk(None)
+
+    def close(self):
+        self.closed = True
+
+
+def contents(stream):
+    return [item.choices[0].delta.content for item in stream]
+
+
+def test_primary_on_time():
+    primary = FakeStream(["primary"])
+    start_hedge = MagicMock()
+    stream = HedgedStream(lambda: primary, start_hedge, latency_budget=1.0)
+    assert contents(stream) == ["", "primary", None]
+    assert (stream.winner, stream.hedged) == ("primary", False)
+    assert hedge_outcome(stream) == "primary"
+    start_hedge.assert_not_called()
+
+
+def test_hedge_wins_and_primary_is_closed():
+    primary = FakeStream(["primary"], first_token_delay=1.0)
+    hedge = FakeStream(["hedge"])
+    stream = HedgedStream(lambda: primary, lambda: hedge, latency_budget=0.05)
+    assert contents(stream) == ["", "hedge", None]
+    assert (stream.winner, stream.hedged) == ("hedge", True)
+    assert hedge_outcome(stream) == "hedge"
+    assert primary.closed
+    assert not hedge.closed
+
+
+def test_primary_wins_after_hedge():
+    primary = FakeStream(["primary"], first_token_delay=0.1)
+    hedge = FakeStream(["hedge"], first_token_delay=1.0)
+    stream = HedgedStream(lambda: primary, lambda: hedge, latency_budget=0.05)
+    assert contents(stream) == ["", "primary", None]
+    assert hedge_outcome(stream) == "primary-after-hedge"
+    assert hedge.closed
+
+
+def test_budget_starts_once_the_primary_has_its_slot():
+    slot = threading.Event()
+    primary = FakeStream(["primary"], first_token_delay=0.02)
+
+    def start_primary():
+        # Queued in the rate limits for longer than the budget
+        time.sleep(0.2)
+        slot.set()
+        return primary
+
+    start_hedge = MagicMock()
+    stream = HedgedStream(start_primary, start_hedge, latency_budget=0.1, slot=slot)
+    assert contents(stream) == ["", "primary", None]
+    assert hedge_outcome(stream) == "primary"
+    start_hedge.assert_not_called()
+
+    def fail_before_slot():
+        raise Exception("no slot")
+
+    with pytest.raises(Exception, match="no slot"):
+        HedgedStream(fail_before_slot, start_hedge, latency_budget=1.0, slot=threading.Event())
+
+
+def test_failed_request_leaves_the_race():
+    def fail():
+        time.sleep(0.1)
+        raise Exception("primary failed")
+
+    hedge = FakeStream(["hedge"], first_token_delay=0.2)
+    stream = HedgedStream(fail, lambda: hedge, latency_budget=0.05)
+    assert contents(stream) == ["", "hedge", None]
+    assert stream.winner == "hedge"
+
+
+def test_all_requests_failing_raise_the_primary_error():
+    def fail(message):
+        def start():
+            raise Exception(message)
+
+        return start
+
+    with pytest.raises(Exception, match="primary failed"):
+        HedgedStream(fail("primary failed"), fail("hedge failed"), latency_budget=1.0)
+
+    def slow_fail():
+        time.sleep(0.1)
+        raise Exception("primary failed")
+
+    with pytest.raises(Exception, match="primary failed"):
+        HedgedStream(slow_fail, fail("hedge failed"), latency_budget=0.05)
+
+
+def test_hedge_outcome_of_plain_stream():
+    assert hedge_outcome([chunk("content")]) is None
@@ -1,6 +1,10 @@
+import json
+from unittest.mock import MagicMock
+
 from typer.testing import CliRunner
 
 from gait.main import app
+from gait.utils import read_prompt
 
 runner = CliRunner()
 
@@ -10,6 +14,7 @@ def test_main(mock_openai, monkeypatch, git_history):
     monkeypatch.setattr("gait.main.AuthenticationError", mock_openai["MockAuthenticationError"])
     monkeypatch.setattr("gait.main.NotFoundError", mock_openai["MockNotFoundError"])
     monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("GAIT_METRICS_DB", str(git_history["no_repo_path"] / "metrics.sqlite"))
 
     result = runner.invoke(app, ["--help"])
     assert "OpenAI Parameters" in result.stdout
@@ -25,6 +30,16 @@ def test_main(mock_openai, monkeypatch, git_history):
     assert non_existent_model_result.exit_code != 0
     assert "gpt-non-existent does not exist" in non_existent_model_result.stdout
 
+    # Test with non-existent hedge model
+    hedge_model_result = runner.invoke(app, ["--model", "gpt-4", "--hedge-model", "gpt-fast"])
+    assert hedge_model_result.exit_code != 0
+    assert "gpt-fast does not exist" in hedge_model_result.stdout
+
+    # Test with non-existent triage model
+    triage_model_result = runner.invoke(app, ["--model", "gpt-4", "--triage-model", "gpt-tiny"])
+    assert triage_model_result.exit_code != 0
+    assert "gpt-tiny does not exist" in triage_model_result.stdout
+
     # Test with invalid openai api key
     invalid_api_key_result = runner.invoke(app, ["--openai-api-key", "invalid-key"])
     print(invalid_api_key_result.stdout)
@@ -36,3 +51,133 @@ def test_main(mock_openai, monkeypatch, git_history):
     not_a_repo_result = runner.invoke(app)
     assert not_a_repo_result.exit_code != 0
     assert "Current directory is not a git repository" in not_a_repo_result.stdout
+
+    # Test scanning outside of a git repository
+    scan_result = runner.invoke(
+        app,
+        ["--model", "gpt-4", "scan", str(git_history["no_repo_path"]), "--output-dir", "scan"],
+    )
+    assert scan_result.exit_code == 0
+    assert "Scanned 0 repositories" in scan_result.stdout
+    sharded_scan_result = runner.invoke(
+        app, ["--model", "gpt-4", "--shard", "1/2", "scan", str(git_history["no_repo_path"])]
+    )
+    assert sharded_scan_result.exit_code == 2
+    assert "cannot be combined with scan" in sharded_scan_result.output
+    copies_without_renames_result = runner.invoke(
+        app, ["--find-renames", "0", "--find-copies", "50", "scan", "."]
+    )
+    assert copies_without_renames_result.exit_code == 2
+    assert "cannot be 0 with --find-copies" in copies_without_renames_result.output
+
+    # Test stats without an OpenAI API key
+    monkeypatch.delenv("OPENAI_API_KEY")
+    stats_result = runner.invoke(app, ["stats", "--openmetrics", "gait.prom"])
+    assert stats_result.exit_code == 0
+    assert "No reviews recorded" in stats_result.stdout
+    assert (git_history["no_repo_path"] / "gait.prom").read_text().endswith("# EOF\n")
+    stats_result = runner.invoke(app, ["stats", "--days", "7", "--openmetrics", "gait.prom"])
+    assert stats_result.exit_code == 0
+    metrics = (git_history["no_repo_path"] / "gait.prom").read_text()
+    assert "# TYPE gait_reviews_window gauge\n" in metrics
+
+    monkeypatch.chdir(git_history["repo_path"])
+    missing_api_key_result = runner.invoke(app, ["add"])
+    assert missing_api_key_result.exit_code != 0
+    assert "Missing OpenAI API key" in missing_api_key_result.stdout
+
+
+def test_shard_and_merge_results(mock_openai, monkeypatch, git_history):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    openai_client.chat.completions.create.return_value = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content="shard review"))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    monkeypatch.chdir(git_history["repo_path"])
+    monkeypatch.setattr("gait.main.OpenAI", lambda api_key: openai_client)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("GAIT_METRICS_DB", str(git_history["no_repo_path"] / "metrics.sqlite"))
+    results_dir = git_history["no_repo_path"] / "results"
+    options = ["--model", "gpt-4", "--results-dir", str(results_dir)]
+
+    invalid_shard_result = runner.invoke(app, options + ["--shard", "3/2", "add"])
+    assert invalid_shard_result.exit_code != 0
+    assert "3/2 is not between 1/2 and 2/2" in invalid_shard_result.stdout
+
+    first_shard_result = runner.invoke(app, options + ["--shard", "1/2", "add"])
+    assert first_shard_result.exit_code == 0
+    assert "Shard 1/2: .gitignore" in first_shard_result.stdout
+    assert "shard review" in first_shard_result.stdout
+    second_shard_result = runner.invoke(app, options + ["--shard", "2/2", "add"])
+    assert second_shard_result.exit_code == 0
+    assert "No files to review in shard 2/2" in second_shard_result.stdout
+    assert openai_client.chat.completions.create.call_count == 1
+
+    monkeypatch.delenv("OPENAI_API_KEY")
+    merge_result = runner.invoke(app, ["merge-results", str(results_dir)])
+    assert merge_result.exit_code == 0
+    assert merge_result.stdout.startswith("# gait add review of 2 shards\n")
+    assert "## Shard 1/2\n\nFiles: .gitignore\n\nshard review\n" in merge_result.stdout
+    assert "No files to review in this shard." in merge_result.stdout
+
+    report = git_history["no_repo_path"] / "report.md"
+    merge_result = runner.invoke(app, ["merge-results", str(results_dir), "--output", str(report)])
+    assert merge_result.exit_code == 0
+    assert report.read_text().startswith("# gait add review of 2 shards\n")
+
+
+def test_findings(mock_openai, monkeypatch, git_history):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    finding = {"path": ".gitignore", "line": 2, "severity": "medium", "message": "x"}
+    content = json.dumps({"findings": [finding]})
+    chunks = [content[:40], content[40:], None]
+
+    def create(**request):
+        return [MagicMock(choices=[MagicMock(delta=MagicMock(content=chunk))]) for chunk in chunks]
+
+    openai_client.chat.completions.create.side_effect = create
+    monkeypatch.chdir(git_history["repo_path"])
+    monkeypatch.setattr("gait.main.OpenAI", lambda api_key: openai_client)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("GAIT_METRICS_DB", str(git_history["no_repo_path"] / "metrics.sqlite"))
+
+    terminal_result = runner.invoke(app, ["--model", "gpt-4", "--findings", "terminal", "add"])
+    assert terminal_result.exit_code == 0
+    assert terminal_result.stdout == ".gitignore:2: [medium] x\n1 findings: 1 medium\n"
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert request["messages"][0]["content"] == read_prompt("findings")
+    assert request["response_format"] == {"type": "json_object"}
+
+    sarif = git_history["no_repo_path"] / "review.sarif"
+    sarif_result = runner.invoke(
+        app, ["--model", "gpt-4", "--findings", "sarif", "--findings-output", str(sarif), "add"]
+    )
+    assert sarif_result.exit_code == 0
+    assert json.loads(sarif.read_text())["runs"][0]["results"][0]["level"] == "warning"
+
+
+def test_findings_on_stdout_stay_parseable(mock_openai, monkeypatch, git_history):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    finding = {"path": ".gitignore", "line": 2, "severity": "medium", "message": "x"}
+    verdicts = [{"id": 0, "verdict": "needs-review", "reason": "logic"}]
+
+    def create(**request):
+        if not request.get("stream"):
+            content = json.dumps({"chunks": verdicts})
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=content))])
+        chunks = [json.dumps({"findings": [finding]}), None]
+        return [MagicMock(choices=[MagicMock(delta=MagicMock(content=chunk))]) for chunk in chunks]
+
+    openai_client.chat.completions.create.side_effect = create
+    monkeypatch.chdir(git_history["repo_path"])
+    monkeypatch.setattr("gait.main.OpenAI", lambda api_key: openai_client)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("GAIT_METRICS_DB", str(git_history["no_repo_path"] / "metrics.sqlite"))
+
+    # The status messages go to the standard error, leaving the report alone on the standard output
+    result = CliRunner(mix_stderr=False).invoke(
+        app, ["--model", "gpt-4", "--triage-model", "gpt-4", "--findings", "sarif", "add"]
+    )
+    assert result.exit_code == 0
+    assert json.loads(result.stdout)["runs"][0]["results"][0]["level"] == "warning"
+    assert result.stderr.startswith("Triage: 1 of 1 files need review")
@@ -0,0 +1,148 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from gait.map_reduce import MapReduceReview, context_window, split_file_patches, split_hunk
+from gait.patch import Hunk
+from gait.scheduler import estimate_tokens
+from gait.utils import read_prompt
+
+
+def fake_client(finding="- a.py:1: [low] finding"):
+    openai_client = MagicMock()
+
+    def create(**request):
+        if request.get("stream"):
+            return "review stream"
+        system_prompt = request["messages"][0]["content"]
+        content = finding if system_prompt == read_prompt("map") else "- merged: [low] findings"
+        return MagicMock(choices=[MagicMock(message=MagicMock(content=content))])
+
+    openai_client.chat.completions.create.side_effect = create
+    return openai_client
+
+
+def test_context_window():
+    assert context_window("gpt-4") == 8192
+    assert context_window("gpt-4-32k-0613") == 32768
+    assert context_window("gpt-4-turbo-preview") == 128000
+    assert context_window("gpt-3.5-turbo-0125") == 16385
+    assert context_window("gpt-4o-mini") == 128000
+    assert context_window("gpt-4.1-mini") == 1047576
+    assert context_window("gpt-4.5-preview") == 128000
+    assert context_window("gpt-5") == 400000
+    assert context_window("gpt-unknown") is None
+    with pytest.raises(ValueError, match="Unknown context window of gpt-unknown"):
+        MapReduceReview(MagicMock(), "gpt-unknown", 0.5)
+    assert MapReduceReview(MagicMock(), "gpt-unknown", 0.5, context_tokens=2048).fits("x")
+
+
+def test_split_hunk():
+    hunk = Hunk("@@ -10,4 +10,4 @@ def main():", [" a" * 5, "-b" * 5, "+c" * 5, " d" * 5])
+    assert split_hunk(hunk, 1000) == [hunk]
+    parts = split_hunk(hunk, 6)
+    assert [part.header for part in parts] == [
+        "@@ -10,2 +10,1 @@",
+        "@@ -12,1 +11,2 @@",
+    ]
+    assert sum((part.lines for part in parts), []) == hunk.lines
+
+    long_line = Hunk("@@ -1 +1 @@", ["+" + "x" * 100])
+    assert split_hunk(long_line, 5)[0].lines == ["+" + "x" * 19]
+
+
+def test_split_file_patches(make_file_patch):
+    small = [make_file_patch("a.py", changes=2), make_file_patch("b.py", changes=2)]
+    large = make_file_patch("large.py", changes=100)
+    parts = split_file_patches(small + [large], 300)
+    assert parts[0][0] == ["a.py", "b.py"]
+    assert len(parts) == 5
+    assert all(paths == ["large.py"] for paths, _ in parts[1:])
+    assert all(estimate_tokens(patch) <= 300 for _, patch in parts)
+    assert "".join(patch for _, patch in parts).count("xxxxxxxxxx\n") == 104
+
+
+def test_map_reduce_review(make_file_patch):
+    openai_client = fake_client()
+    reviewer = MapReduceReview(openai_client, "gpt-4", 0.5, context_tokens=2048)
+    assert reviewer.fits("x" * 4000)
+    assert not reviewer.fits("x" * 8000)
+
+    file_patches = [make_file_patch(f"{index}.py", changes=200) for index in range(5)]
+    assert reviewer.review(file_patches) == "review stream"
+    assert reviewer.parts == 10
+    assert reviewer.levels == 1
+    requests = [call.kwargs for call in openai_client.chat.completions.create.call_args_list]
+    assert len(requests) == reviewer.parts + 1
+    assert all(request["max_tokens"] == reviewer.findings_tokens for request in requests[:-1])
+    assert requests[-1]["messages"][0]["content"] == read_prompt("reduce")
+    assert requests[-1]["messages"][1]["content"].count("- a.py:1: [low] finding") == (
+        reviewer.parts
+    )
+
+
+def test_map_reduce_review_follows_system_prompt(make_file_patch):
+    openai_client = fake_client()
+    reviewer = MapReduceReview(
+        openai_client, "gpt-4", 0.5, context_tokens=2048, system_prompt="Focus on security."
+    )
+    reviewer.review([make_file_patch(f"{index}.py", changes=200) for index in range(2)])
+    final_request = openai_client.chat.completions.create.call_args.kwargs
+    assert final_request["messages"][0]["content"] == (
+        "Focus on security.\n\n" + read_prompt("reduce")
+    )
+
+
+def test_map_reduce_review_reasoning_model_parameters(make_file_patch):
+    openai_client = fake_client()
+    reviewer = MapReduceReview(openai_client, "gpt-5-mini", 1, context_tokens=2048)
+    reviewer.review([make_file_patch(f"{index}.py", changes=200) for index in range(2)])
+    requests = [call.kwargs for call in openai_client.chat.completions.create.call_args_list]
+    assert len(requests) > 2
+    for request in requests:
+        assert "max_tokens" not in request
+        assert "temperature" not in request
+    assert requests[0]["extra_body"] == {"max_completion_tokens": reviewer.findings_tokens}
+    assert "extra_body" not in requests[-1]
+
+    openai_client = fake_client()
+    MapReduceReview(openai_client, "gpt-4", 0.5, context_tokens=2048).review(
+        [make_file_patch("a.py", changes=200)]
+    )
+    first_request = openai_client.chat.completions.create.call_args_list[0].kwargs
+    assert first_request["temperature"] == 0.5
+    assert first_request["max_tokens"] > 0
+
+
+def test_map_reduce_review_combines_recursively(make_file_patch):
+    openai_client = fake_client("- a.py:1: [low] " + "long finding " * 100)
+    reviewer = MapReduceReview(openai_client, "gpt-4", 0.5, context_tokens=2048)
+    file_patches = [make_file_patch(f"{index}.py", changes=100) for index in range(5)]
+    assert reviewer.review(file_patches) == "review stream"
+    assert reviewer.levels == 2
+    final_request = openai_client.chat.completions.create.call_args.kwargs
+    assert "- merged: [low] findings" in final_request["messages"][1]["content"]
+
+
+def test_map_reduce_review_failed_parts(make_file_patch):
+    openai_client = fake_client()
+    create = openai_client.chat.completions.create.side_effect
+    calls = []
+
+    def fail_first_part(**request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise Exception("timeout")
+        return create(**request)
+
+    openai_client.chat.completions.create.side_effect = fail_first_part
+    reviewer = MapReduceReview(openai_client, "gpt-4", 0.5, context_tokens=2048, max_workers=1)
+    reviewer.review([make_file_patch("a.py", changes=100), make_file_patch("b.py", changes=100)])
+    final_request = openai_client.chat.completions.create.call_args.kwargs
+    assert "- a.py: [low] This part of the patch could not be reviewed." in (
+        final_request["messages"][1]["content"]
+    )
+
+    openai_client.chat.completions.create.side_effect = Exception("invalid key")
+    with pytest.raises(Exception, match="invalid key"):
+        reviewer.review([make_file_patch("a.py", changes=100)])
@@ -0,0 +1,199 @@
+import sqlite3
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from gait.metrics import (
+    MetricsStore,
+    ReviewRecord,
+    StreamTimer,
+    format_summary,
+    percentile,
+    review_record,
+    summarize,
+    to_openmetrics,
+    write_openmetrics,
+)
+from gait.patch import FilePatch
+
+
+def make_record(
+    command="add",
+    duration_seconds=1.0,
+    ttft_seconds=0.5,
+    timestamp=1000.0,
+    hedge_winner=None,
+    diff_seconds=None,
+):
+    return ReviewRecord(
+        command=command,
+        patch_bytes=100,
+        files=2,
+        input_tokens=30,
+        output_tokens=10,
+        ttft_seconds=ttft_seconds,
+        duration_seconds=duration_seconds,
+        cache_hits=1,
+        hedge_winner=hedge_winner,
+        diff_seconds=diff_seconds,
+        renamed_files=1,
+        timestamp=timestamp,
+    )
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3.0], 0.99) == 3.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 0.5) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 0.9) == pytest.approx(4.6)
+
+
+def test_stream_timer():
+    stream = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=""))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content="mock"))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=" content"))]),
+        MagicMock(choices=[]),
+    ]
+    timer = StreamTimer(stream)
+    assert timer.ttft_seconds is None
+    assert list(timer) == stream
+    assert timer.chunks == 2
+    assert 0 <= timer.ttft_seconds <= timer.elapsed
+
+
+def test_review_record():
+    diff = SimpleNamespace(
+        patch="a" * 40,
+        diffs=[1, 2],
+        file_patches=[
+            FilePatch("a.py", "b.py", renamed_file=True),
+            FilePatch("c.py", "c.py"),
+        ],
+        symbol_cache=SimpleNamespace(hits=3),
+        hedge_winner="hedge",
+        diff_seconds=0.25,
+    )
+    timer = StreamTimer([])
+    record = review_record("commit", diff, "b" * 40, timer)
+    assert (record.command, record.patch_bytes, record.files) == ("commit", 40, 2)
+    assert (record.input_tokens, record.output_tokens, record.cache_hits) == (21, 0, 3)
+    assert record.ttft_seconds is None
+    assert record.hedge_winner == "hedge"
+    assert (record.diff_seconds, record.renamed_files) == (0.25, 1)
+
+
+def test_metrics_store(tmp_path):
+    store = MetricsStore(tmp_path / "nested" / "metrics.sqlite")
+    assert store.records() == []
+    store.record(make_record("add", timestamp=1000.0))
+    store.record(make_record("push", timestamp=2000.0, hedge_winner="hedge"))
+    assert store.records() == [
+        make_record("add"),
+        make_record("push", timestamp=2000.0, hedge_winner="hedge"),
+    ]
+    pushed = [make_record("push", timestamp=2000.0, hedge_winner="hedge")]
+    assert store.records(command="push") == pushed
+    assert store.records(since=1500.0) == pushed
+
+
+def test_metrics_store_adds_missing_columns(tmp_path):
+    path = tmp_path / "metrics.sqlite"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE reviews (command TEXT, patch_bytes INTEGER, files INTEGER, "
+        "input_tokens INTEGER, output_tokens INTEGER, ttft_seconds REAL, "
+        "duration_seconds REAL, timestamp REAL)"
+    )
+    connection.execute("INSERT INTO reviews VALUES ('add', 1, 1, 1, 1, NULL, 1.0, 1.0)")
+    connection.commit()
+    connection.close()
+
+    store = MetricsStore(path)
+    assert store.records()[0].cache_hits is None
+    assert store.records()[0].hedge_winner is None
+    assert summarize(store.records())["add"]["renamed_files"] == 0
+    store.record(make_record())
+    assert len(store.records()) == 2
+
+
+def test_summarize_and_format():
+    records = [
+        make_record("add", duration_seconds=1.0, ttft_seconds=None),
+        make_record("add", duration_seconds=3.0, ttft_seconds=0.5, diff_seconds=0.1),
+        make_record("push", duration_seconds=2.0, hedge_winner="hedge"),
+        make_record("push", duration_seconds=2.0, hedge_winner="primary"),
+        make_record("push", duration_seconds=2.0, hedge_winner="hedge"),
+    ]
+    summary = summarize(records)
+    assert list(summary) == ["add", "push"]
+    assert summary["add"]["count"] == 2
+    assert summary["add"]["duration_seconds"][0.5] == 2.0
+    assert summary["add"]["ttft_seconds_count"] == 1
+    assert summary["add"]["input_tokens"] == 60
+    assert summary["add"]["diff_seconds_count"] == 1
+    assert summary["add"]["renamed_files"] == 2
+    assert summary["add"]["hedges"] == {}
+    assert summary["push"]["hedges"] == {"hedge": 2, "primary": 1}
+
+    table = format_summary(summary).splitlines()
+    assert table[0].startswith("command  reviews  duration p50/p90/p99 (s)")
+    assert table[1].startswith("add      2        2.00/2.80/2.98")
+    assert "0.10/0.10/0.10" in table[1]
+    assert "-/-/-" in table[2]
+    assert table[1].endswith("  -")
+    assert table[2].endswith("hedge=2,primary=1")
+
+
+def test_openmetrics(tmp_path):
+    records = [
+        make_record("add", hedge_winner="primary-after-hedge"),
+        make_record("add", ttft_seconds=None, diff_seconds=0.5),
+    ]
+    summary = summarize(records)
+    metrics = to_openmetrics(summary)
+    assert 'gait_review_duration_seconds{command="add",quantile="0.5"} 1.0\n' in metrics
+    assert 'gait_review_duration_seconds_count{command="add"} 2\n' in metrics
+    assert 'gait_review_ttft_seconds_count{command="add"} 1\n' in metrics
+    assert 'gait_review_diff_seconds_sum{command="add"} 0.5\n' in metrics
+    assert 'gait_renamed_files_total{command="add"} 2\n' in metrics
+    assert "# TYPE gait_input_tokens counter\n" in metrics
+    assert 'gait_input_tokens_total{command="add"} 60\n' in metrics
+    assert (
+        'gait_review_hedge_winner_total{command="add",winner="primary-after-hedge"} 1\n' in metrics
+    )
+    assert metrics.endswith("# EOF\n")
+
+    path = tmp_path / "gait.prom"
+    write_openmetrics(summary, path)
+    assert path.read_text() == metrics
+    assert list(tmp_path.iterdir()) == [path]
+    assert "_window" not in metrics
+
+
+def test_openmetrics_window(tmp_path):
+    records = [
+        make_record("pr", duration_seconds=5.0),
+        make_record("add", duration_seconds=1.0),
+        make_record("add", duration_seconds=3.0),
+    ]
+    totals = summarize(records)
+    window = summarize(records[2:])
+    metrics = to_openmetrics(totals, window)
+    # Counters stay all-time totals, so that they do not decrease when the window moves
+    assert 'gait_input_tokens_total{command="add"} 60\n' in metrics
+    assert 'gait_review_duration_seconds_count{command="add"} 2\n' in metrics
+    assert 'gait_review_duration_seconds{command="add",quantile="0.5"} 3.0\n' in metrics
+    assert "# TYPE gait_input_tokens_window gauge\n" in metrics
+    assert 'gait_input_tokens_window{command="add"} 30\n' in metrics
+    assert 'gait_reviews_window{command="add"} 1\n' in metrics
+    # Commands without records in the window keep their totals but have no current quantiles
+    assert 'gait_review_duration_seconds_count{command="pr"} 1\n' in metrics
+    assert 'gait_review_duration_seconds{command="pr"' not in metrics
+    assert 'gait_reviews_window{command="pr"}' not in metrics
+    assert metrics.endswith("# EOF\n")
+
+    path = tmp_path / "gait.prom"
+    write_openmetrics(totals, path, window=window)
+    assert path.read_text() == metrics
@@ -0,0 +1,52 @@
+from git import Repo
+
+from gait.patch import FilePatch, Hunk, parse_hunks
+
+PATCH = """@@ -1,2 +1,3 @@
+ first_line
++second_line
+ third_line
+@@ -10 +11 @@ def f():
+-    return 1
++    return 2
+\\ No newline at end of file
+"""
+
+
+def test_parse_hunks():
+    hunks, preamble = parse_hunks(PATCH)
+    assert preamble == ""
+    assert len(hunks) == 2
+    assert (hunks[0].old_start, hunks[0].old_length) == (1, 2)
+    assert (hunks[0].new_start, hunks[0].new_length) == (1, 3)
+    assert (hunks[1].old_start, hunks[1].old_length) == (10, 1)
+    assert hunks[1].changes == ["-    return 1", "+    return 2"]
+    assert "".join(hunk.render() for hunk in hunks) == PATCH
+
+    hunks, preamble = parse_hunks("Binary files differ\n")
+    assert hunks == []
+    assert preamble == "Binary files differ\n"
+
+
+def test_hunk_with_invalid_header():
+    hunk = Hunk("@@ -14,22- +14,21- @@", ["+third_line"])
+    assert hunk.old_start is None
+    assert hunk.render() == "@@ -14,22- +14,21- @@\n+third_line\n"
+
+
+def test_file_patch(git_history):
+    repo = Repo(git_history["repo_path"])
+    git_diff = repo.index.diff(None, create_patch=True)[0]
+    file_patch = FilePatch.from_diff(git_diff)
+    assert file_patch.path == ".gitignore"
+    assert file_patch.render() == (
+        "--- a/.gitignore\n+++ b/.gitignore\n" + git_diff.diff.decode("utf-8")
+    )
+
+    new_file = FilePatch(None, "new.py", new_file=True)
+    assert new_file.render_header() == "--- /dev/null\n+++ b/new.py\n"
+
+    renamed = FilePatch("src/a.py", "lib/a.py", renamed_file=True)
+    assert renamed.render_header() == "rename src/a.py => lib/a.py\n"
+    copied = FilePatch("src/a.py", "lib/b.py", copied_file=True)
+    assert copied.render() == "copy src/a.py => lib/b.py\n"
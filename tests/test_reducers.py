@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from gait import reducers
+from gait.reducers import diff_mappings, find_reducer, flatten, reduce_file
+
+
+def notebook(*cells):
+    return json.dumps(
+        {
+            "cells": [
+                {"cell_type": "code", "source": source, "outputs": outputs}
+                for source, outputs in cells
+            ],
+            "metadata": {"kernelspec": {"name": "python3"}},
+        }
+    ).encode("utf-8")
+
+
+def test_find_reducer():
+    assert find_reducer("notebooks/analysis.ipynb")[0] == "notebook cell sources"
+    assert find_reducer("poetry.lock")[0] == "locked package versions"
+    assert find_reducer("web/package-lock.json")[1] is reducers.reduce_npm_lock
+    assert find_reducer("tests/fixtures/data.json")[1] is reducers.reduce_json
+    assert find_reducer("config.yml")[1] is reducers.reduce_yaml
+    assert find_reducer("main.py") is None
+
+
+def test_diff_mappings():
+    old = {"a": "1", "b": "2", "c": "3"}
+    new = {"a": "1", "b": "20", "d": "x" * 100}
+    assert diff_mappings(old, new, ": ") == [
+        "~ b: 2 -> 20",
+        "- c: 3",
+        f"+ d: {'x' * 80}... (100 characters)",
+    ]
+
+
+def test_flatten():
+    assert flatten({"a": {"b": [1, {"c": None}], "d": {}}, "e": []}) == {
+        "$.a.b[0]": "1",
+        "$.a.b[1].c": "null",
+        "$.a.d": "{}",
+        "$.e": "[]",
+    }
+
+
+def test_reduce_notebook():
+    image = {"data": {"image/png": "iVBORw0KGgo" * 1000}, "output_type": "display_data"}
+    old = notebook(("import pandas\n", []), (["df = load()\n", "df.plot()"], []))
+    new = notebook(("import pandas\n", []), (["df = load(cache=True)\n", "df.plot()"], [image]))
+    reduced = reduce_file("analysis.ipynb", old, new)
+    assert reduced.splitlines() == [
+        "# Semantic diff of the notebook cell sources, the raw hunks are left out",
+        "@@ -3,3 +3,3 @@",
+        " # %% [code] cell 2",
+        "-df = load()",
+        "+df = load(cache=True)",
+        " df.plot()",
+        "# Outputs changed in 1 cells, not shown",
+    ]
+    assert reduce_file("analysis.ipynb", None, old).count("\n+") == 5
+
+
+def test_reduce_lockfiles():
+    poetry_lock = (
+        '[[package]]\nname = "requests"\nversion = "{}"\ndescription = "HTTP"\n\n'
+        '[[package]]\nname = "{}"\nversion = "1.0"\n'
+    )
+    reduced = reduce_file(
+        "poetry.lock",
+        poetry_lock.format("2.30.0", "idna").encode(),
+        poetry_lock.format("2.31.0", "certifi").encode(),
+    )
+    assert reduced.splitlines()[1:] == [
+        "+ certifi 1.0",
+        "- idna 1.0",
+        "~ requests 2.30.0 -> 2.31.0",
+    ]
+
+    def npm_lock(version):
+        packages = {"": {"name": "app"}, "node_modules/left-pad": {"version": version}}
+        return json.dumps({"lockfileVersion": 3, "packages": packages}).encode()
+
+    reduced = reduce_file("package-lock.json", npm_lock("1.0.0"), npm_lock("1.3.0"))
+    assert reduced.splitlines()[1:] == ["~ left-pad 1.0.0 -> 1.3.0"]
+
+    pipfile_lock = json.dumps({"default": {"six": {"version": "==1.16.0"}}, "develop": {}})
+    reduced = reduce_file("Pipfile.lock", None, pipfile_lock.encode())
+    assert reduced.splitlines()[1:] == ["+ six 1.16.0"]
+
+
+def test_reduce_json_and_yaml():
+    reduced = reduce_file("fixture.json", b'{"a": [1, 2], "b": "x"}', b'{"a": [1, 3], "b": "x"}')
+    assert reduced.splitlines() == [
+        "# Semantic diff of the key paths, the raw hunks are left out",
+        "~ $.a[1]: 2 -> 3",
+    ]
+    assert reduce_file("fixture.json", b"{}", b"{ }").endswith("# No semantic changes\n")
+    assert reduce_file("broken.json", b"{", b"{}") is None
+    assert reduce_file("main.py", b"", b"") is None
+
+    pytest.importorskip("yaml")
+    reduced = reduce_file("ci.yml", b"jobs:\n  test: {os: linux}\n", b"jobs:\n  test: {os: mac}\n")
+    assert reduced.splitlines()[1:] == ['~ $.jobs.test.os: "linux" -> "mac"']
+    reduced = reduce_file("docs.yaml", b"a: 1\n---\nb: 2\n", b"a: 1\n---\nb: 3\n")
+    assert reduced.splitlines()[1:] == ["~ $[1].b: 2 -> 3"]
+
+
+def test_reduce_yaml_without_pyyaml(monkeypatch):
+    monkeypatch.setattr(reducers, "yaml", None)
+    assert reduce_file("ci.yml", b"a: 1\n", b"a: 2\n") is None
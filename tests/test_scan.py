@@ -0,0 +1,115 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from git import Repo
+
+from gait.findings import FindingsFormat
+from gait.metrics import MetricsStore
+from gait.scan import find_repositories, review_repository, scan_repositories
+
+
+def make_config():
+    return SimpleNamespace(
+        openai_api_key="test-key",
+        model="gpt-4",
+        temperature=1,
+        system_prompt="system prompt",
+        triage_model=None,
+        map_reduce=True,
+        context_window=None,
+        findings=None,
+        diff_options={"unified": 3},
+        rate_limit_state=None,
+        metrics_db=None,
+    )
+
+
+def test_find_repositories(tmp_path):
+    Repo.init(tmp_path / "service_a")
+    Repo.init(tmp_path / "group" / "service_b")
+    Repo.init(tmp_path / "service_a" / "nested")
+    Repo.init(tmp_path / "a" / "b" / "c" / "too_deep")
+    (tmp_path / "not_a_repo").mkdir()
+
+    repositories = find_repositories(tmp_path)
+    assert repositories == [tmp_path / "group" / "service_b", tmp_path / "service_a"]
+    assert find_repositories(tmp_path, max_depth=4)[0] == tmp_path / "a" / "b" / "c" / "too_deep"
+
+
+def test_review_repository(mock_openai, monkeypatch, git_history, tmp_path):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    openai_client.chat.completions.create.return_value = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content="looks good"))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    monkeypatch.setattr("gait.scan.OpenAI", lambda api_key: openai_client)
+    output_path = tmp_path / "review.md"
+
+    result = review_repository(git_history["repo_path"], "push", make_config(), output_path)
+    assert result["status"] == "no-diffs"
+    assert result["output"] is None
+
+    result = review_repository(git_history["no_repo_path"], "add", make_config(), output_path)
+    assert result["status"] == "not-a-repo"
+
+    config = make_config()
+    config.metrics_db = tmp_path / "metrics.sqlite"
+    result = review_repository(git_history["repo_path"], "add", config, output_path)
+    assert result["status"] == "reviewed"
+    assert result["output"] == str(output_path)
+    assert output_path.read_text() == "looks good"
+    records = MetricsStore(config.metrics_db).records()
+    assert [(record.command, record.output_tokens) for record in records] == [("scan-add", 1)]
+
+    openai_client.chat.completions.create.side_effect = Exception("rate limited")
+    result = review_repository(git_history["repo_path"], "commit", make_config(), output_path)
+    assert result["status"] == "error"
+    assert result["detail"] == "rate limited"
+
+
+def test_review_repository_findings(mock_openai, monkeypatch, git_history, tmp_path):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    content = '{"findings": [{"path": ".gitignore", "line": 3, "severity": "low", "message": "x"}]}'
+    openai_client.chat.completions.create.return_value = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=content))]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    monkeypatch.setattr("gait.scan.OpenAI", lambda api_key: openai_client)
+    config = make_config()
+    config.findings = FindingsFormat.sarif
+
+    result = review_repository(git_history["repo_path"], "add", config, tmp_path / "review.sarif")
+    assert result["status"] == "reviewed"
+    sarif = json.loads((tmp_path / "review.sarif").read_text())
+    assert sarif["runs"][0]["results"][0]["message"] == {"text": "x"}
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert request["response_format"] == {"type": "json_object"}
+
+
+def test_review_repository_with_triage(mock_openai, monkeypatch, git_history, tmp_path):
+    openai_client = mock_openai["MockOpenAI"]("test-key")
+    content = json.dumps({"chunks": [{"id": 0, "verdict": "trivial", "reason": "ignore list"}]})
+    openai_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content=content))]
+    )
+    monkeypatch.setattr("gait.scan.OpenAI", lambda api_key: openai_client)
+    config = make_config()
+    config.triage_model = "gpt-3.5-turbo"
+
+    result = review_repository(git_history["repo_path"], "add", config, tmp_path / "review.md")
+    assert result["status"] == "no-code-changes"
+    assert result["trivial_files"] == [".gitignore"]
+    assert openai_client.chat.completions.create.call_args.kwargs["model"] == "gpt-3.5-turbo"
+
+
+def test_scan_repositories(git_history, tmp_path):
+    root = tmp_path / "repos"
+    Repo.init(root / "clean")
+    output_dir = tmp_path / "scan"
+
+    summary = scan_repositories(root, "add", make_config(), output_dir, max_workers=2)
+    assert summary["repositories"] == 1
+    assert summary["statuses"] == {"no-diffs": 1}
+    assert summary["results"][0]["repo"] == str(root / "clean")
+    assert json.loads((output_dir / "summary.json").read_text()) == summary
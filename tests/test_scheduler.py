@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+import pytest
+
+from gait.scheduler import Priority, RequestScheduler, estimate_tokens, parse_duration
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("a" * 400) == 101
+
+
+def test_parse_duration():
+    assert parse_duration("1s") == 1
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("") == 0
+
+
+def test_acquire(tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RequestScheduler(
+        state_path, requests_per_minute=2, tokens_per_minute=1000, expected_output_tokens=100
+    )
+    with scheduler.acquire(100):
+        pass
+    state = json.loads(state_path.read_text())
+    assert state["waiting"] == {}
+    assert state["buckets"]["requests"]["remaining"] == pytest.approx(1, abs=0.01)
+    assert state["buckets"]["tokens"]["remaining"] == pytest.approx(800, abs=1)
+    assert not scheduler.lock_path.exists()
+
+
+def test_acquire_waits_for_refill(tmp_path):
+    scheduler = RequestScheduler(
+        tmp_path / "state.json",
+        requests_per_minute=6000,
+        tokens_per_minute=6000,
+        expected_output_tokens=0,
+        poll_interval=0.01,
+    )
+    with scheduler.acquire(6000):
+        pass
+    start = time.perf_counter()
+    # 60 tokens refill in 0.6 seconds at 100 tokens per second
+    with scheduler.acquire(60):
+        pass
+    assert time.perf_counter() - start >= 0.5
+
+
+def test_acquire_priority(tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RequestScheduler(state_path, expected_output_tokens=0, poll_interval=0.01)
+    # No request slot refills during the test, both requests wait for the one released below
+    scheduler.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "1000h",
+        }
+    )
+    order = []
+
+    def request(name, priority):
+        with scheduler.acquire(1, priority):
+            order.append(name)
+
+    threads = [
+        threading.Thread(target=request, args=("batch", Priority.batch)),
+        threading.Thread(target=request, args=("interactive", Priority.interactive)),
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 10
+    while len(json.loads(state_path.read_text())["waiting"]) < 2 and time.time() < deadline:
+        time.sleep(0.005)
+    assert order == []
+
+    scheduler.update_from_headers(
+        {"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "2"}
+    )
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "batch"]
+
+
+def test_update_from_headers(tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RequestScheduler(state_path)
+    scheduler.update_from_headers({"x-request-id": "abc"})
+    assert not state_path.exists()
+
+    scheduler.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "59",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": "1000",
+            "x-ratelimit-remaining-tokens": "400",
+            "x-ratelimit-reset-tokens": "6m0s",
+        }
+    )
+    buckets = json.loads(state_path.read_text())["buckets"]
+    assert buckets["requests"]["limit"] == 60
+    assert buckets["requests"]["rate"] == 1
+    assert buckets["tokens"]["remaining"] == 400
+    assert buckets["tokens"]["rate"] == pytest.approx(600 / 360)
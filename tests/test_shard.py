@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from gait.errors import InvalidShardResults
+from gait.shard import (
+    assign_shards,
+    load_results,
+    parse_shard,
+    result_path,
+    stitch_results,
+    write_result,
+)
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    assert parse_shard(" 1/1 ") == (1, 1)
+    for invalid in ("0/4", "5/4", "2", "a/b", "2/0"):
+        with pytest.raises(ValueError):
+            parse_shard(invalid)
+
+
+def test_assign_shards():
+    paths = ["a.py", "b.py", "c.py", "d.py", "e.py"]
+    tokens = [100, 60, 50, 40, 10]
+    shards = assign_shards(paths, tokens, 2)
+    assert shards == [1, 2, 2, 1, 2]
+    loads = [sum(tokens[i] for i in range(5) if shards[i] == shard) for shard in (1, 2)]
+    assert loads == [140, 120]
+
+    # The assignment depends on the files, not on their order
+    reordered = assign_shards(list(reversed(paths)), list(reversed(tokens)), 2)
+    assert list(reversed(reordered)) == shards
+    assert assign_shards(["a.py", "b.py"], [5, 5], 3) == [1, 2]
+
+
+def test_write_and_stitch_results(tmp_path):
+    write_result(tmp_path, 1, 3, "pr", ["a.py"], 100, "Looks good.\n")
+    write_result(tmp_path, 3, 3, "pr", [], 0, "")
+    (tmp_path / "unrelated.json").write_text("{}")
+    assert json.loads(result_path(tmp_path, 1, 3).read_text())["patch_tokens"] == 100
+
+    results = load_results([tmp_path])
+    assert [result["shard"] for result in results] == [1, 3]
+    assert stitch_results(results) == (
+        "# gait pr review of 3 shards\n\n"
+        "Missing the results of shards 2/3\n\n"
+        "## Shard 1/3\n\nFiles: a.py\n\nLooks good.\n\n"
+        "## Shard 3/3\n\nFiles: no files\n\nNo files to review in this shard.\n"
+    )
+    assert stitch_results([]) == "No shard results found\n"
+
+
+def test_load_results_rejects_mixed_shards(tmp_path):
+    first = write_result(tmp_path / "a", 1, 2, "pr", ["a.py"], 1, "review")
+    other_count = write_result(tmp_path / "b", 1, 3, "pr", ["a.py"], 1, "review")
+    with pytest.raises(InvalidShardResults, match="result of 3 shards"):
+        load_results([first, other_count])
+    repeated = write_result(tmp_path / "c", 1, 2, "pr", ["a.py"], 1, "review")
+    with pytest.raises(InvalidShardResults, match="repeats the result of shard 1"):
+        load_results([first, repeated])
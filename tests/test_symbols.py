@@ -0,0 +1,123 @@
+import time
+
+from gait.patch import FilePatch, parse_hunks
+from gait.symbols import (
+    Symbol,
+    SymbolCache,
+    blob_sha,
+    expand_hunks,
+    heuristic_symbols,
+    index_symbols,
+    python_symbols,
+)
+
+PYTHON_SOURCE = """import os
+
+
+class Greeter:
+    @staticmethod
+    def greet(name):
+        message = f"Hello {name}"
+        print(message)
+        return message
+
+
+def main():
+    Greeter.greet("world")
+"""
+
+C_SOURCE = """#include <stdio.h>
+
+static int add(int a, int b) {
+    if (a > b) {
+        return a;
+    }
+    return a + b;
+}
+
+int main(void)
+{
+    return add(1, 2);
+}
+"""
+
+
+def test_blob_sha():
+    # git hash-object of an empty file
+    assert blob_sha(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+def test_python_symbols():
+    assert python_symbols(PYTHON_SOURCE) == [
+        Symbol("Greeter", 4, 9),
+        Symbol("main", 12, 13),
+        Symbol("greet", 5, 9),
+    ]
+    assert python_symbols("def broken(:\n") is None
+
+
+def test_heuristic_symbols():
+    assert heuristic_symbols(C_SOURCE) == [Symbol("add", 3, 8), Symbol("main", 10, 13)]
+    assert heuristic_symbols("func (s *Server) Run() error {\n\treturn nil\n}\n") == [
+        Symbol("Run", 1, 3)
+    ]
+    assert index_symbols("def broken(:\n    pass\n", "broken.py") == [Symbol("broken", 1, 2)]
+
+
+def test_heuristic_symbols_comment_banner():
+    banner = "/" + "*" * 60 + "/"
+    start = time.perf_counter()
+    # Lines of asterisks used to backtrack exponentially in the C-like function pattern
+    source = f"{banner}\n * {'*' * 60}\n{'*' * 60}/\n{C_SOURCE}"
+    symbols = heuristic_symbols(source)
+    assert time.perf_counter() - start < 1
+    assert [symbol.name for symbol in symbols] == ["add", "main"]
+
+
+def test_symbol_cache(tmp_path):
+    cache = SymbolCache(tmp_path)
+    content = PYTHON_SOURCE.encode("utf-8")
+    symbols = cache.symbols(content, "greeter.py")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert (tmp_path / f"{blob_sha(content)}.python.json").exists()
+    assert cache.symbols(content, "other.py") == symbols
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.symbols(content, "greeter.txt")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_expand_hunks():
+    post_image = PYTHON_SOURCE.splitlines()
+    hunks, _ = parse_hunks(
+        "@@ -7 +7 @@ class Greeter:\n"
+        '-        message = f"Hi {name}"\n'
+        '+        message = f"Hello {name}"\n'
+        "@@ -13 +13 @@ def main():\n"
+        '-    Greeter.greet("everyone")\n'
+        '+    Greeter.greet("world")\n'
+    )
+    file_patch = FilePatch("greeter.py", "greeter.py", hunks)
+    expanded = expand_hunks(file_patch, post_image, python_symbols(PYTHON_SOURCE))
+    assert expanded[0].header == "@@ -5,5 +5,5 @@ class Greeter:"
+    assert expanded[0].lines[0] == "     @staticmethod"
+    assert expanded[0].lines[-1] == "         return message"
+    assert expanded[1].header == "@@ -12,2 +12,2 @@ def main():"
+    assert expanded[1].lines[0] == " def main():"
+
+    # Hunks outside of any symbol are left as they are
+    hunks, _ = parse_hunks("@@ -1 +1 @@\n-import sys\n+import os\n")
+    file_patch = FilePatch("greeter.py", "greeter.py", hunks)
+    assert expand_hunks(file_patch, post_image, python_symbols(PYTHON_SOURCE)) == hunks
+
+
+def test_expand_hunks_stops_at_neighbour_hunks():
+    post_image = C_SOURCE.splitlines()
+    hunks, _ = parse_hunks(
+        "@@ -4 +4 @@\n-    if (a >= b) {\n+    if (a > b) {\n"
+        "@@ -6,0 +7 @@\n+    return a + b;\n"
+    )
+    file_patch = FilePatch("add.c", "add.c", hunks)
+    expanded = expand_hunks(file_patch, post_image, heuristic_symbols(C_SOURCE))
+    assert expanded[0].header == "@@ -3,4 +3,4 @@"
+    assert expanded[1].header == "@@ -7,1 +7,2 @@"
+    assert expanded[1].lines == ["+    return a + b;", " }"]
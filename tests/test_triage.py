@@ -0,0 +1,113 @@
+import json
+from unittest.mock import MagicMock
+
+from gait.scheduler import RequestScheduler
+from gait.triage import (
+    TriageVerdict,
+    batch_chunks,
+    format_triage,
+    parse_verdicts,
+    triage_file_patches,
+)
+
+
+def completion(verdicts):
+    content = json.dumps({"chunks": verdicts})
+    return MagicMock(choices=[MagicMock(message=MagicMock(content=content))])
+
+
+def test_parse_verdicts():
+    content = json.dumps(
+        {
+            "chunks": [
+                {"id": 0, "verdict": "trivial", "reason": "typo"},
+                {"id": "1", "verdict": "needs-review"},
+                {"id": 2, "verdict": "maybe"},
+                {"verdict": "trivial"},
+            ]
+        }
+    )
+    assert parse_verdicts(content) == {0: (False, "typo"), 1: (True, "")}
+    assert parse_verdicts("not json") == {}
+    assert parse_verdicts('{"chunks": "none"}') == {}
+
+
+def test_batch_chunks():
+    chunks = {0: "a" * 40, 1: "b" * 40, 2: "c" * 40, 3: "d" * 100}
+    assert batch_chunks(chunks, 25) == [[0, 1], [2], [3]]
+    assert batch_chunks({}, 25) == []
+
+
+def test_triage_file_patches(make_file_patch):
+    openai_client = MagicMock()
+    openai_client.chat.completions.create.return_value = completion(
+        [
+            {"id": 0, "verdict": "trivial", "reason": "formatting"},
+            {"id": 1, "verdict": "needs-review", "reason": "logic change"},
+            {"id": 5, "verdict": "trivial", "reason": "not in the batch"},
+        ]
+    )
+    file_patches = [
+        make_file_patch("style.py"),
+        make_file_patch("logic.py"),
+        make_file_patch("missing.py"),
+        make_file_patch("large.py", changes=1000),
+    ]
+    verdicts = triage_file_patches(
+        openai_client, "gpt-3.5-turbo", file_patches, "triage prompt", max_chunk_tokens=1000
+    )
+    assert verdicts == [
+        TriageVerdict("style.py", False, "formatting"),
+        TriageVerdict("logic.py", True, "logic change"),
+        TriageVerdict("missing.py", True, "not triaged"),
+        TriageVerdict("large.py", True, "too large to triage"),
+    ]
+    request = openai_client.chat.completions.create.call_args.kwargs
+    assert request["model"] == "gpt-3.5-turbo"
+    assert request["response_format"] == {"type": "json_object"}
+    assert request["messages"][0]["content"] == "triage prompt"
+    assert "### Chunk 1: logic.py\n--- a/logic.py\n+++ b/logic.py\n" in (
+        request["messages"][1]["content"]
+    )
+    assert "large.py" not in request["messages"][1]["content"]
+
+
+def test_triage_file_patches_fails_open(make_file_patch):
+    openai_client = MagicMock()
+    openai_client.chat.completions.create.side_effect = Exception("rate limited")
+    file_patches = [make_file_patch("a.py"), make_file_patch("b.py")]
+    verdicts = triage_file_patches(
+        openai_client, "gpt-3.5-turbo", file_patches, "triage prompt", batch_tokens=1
+    )
+    assert [verdict.needs_review for verdict in verdicts] == [True, True]
+    assert openai_client.chat.completions.create.call_count == 2
+
+
+def test_triage_file_patches_with_scheduler(tmp_path, make_file_patch):
+    openai_client = MagicMock()
+    response = openai_client.chat.completions.with_raw_response.create.return_value
+    response.headers = {
+        "x-ratelimit-limit-requests": "500",
+        "x-ratelimit-remaining-requests": "498",
+    }
+    response.parse.return_value = completion([{"id": 0, "verdict": "trivial"}])
+    scheduler = RequestScheduler(tmp_path / "state.json")
+
+    verdicts = triage_file_patches(
+        openai_client, "gpt-3.5-turbo", [make_file_patch("a.py")], "prompt", scheduler=scheduler
+    )
+    assert verdicts == [TriageVerdict("a.py", False, "")]
+    openai_client.chat.completions.create.assert_not_called()
+    assert '"remaining": 498' in (tmp_path / "state.json").read_text()
+
+
+def test_format_triage():
+    verdicts = [
+        TriageVerdict("a.py", True, "logic change"),
+        TriageVerdict("README.md", False, "typo fix"),
+        TriageVerdict("poetry.lock", False, ""),
+    ]
+    assert format_triage(verdicts) == (
+        "Triage: 1 of 3 files need review, skipped README.md (typo fix), poetry.lock"
+    )
+    assert format_triage(verdicts[:1]) == "Triage: 1 of 1 files need review"